@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+# flake8: noqa: E501
+#
+#   (C) Sebastian Weigmann, 2025
+#   This software is released under:
+#   GNU GENERAL PUBLIC LICENSE, Version 3
+#   Please find the full text in LICENSE.
+#
+# deterministic inputs for the benchmark suite. the same seed and sizes
+# always give the same bytes, so runs on different machines or commits
+# work on identical data.
+#
+# generic imports
+import os
+import sys
+import random
+import argparse
+
+LINESEP = {"unix": b"\n", "windows": b"\r\n", "macos": b"\r"}
+WRITESIZE = 1 << 20
+# hits stay clear of the start of the input, so every hit has its full
+# -B context in lines and blocks
+MIN_OFFSET = 1 << 16
+WORDS = [
+    b"kernel:", b"sshd[2231]:", b"Accepted", b"publickey", b"for", b"root", b"from", b"port",
+    b"CRON[881]:", b"session", b"opened", b"closed", b"user", b"systemd[1]:", b"Started",
+    b"Stopped", b"dhclient:", b"DHCPACK", b"eth0", b"audit:", b"type=1400", b"denied", b"yes",
+    b"0x7ffd3a2c", b"GET", b"/index.html", b"HTTP/1.1", b"200", b"404", b"-", b"Mozilla/5.0",
+]
+
+
+def parse_size(value: str) -> int:
+    units = {"K": 1 << 10, "M": 1 << 20, "G": 1 << 30, "T": 1 << 40}
+    value = value.strip().upper().rstrip("B")
+    if value and value[-1] in units:
+        return int(float(value[:-1]) * units[value[-1]])
+    return int(value)
+
+
+# text log of about size bytes, line lengths (without separator) uniform
+# in [minlen, maxlen]
+def gen_log(path: str, size: int, seed: int = 1, minlen: int = 40, maxlen: int = 200, linesep: str = "unix") -> int:
+    rng = random.Random(seed)
+    sep = LINESEP[linesep]
+    # lines are cut from a long pool of words, so each line is one slice
+    pool = b" ".join(rng.choice(WORDS) for _ in range(1 << 16))
+    written = 0
+    with open(path, "wb") as f:
+        buf = bytearray()
+        while written + len(buf) < size:
+            length = rng.randint(minlen, maxlen)
+            start = rng.randrange(len(pool) - length)
+            buf += pool[start:start + length]
+            buf += sep
+            if len(buf) >= WRITESIZE:
+                f.write(buf)
+                written += len(buf)
+                buf = bytearray()
+        f.write(buf)
+        written += len(buf)
+    return written
+
+
+# random binary image of exactly size bytes
+def gen_image(path: str, size: int, seed: int = 1) -> int:
+    rng = random.Random(seed)
+    with open(path, "wb") as f:
+        left = size
+        while left > 0:
+            n = min(WRITESIZE, left)
+            f.write(rng.randbytes(n))
+            left -= n
+    return size
+
+
+# count hit offsets within [MIN_OFFSET, size), in order of appearance
+# as strings -td would print them, not sorted.
+#   uniform    spread over the whole input
+#   clustered  grouped around clusters random centres, about spread bytes wide
+def gen_offsets(path: str, size: int, count: int, seed: int = 1, distribution: str = "uniform", clusters: int = 64, spread: int = 1 << 16) -> int:
+    rng = random.Random(seed)
+    lo, hi = min(MIN_OFFSET, size - 1), size - 1
+    centres = [rng.randrange(lo, hi) for _ in range(clusters)]
+    with open(path, "w") as f:
+        for _ in range(count):
+            if distribution == "uniform":
+                p = rng.randrange(lo, hi)
+            else:
+                p = int(rng.gauss(rng.choice(centres), spread))
+                p = max(lo, min(hi - 1, p))
+            f.write(f"{p} hit\n")
+    return count
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="generate deterministic benchmark inputs for offset_dump")
+    parser.add_argument("--seed", type=int, default=1, help="random seed (default: %(default)d)")
+    subparsers = parser.add_subparsers(dest="kind", required=True, metavar="kind")
+    p_log = subparsers.add_parser("log", help="text log with lines of random length")
+    p_log.add_argument("--size", type=parse_size, default="64M", help="approximate size, K/M/G suffixes allowed (default: 64M)")
+    p_log.add_argument("--min-line", type=int, default=40, help="shortest line (default: %(default)d)")
+    p_log.add_argument("--max-line", type=int, default=200, help="longest line (default: %(default)d)")
+    p_log.add_argument("--linesep", choices=sorted(LINESEP), default="unix", help="line endings (default: %(default)s)")
+    p_log.add_argument("path")
+    p_image = subparsers.add_parser("image", help="random binary disk image")
+    p_image.add_argument("--size", type=parse_size, default="64M", help="size, K/M/G suffixes allowed (default: 64M)")
+    p_image.add_argument("path")
+    p_offsets = subparsers.add_parser("offsets", help="strings -td style hit list for an input")
+    p_offsets.add_argument("--count", type=int, default=10000, help="number of hits (default: %(default)d)")
+    p_offsets.add_argument("--distribution", choices=["uniform", "clustered"], default="uniform", help="(default: %(default)s)")
+    p_offsets.add_argument("--clusters", type=int, default=64, help="number of clusters (default: %(default)d)")
+    p_offsets.add_argument("--spread", type=parse_size, default="64K", help="width of a cluster (default: 64K)")
+    p_offsets.add_argument("input", help="input the offsets are generated for")
+    p_offsets.add_argument("path")
+    return parser.parse_args()
+
+
+def main() -> None:
+    args = parse_args()
+    if args.kind == "log":
+        n = gen_log(args.path, args.size, args.seed, args.min_line, args.max_line, args.linesep)
+    elif args.kind == "image":
+        n = gen_image(args.path, args.size, args.seed)
+    else:
+        n = gen_offsets(args.path, os.path.getsize(args.input), args.count, args.seed, args.distribution, args.clusters, args.spread)
+    print(f"{args.path}: {n}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
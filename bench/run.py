@@ -0,0 +1,222 @@
+#!/usr/bin/env python3
+# flake8: noqa: E501
+#
+#   (C) Sebastian Weigmann, 2025
+#   This software is released under:
+#   GNU GENERAL PUBLIC LICENSE, Version 3
+#   Please find the full text in LICENSE.
+#
+# benchmark suite for offset_dump. every case runs offset_dump in a child
+# process on generated inputs (see generate.py) and records
+#   wall time, offsets per second, user and system time, peak RSS (rusage)
+#   bytes read and written (/proc/self/io of the child, linux only)
+# memory-mapped input does not show up in the bytes read, only in the
+# major page faults, and only if the input is not in the page cache yet.
+# results are written as one JSON document; --compare prints the ratios
+# against an earlier results file.
+#
+# generic imports
+import os
+import sys
+import json
+import time
+import atexit
+import shutil
+import platform
+import argparse
+import tempfile
+import subprocess
+
+# specific imports
+import generate
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+SRC = os.path.join(os.path.dirname(HERE), "src")
+
+# name: (input, offsets, offset_dump arguments)
+CASES = {
+    "lines": ("log-unix", "uniform", ["lines"]),
+    "lines-windows": ("log-windows", "uniform", ["lines", "--linesep", "windows"]),
+    "lines-macos": ("log-macos", "uniform", ["lines", "--linesep", "macos"]),
+    "lines-nodupes": ("log-unix", "uniform", ["lines", "--nodupes"]),
+    "lines-context": ("log-unix", "uniform", ["lines", "-B", "2", "-A", "2"]),
+    "lines-outdir": ("log-unix", "uniform", ["lines", "--outdir", "{outdir}"]),
+    "blocks": ("image", "uniform", ["blocks"]),
+    "blocks-clustered": ("image", "clustered", ["blocks"]),
+    "blocks-nodupes": ("image", "clustered", ["blocks", "--nodupes"]),
+    "blocks-context": ("image", "uniform", ["blocks", "-B", "2", "-A", "2"]),
+    "blocks-outdir": ("image", "uniform", ["blocks", "--outdir", "{outdir}"]),
+}
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="benchmark offset_dump on generated inputs")
+    parser.add_argument("--workdir", default=os.path.join(tempfile.gettempdir(), "offset-tools-bench"), metavar="DIR", help="generated inputs are kept and reused here (default: %(default)s)")
+    parser.add_argument("--log-size", type=generate.parse_size, default="256M", metavar="SIZE", help="size of the generated logs (default: 256M)")
+    parser.add_argument("--image-size", type=generate.parse_size, default="256M", metavar="SIZE", help="size of the generated image (default: 256M)")
+    parser.add_argument("--hits", type=int, default=100000, metavar="NUM", help="offsets per case (default: %(default)d)")
+    parser.add_argument("--blocksize", type=int, default=512, metavar="BS", help="--blocksize for all cases (default: %(default)d)")
+    parser.add_argument("--seed", type=int, default=1, help="seed for all generators (default: %(default)d)")
+    parser.add_argument("--repeat", type=int, default=3, metavar="NUM", help="runs per case, the fastest one is reported (default: %(default)d)")
+    parser.add_argument("--case", action="append", choices=sorted(CASES), metavar="NAME", help="run only this case, may be repeated (choices: %(choices)s)")
+    parser.add_argument("--extra", default="", metavar="ARGS", help="additional offset_dump arguments for all cases, e.g. \"--jobs 4\"")
+    parser.add_argument("--output", "-o", default=None, metavar="FILE", help="write results to FILE (default: stdout)")
+    parser.add_argument("--compare", default=None, metavar="FILE", help="print ratios against the results in FILE")
+    parser.add_argument("--probe", default=None, help=argparse.SUPPRESS)
+    args, rest = parser.parse_known_args()
+    args.rest = rest[1:] if rest[:1] == ["--"] else rest
+    return args
+
+
+# child side: run offset_dump in this process and leave its io counters
+# in the probe file when it exits
+def probe(path: str, argv: list[str]) -> None:
+    def dump_io() -> None:
+        io = {}
+        try:
+            with open("/proc/self/io") as f:
+                for line in f:
+                    key, value = line.split(":")
+                    io[key] = int(value)
+        except OSError:
+            pass
+        with open(path, "w") as f:
+            json.dump(io, f)
+
+    atexit.register(dump_io)
+    sys.path.insert(0, SRC)
+    from offset_tools import offset_dump
+    sys.argv = ["offset_dump"] + argv
+    if hasattr(offset_dump, "run"):
+        # in this process, not handed to a running offset_dump_server
+        offset_dump.run(argv)
+    else:
+        # revisions before the server read sys.argv in main()
+        offset_dump.main()
+
+
+def prepare(args: argparse.Namespace) -> dict[str, str]:
+    os.makedirs(args.workdir, exist_ok=True)
+    files = {}
+    for linesep in ["unix", "windows", "macos"]:
+        files[f"log-{linesep}"] = os.path.join(args.workdir, f"log-{linesep}-{args.log_size}-{args.seed}.txt")
+    files["image"] = os.path.join(args.workdir, f"image-{args.image_size}-{args.seed}.img")
+    needed = {CASES[case][0] for case in args.case}
+    for name in sorted(needed):
+        path = files[name]
+        if not os.path.exists(path):
+            print(f"generating {path}", file=sys.stderr)
+            if name == "image":
+                generate.gen_image(path, args.image_size, args.seed)
+            else:
+                generate.gen_log(path, args.log_size, args.seed, linesep=name.split("-")[1])
+        for distribution in ["uniform", "clustered"]:
+            offsets = f"{path}.{distribution}-{args.hits}.txt"
+            files[f"{name}:{distribution}"] = offsets
+            if not os.path.exists(offsets):
+                generate.gen_offsets(offsets, os.path.getsize(path), args.hits, args.seed, distribution)
+    return files
+
+
+def run_case(args: argparse.Namespace, case: str, files: dict[str, str]) -> dict:
+    name, distribution, case_args = CASES[case]
+    runs = []
+    for _ in range(args.repeat):
+        outdir = tempfile.mkdtemp(dir=args.workdir, prefix="out-")
+        shutil.rmtree(outdir)
+        iofile = os.path.join(args.workdir, f"io-{os.getpid()}.json")
+        argv = ["strings", case_args[0], "--type", "dec", "--offsetfile", files[f"{name}:{distribution}"], "--infile", files[name], "--blocksize", str(args.blocksize)]
+        argv += [a.format(outdir=outdir) for a in case_args[1:]] + args.extra.split()
+        start = time.perf_counter()
+        with open(os.devnull, "wb") as devnull:
+            p = subprocess.Popen([sys.executable, os.path.abspath(__file__), "--probe", iofile, "--"] + argv, stdout=devnull)
+            _, status, rusage = os.wait4(p.pid, 0)
+            p.returncode = os.waitstatus_to_exitcode(status)
+        wall = time.perf_counter() - start
+        if p.returncode != 0:
+            raise RuntimeError(f"{case}: offset_dump exited with {p.returncode}")
+        with open(iofile) as f:
+            io = json.load(f)
+        os.remove(iofile)
+        shutil.rmtree(outdir, ignore_errors=True)
+        runs.append({
+            "wall_s": wall,
+            "user_s": rusage.ru_utime,
+            "sys_s": rusage.ru_stime,
+            "maxrss_kb": rusage.ru_maxrss,
+            "major_faults": rusage.ru_majflt,
+            "read_bytes": io.get("rchar"),
+            "disk_read_bytes": io.get("read_bytes"),
+            "written_bytes": io.get("wchar"),
+        })
+    best = min(runs, key=lambda r: r["wall_s"])
+    return {
+        "case": case,
+        "args": argv,
+        "input_bytes": os.path.getsize(files[name]),
+        "offsets": args.hits,
+        "offsets_per_s": args.hits / best["wall_s"],
+        **best,
+        "runs": runs,
+    }
+
+
+def meta(args: argparse.Namespace) -> dict:
+    try:
+        rev = subprocess.run(["git", "rev-parse", "HEAD"], cwd=HERE, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        rev = None
+    return {
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "git": rev,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "log_size": args.log_size,
+        "image_size": args.image_size,
+        "hits": args.hits,
+        "blocksize": args.blocksize,
+        "seed": args.seed,
+        "extra": args.extra,
+    }
+
+
+def compare(old: dict, new: dict) -> None:
+    before = {r["case"]: r for r in old["results"]}
+    print(f"{'case':20} {'offsets/s':>12} {'ratio':>7} {'maxrss MB':>10} {'ratio':>7} {'read MB':>10} {'ratio':>7}", file=sys.stderr)
+    for r in new["results"]:
+        o = before.get(r["case"])
+
+        def ratio(key: str) -> str:
+            if o is None or not o.get(key) or r.get(key) is None:
+                return "-"
+            return f"{r[key] / o[key]:.2f}"
+
+        print(f"{r['case']:20} {r['offsets_per_s']:12.0f} {ratio('offsets_per_s'):>7} {r['maxrss_kb'] / 1024:10.1f} {ratio('maxrss_kb'):>7} {(r['read_bytes'] or 0) / 2**20:10.1f} {ratio('read_bytes'):>7}", file=sys.stderr)
+
+
+def main() -> None:
+    args = parse_args()
+    if args.probe is not None:
+        probe(args.probe, args.rest)
+        return
+    args.case = args.case or list(CASES)
+    files = prepare(args)
+    runs: list[dict] = []
+    results = {"meta": meta(args), "results": runs}
+    for case in args.case:
+        print(f"running {case}", file=sys.stderr)
+        runs.append(run_case(args, case, files))
+    if args.output is None:
+        json.dump(results, sys.stdout, indent=2)
+        print()
+    else:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.compare is not None:
+        with open(args.compare) as f:
+            compare(json.load(f), results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,22 @@
+#
+#   (C) Sebastian Weigmann, 2025
+#   This software is released under:
+#   GNU GENERAL PUBLIC LICENSE, Version 3
+#   Please find the full text in LICENSE.
+#
+# public api, see README.md
+# imported on first use, so the offset_dump client starts without them
+import importlib
+
+__all__ = ["extract", "BlockLine", "Patterns"]
+_PUBLIC = {
+    "extract": "offset_tools.api",
+    "BlockLine": "offset_tools.common.blockline",
+    "Patterns": "offset_tools.common.scan",
+}
+
+
+def __getattr__(name: str):
+    if name in _PUBLIC:
+        return getattr(importlib.import_module(_PUBLIC[name]), name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,223 @@
+# flake8: noqa: E501
+#
+#   (C) Sebastian Weigmann, 2025
+#   This software is released under:
+#   GNU GENERAL PUBLIC LICENSE, Version 3
+#   Please find the full text in LICENSE.
+#
+# library interface of offset-tools, offset_dump is a thin CLI on top.
+#
+# generic imports
+import typing
+import os
+import mmap
+
+# specific imports
+try:
+    from common import errors as ERR
+    from common import blockline
+    from common import sources
+    from common import compressed
+    from common import offsets as OFS
+    from common import dedup
+    from common import stats as STATS
+    from common import scan as SCAN
+    from common import cache
+except ModuleNotFoundError:
+    from offset_tools.common import errors as ERR
+    from offset_tools.common import blockline
+    from offset_tools.common import sources
+    from offset_tools.common import compressed
+    from offset_tools.common import offsets as OFS
+    from offset_tools.common import dedup
+    from offset_tools.common import stats as STATS
+    from offset_tools.common import scan as SCAN
+    from offset_tools.common import cache
+
+Result = typing.Tuple[int, typing.Tuple[int, int], bytes | sources.SpanData]
+BUFFERS = (bytes, bytearray, memoryview, mmap.mmap)
+# set by a long running process (see server.py): inputs given by path are
+# opened through it and stay open for later calls
+input_cache: cache.SourceCache | None = None
+
+
+def _has_fd(filehandle: typing.Any) -> bool:
+    try:
+        filehandle.fileno()
+        return True
+    except (OSError, AttributeError):
+        return False
+
+
+def extract(
+    source: typing.Any,
+    offsets: typing.Iterable[int] | SCAN.Patterns,
+    mode: str = "lines",
+    before: int = 0,
+    after: int = 0,
+    blocksize: int = 512,
+    linesep: str = "unix",
+    *,
+    linebuf: int = 1 << 16,
+    readahead: int = 16,
+    zero_copy: int = 0,
+    nodupes: bool = False,
+    digest: str = "sha256",
+    dedup_store: str | None = None,
+    dups: dedup.Dedup | None = None,
+    merge: bool = False,
+    jobs: int = 1,
+    queue_depth: int | None = None,
+    use_mmap: bool = True,
+    index: bool = False,
+    index_dir: str | None = None,
+    decompress: bool = False,
+    segmented: bool = False,
+    presorted: bool = False,
+    window: int = 0,
+    offset_memory: int = 256 << 20,
+    resume_from: int = 0,
+    stats: STATS.Stats | None = None,
+) -> typing.Iterator[Result]:
+    """Extract the lines or blocks around offsets of an input.
+
+    Yields ``(offset, (start, length), data)`` for every offset in
+    ascending order, ``data`` being the bytes of the span. Equal spans of
+    neighbouring offsets are read once.
+
+    source      path, binary file handle (closed by the caller), bytes-like
+                buffer such as bytes, bytearray, memoryview or mmap, or an
+                offset_tools.common.sources.Source
+    offsets     iterable of ints. they are sorted and duplicates dropped
+                unless presorted is true, sorting spills to disk beyond
+                offset_memory bytes. or offset_tools.Patterns: the offsets
+                are the matches of the patterns, found while extracting in
+                the same pass over the input.
+    mode        "lines": the line(s) holding the offset, linesep is one of
+                "unix", "windows", "macos"; "blocks": the blocksize block(s)
+    before      lines or blocks of context before the matching one
+    after       lines or blocks of context after the matching one
+
+    The keyword options match the offset_dump options of the same name:
+    linebuf is the first read size when looking for line ends, readahead
+    the number of offsets whose windows are announced to the kernel ahead
+    of time (not while streaming or scanning, see below), zero_copy > 0
+    yields results of at least that many bytes as
+    offset_tools.common.sources.SpanData instead of bytes, to be copied
+    with chunks() or kernel_span() while iterating, nodupes,
+    digest and dedup_store drop results with equal content (or dups, an
+    open offset_tools.common.dedup.Dedup kept by the caller, e.g. across
+    calls; it is not closed here), merge yields
+    one result per run of touching blocks, jobs > 1 reads offset ranges in
+    parallel threads, index / index_dir keep a line index,
+    decompress reads gzip, bzip2 and xz inputs, segmented reads a path to
+    the first segment of a split image with all following segments.
+    stats is an offset_tools.common.stats.Stats collecting counters.
+    resume_from > 0 leaves out offsets below it, with Patterns the scan
+    starts there, e.g. to continue an interrupted run.
+
+    window > 0 extracts while offsets are still arriving, e.g. from a pipe:
+    instead of sorting all offsets first, they are reordered in a window of
+    that many offsets. offsets arriving too late for the window are
+    extracted after all others, see offset_tools.common.offsets.StreamWindow.
+
+    Errors in the arguments raise right away, errors of the input while
+    iterating.
+    """
+    if ERR.verbosity > ERR.ERRLVL.INFNT:
+        # library use without a CLI: warnings only
+        ERR.verbosity = ERR.ERRLVL.WARN
+    if merge and mode != "blocks":
+        raise ValueError("merge works on blocks only")
+    if segmented and not isinstance(source, (str, os.PathLike)):
+        raise ValueError("segmented needs the path of the first segment")
+    if window > 0 or isinstance(offsets, SCAN.Patterns):
+        # holding offsets back for readahead would only delay them
+        readahead = 0
+    bl = blockline.BlockLine(datatype=mode, before=before, after=after, blocksize=blocksize, linesep=linesep, linebuf=linebuf, readahead=readahead, zero_copy=zero_copy, no_mmap=not use_mmap,
+                             index=index, index_dir=index_dir, decompress=decompress, segmented=segmented)
+    bl.stats = stats
+    owned_dups = dups is None and nodupes
+    if owned_dups:
+        dups = dedup.Dedup(digest, dedup_store)
+    return _extract(bl, source, offsets, dups, owned_dups, merge, jobs, queue_depth, presorted, window, offset_memory, resume_from, stats)
+
+
+def _extract(bl: blockline.BlockLine, source: typing.Any, offsets: typing.Iterable[int] | SCAN.Patterns, dups: dedup.Dedup | None, owned_dups: bool, merge: bool, jobs: int,
+             queue_depth: int | None, presorted: bool, window: int, offset_memory: int, resume_from: int, stats: STATS.Stats | None) -> typing.Iterator[Result]:
+    filehandle = None
+    cached = None
+    owned: list[typing.Any] = []
+    target: typing.Any = source
+    try:
+        if isinstance(source, (str, os.PathLike)) and input_cache is not None:
+            cached = target = input_cache.acquire(bl, os.fspath(source))
+            if stats is not None:
+                target = stats.source(target)
+        elif isinstance(source, (str, os.PathLike)):
+            filehandle = open(source, "rb")
+            target = filehandle
+        elif isinstance(source, (sources.Source, *BUFFERS)):
+            if isinstance(source, BUFFERS):
+                target = sources.BufferSource(source)
+                owned.append(target)
+            if bl.decompress:
+                target = compressed.wrap_source(target, bl.index_dir)
+            if stats is not None:
+                target = stats.source(target)
+        streamed = None
+        if isinstance(offsets, SCAN.Patterns):
+            # matches are ascending, scanning and extraction share the source
+            if not isinstance(target, sources.Source):
+                target = bl.open_source(target)
+                owned.append(target)
+            offsets = offsets.finditer(target, start=resume_from)
+        else:
+            if resume_from > 0:
+                offsets = (p for p in offsets if p >= resume_from)
+            if window > 0:
+                streamed = OFS.StreamWindow(offsets, window, offset_memory)
+                owned.append(streamed)
+                offsets = streamed
+            elif not presorted:
+                sorter = OFS.sorted_offsets(offsets, offset_memory)
+                owned.append(sorter)
+                offsets = sorter
+        skip = dups.seen_span if dups else None
+        seen_data = dups.seen_data if dups else None
+        if stats is not None and dups:
+            skip = stats.timed_call("dedup", dups.seen_span, "dup_spans")
+            seen_data = stats.timed_call("dedup", dups.seen_data, "dup_data")
+        results: typing.Iterable[Result]
+        if merge:
+            results = bl.sweep_extents(target, offsets, skip)
+        elif jobs > 1 and (isinstance(target, sources.Source) or _has_fd(target)):
+            # positional reads, the workers share no file offset
+            if not isinstance(target, sources.Source):
+                target = bl.open_source(target, use_mmap=False)
+                owned.append(target)
+            # small chunks while streaming, workers should not wait for offsets
+            chunksize = 64 if streamed else 1024
+            results = blockline.parallel_sweep(bl, target, offsets, jobs, queue_depth or 2 * jobs, skip, chunksize, stats)
+        else:
+            results = bl.sweep(target, offsets, skip)
+        if stats is not None:
+            results = stats.timed_iter("extract", results, "results")
+        # dup removal before further processing: equal spans are skipped
+        # before reading, equal contents are caught by their digest
+        for result in results:
+            if seen_data and seen_data(result[2]):
+                continue
+            yield result
+        if streamed and streamed.nlate:
+            ERR.printmsg(f"{streamed.nlate} offsets arrived too late for the reorder window and were extracted last, consider a larger window", ERR.ERRLVL.WARN)
+    finally:
+        bl.close()
+        for obj in reversed(owned):
+            obj.close()
+        if dups and owned_dups:
+            dups.close()
+        if filehandle is not None:
+            filehandle.close()
+        if cached is not None and input_cache is not None:
+            input_cache.release(cached)
@@ -0,0 +1,113 @@
+# flake8: noqa: E501
+#
+#   (C) Sebastian Weigmann, 2025
+#   This software is released under:
+#   GNU GENERAL PUBLIC LICENSE, Version 3
+#   Please find the full text in LICENSE.
+#
+# thin client of offset_dump: if a server (see server.py) listens on the
+# socket, the command line, working directory, stdin, stdout and stderr
+# are handed over to it and its exit code is returned. nothing of
+# offset_dump itself is imported for that. without a server, offset_dump
+# runs in this process. stdio is only handed to a socket and a server of
+# the same user.
+#
+# generic imports
+import os
+import sys
+import stat
+import json
+import socket
+import struct
+
+# specific imports
+try:
+    from common import errors as ERR
+except ModuleNotFoundError:
+    from offset_tools.common import errors as ERR
+
+# request: length of the json message, then the message {"argv", "cwd"},
+# sent along with the file descriptors 0, 1 and 2. reply: the exit code.
+REQUEST = struct.Struct("<I")
+REPLY = struct.Struct("<i")
+
+
+# directory of the socket if $XDG_RUNTIME_DIR is not set, created by the
+# server with no access for others
+def private_dir() -> str:
+    return os.path.join(os.environ.get("TMPDIR") or "/tmp", f"offset_dump-{os.getuid()}")
+
+
+def socket_path() -> str:
+    path = os.environ.get("OFFSET_DUMP_SOCKET")
+    if path:
+        return path
+    runtime = os.environ.get("XDG_RUNTIME_DIR")
+    if runtime:
+        return os.path.join(runtime, f"offset_dump-{os.getuid()}.sock")
+    return os.path.join(private_dir(), "offset_dump.sock")
+
+
+# whether path is a socket, or a directory without access for group and
+# others, owned by this user. symlinks are not followed.
+def owned(path: str, directory: bool = False) -> bool:
+    try:
+        st = os.lstat(path)
+    except OSError:
+        return False
+    if st.st_uid != os.getuid():
+        return False
+    if directory:
+        return stat.S_ISDIR(st.st_mode) and not st.st_mode & 0o077
+    return stat.S_ISSOCK(st.st_mode)
+
+
+# uid of the process at the other end of a connected unix socket
+def peer_uid(sock: socket.socket) -> int:
+    creds = sock.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED, struct.calcsize("3i"))
+    _, uid, _ = struct.unpack("3i", creds)
+    return uid
+
+
+# exit code of argv run by the server, None if no server of this user is running
+def run(argv: list[str]) -> int | None:
+    path = socket_path()
+    if not os.path.lexists(path):
+        return None
+    folder = os.path.dirname(path)
+    if not owned(path) or (folder == private_dir() and not owned(folder, directory=True)):
+        print(f"WARNING:  {path} is not a socket of this user, running without the server", file=sys.stderr)
+        return None
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+    except OSError:
+        # a stale socket of a server which is gone
+        sock.close()
+        return None
+    with sock:
+        if peer_uid(sock) != os.getuid():
+            print(f"WARNING:  the server at {path} runs as another user, running without the server", file=sys.stderr)
+            return None
+        msg = json.dumps({"argv": argv, "cwd": os.getcwd()}).encode("utf-8")
+        socket.send_fds(sock, [REQUEST.pack(len(msg)) + msg], [0, 1, 2])
+        reply = b""
+        while len(reply) < REPLY.size:
+            buf = sock.recv(REPLY.size - len(reply))
+            if not buf:
+                # output may be written already, running again would repeat it
+                print(f"CRITICAL: the server at {path} closed the connection", file=sys.stderr)
+                return ERR.EXIT.GENERIC
+            reply += buf
+    return REPLY.unpack(reply)[0]
+
+
+def main() -> None:
+    code = run(sys.argv[1:])
+    if code is None:
+        try:
+            import offset_dump
+        except ModuleNotFoundError:
+            from offset_tools import offset_dump
+        offset_dump.run()
+    sys.exit(code)
@@ -9,12 +9,25 @@
 import typing
 import os
 import argparse
+import bisect
+import itertools
+import threading
+import collections
+import concurrent.futures
 
 # specific imports
 try:
     from common import mytypes as T
+    from common import errors as ERR
+    from common import sources
+    from common import lineindex
+    from common import compressed
 except ModuleNotFoundError:
     from offset_tools.common import mytypes as T
+    from offset_tools.common import errors as ERR
+    from offset_tools.common import sources
+    from offset_tools.common import lineindex
+    from offset_tools.common import compressed
 
 # common parsing module for all offset tools
 # to be included by CLI programs line this:
@@ -22,84 +35,476 @@ except ModuleNotFoundError:
 parser = argparse.ArgumentParser(add_help=False)
 parser.add_argument("--before", "-B", type=int, default=0, metavar="NUM", help="print NUM units before matching block/line")
 parser.add_argument("--after", "-A", type=int, default=0, metavar="NUM", help="print NUM units after matching block/line")
-parser.add_argument("--blocksize", "-s", type=int, default=512, metavar="BS", help="block size for block mode, buffer size for line mode (default: %(default)d)")
+parser.add_argument("--blocksize", "-s", type=int, default=512, metavar="BS", help="block size for block mode (default: %(default)d)")
+parser.add_argument("--linebuf", type=int, default=1 << 16, metavar="BYTES", help="first read size when looking for line ends in line mode, doubled while lines turn out longer (default: %(default)d)")
 parser.add_argument("--linesep", "-d", choices=["unix", "windows", "macos"], default="unix", help="line endings for a text file to dump lines from (default: %(default)s)")
+parser.add_argument("--no-mmap", action="store_true", help="read input through a file handle instead of memory-mapping it")
+parser.add_argument("--index", action="store_true", help="keep a persistent line index next to the input file and reuse it in later runs")
+parser.add_argument("--index-dir", default=None, metavar="DIR", help="store line indexes in DIR instead of next to the input (implies --index)")
+parser.add_argument("--decompress", action="store_true", help="input is gzip, bzip2 or xz compressed, offsets refer to the uncompressed data. a checkpoint index is kept like a line index")
+parser.add_argument("--segmented", action="store_true", help="input is the first segment of a split image (disk.001), all following segments are read as one input")
+parser.add_argument("--readahead", type=int, default=16, metavar="NUM", help="ask the kernel to read the windows of the next NUM offsets ahead of time, 0 disables it (default: %(default)d)")
+parser.add_argument("--zero-copy", type=int, default=1 << 20, metavar="BYTES", help="results of at least BYTES are not read into memory but copied to the output in chunks or by the kernel, 0 disables it (default: %(default)d)")
+parser.add_argument("--merge", action="store_true", help="blocks only: write one result per run of overlapping or adjacent blocks instead of one per offset")
 parser.add_argument("datatype", choices=["lines", "blocks"], metavar="datatype", help="state if input is parsed as lines or blocks (choices: %(choices)s)")
 
+# upper bound for one coalesced read in block mode
+MAX_EXTENT = 1 << 26
+# upper bound for one readahead hint
+MAX_HINT = 1 << 20
 
-class BlockLine(object):
-    def __init__(self, args):
-        self.args = args
-        self.bufsize = args.blocksize
-        self.linesep = T.LINESEP.get(args.linesep)
 
-    def __reverse_find(self, filehandle: typing.BinaryIO, position: int, substring: bytes) -> int:
-        p = position
-        f = filehandle
-        s = substring
-        idx = 0
-        while True:
-            sz = min(self.bufsize, p)
-            p -= sz
-            f.seek(p)
-            buf = f.read(sz)
-            try:
-                idx = buf.rindex(s) + p
-                f.seek(idx)
+# remembers every separator within one contiguous region [lo, hi) of the
+# input. sorted offsets mostly hit the region or land just behind it, so
+# the region is grown sequentially and boundaries found for one offset are
+# reused for the next ones. far jumps start a new region at the target.
+# the region grows by step bytes at a time, starting at chunksize
+# (--linebuf). whenever one lookup needs another read, lines are longer
+# than step and step is doubled up to maxstep. at least keep separators
+# are kept when the region is trimmed, enough for the -B/-A context.
+class SepCache(object):
+    maxseps = 1 << 14
+    maxstep = 1 << 26
+
+    def __init__(self, source: sources.Source, substring: bytes, chunksize: int = 1 << 16, keep: int = 0):
+        self.source = source
+        self.substring = substring
+        self.step = max(chunksize, len(substring))
+        self.maxseps = max(self.maxseps, keep)
+        self.lo = 0
+        self.hi = 0
+        self.seps: list[int] = []
+
+    def __reset(self, position: int) -> None:
+        self.lo = self.hi = position
+        self.seps = []
+
+    # holes of sparse inputs hold no separators and are not read
+    def __scan(self, start: int, end: int) -> list[int]:
+        s = self.substring
+        found = []
+        for ext_start, ext_end in self.source.data_extents(start, end):
+            buf = self.source.read(ext_start, ext_end - ext_start)
+            idx = buf.find(s)
+            while idx >= 0:
+                found.append(idx + ext_start)
+                idx = buf.find(s, idx + len(s))
+        return found
+
+    def __extend_forward(self, end: int) -> None:
+        end = min(max(end, self.hi + self.step), self.source.size)
+        # separators straddling the old upper border were not recorded yet
+        start = max(self.lo, self.hi - len(self.substring) + 1)
+        self.seps.extend(p for p in self.__scan(start, end) if p >= start)
+        self.hi = end
+
+    def __extend_backward(self) -> None:
+        start = max(0, self.lo - self.step)
+        end = min(self.lo + len(self.substring) - 1, self.hi)
+        self.seps[:0] = [p for p in self.__scan(start, end) if p < self.lo]
+        self.lo = start
+
+    def __grow(self) -> None:
+        self.step = min(self.step * 2, self.maxstep)
+
+    def __trim(self) -> None:
+        if len(self.seps) > self.maxseps:
+            del self.seps[:len(self.seps) // 2]
+            self.lo = self.seps[0]
+
+    # same result as source.rfind(substring, position), repeated count
+    # times from the separator found - 1 on. -1 if there are fewer.
+    def rfind(self, position: int, count: int = 1) -> int:
+        sources.Source._check_position(position)
+        position = min(position, self.source.size)
+        if position < self.lo or position > self.hi + self.step:
+            self.__reset(position)
+        elif position > self.hi:
+            self.__extend_forward(position)
+        idx = -1
+        extended = False
+        for _ in range(count):
+            if position < 0:
+                idx = -1
                 break
-            except ValueError:
-                pass
-            if p == 0:
+            while True:
+                i = bisect.bisect_right(self.seps, position - len(self.substring))
+                if i > 0:
+                    idx = self.seps[i - 1]
+                    break
+                if self.lo == 0:
+                    idx = -1
+                    break
+                if extended:
+                    self.__grow()
+                self.__extend_backward()
+                extended = True
+            if idx < 0:
                 break
-        f.seek(position)
+            position = idx - 1
+        self.__trim()
         return idx
 
-    def __forward_find(self, filehandle: typing.BinaryIO, position: int, substring: bytes) -> int:
-        p = position
-        f = filehandle
-        s = substring
-        idx = 0
-        f.seek(0, os.SEEK_END)
-        idx_max = f.tell()
-        while True:
-            sz = min(self.bufsize, idx_max - p)
-            f.seek(p)
-            buf = f.read(sz)
-            try:
-                idx = buf.index(s) + p
-                break
-            except ValueError:
-                p += sz
-            if p >= idx_max:
+    # same result as source.find(substring, position), repeated count
+    # times from the separator found + 1 on. -1 if there are fewer.
+    def find(self, position: int, count: int = 1) -> int:
+        sources.Source._check_position(position)
+        if position >= self.source.size:
+            return -1
+        if position < self.lo or position > self.hi + self.step:
+            self.__reset(position)
+        idx = -1
+        extended = False
+        for _ in range(count):
+            while True:
+                i = bisect.bisect_left(self.seps, position)
+                if i < len(self.seps):
+                    idx = self.seps[i]
+                    break
+                if self.hi >= self.source.size:
+                    idx = -1
+                    break
+                if extended:
+                    self.__grow()
+                self.__extend_forward(position)
+                extended = True
+            if idx < 0:
                 break
+            position = idx + 1
+        self.__trim()
         return idx
 
-    def dump_line(self, filehandle: typing.BinaryIO, position: int, substring: bytes) -> bytes:
+
+# options of BlockLine and their defaults, named like the arguments of parser
+OPTIONS: dict[str, typing.Any] = {
+    "datatype": "lines",
+    "before": 0,
+    "after": 0,
+    "blocksize": 512,
+    "linebuf": 1 << 16,
+    "linesep": "unix",
+    "no_mmap": False,
+    "index": False,
+    "index_dir": None,
+    "decompress": False,
+    "segmented": False,
+    "readahead": 16,
+    "zero_copy": 0,
+}
+
+
+# options are taken from an argparse namespace of parser (CLI), from
+# keywords (library use, see api.extract) or both, keywords win.
+class BlockLine(object):
+    def __init__(self, args: argparse.Namespace | None = None, **options: typing.Any):
+        unknown = set(options) - set(OPTIONS)
+        if unknown:
+            raise TypeError(f"unknown BlockLine options: {', '.join(sorted(unknown))}")
+        self.options = dict(OPTIONS)
+        if args is not None:
+            self.options.update({k: getattr(args, k) for k in OPTIONS if hasattr(args, k)})
+        self.options.update(options)
+        if self.options["datatype"] not in ("lines", "blocks"):
+            raise ValueError(f"Undefined datatype: {self.options['datatype']}")
+        self.datatype = self.options["datatype"]
+        self.before = self.options["before"]
+        self.after = self.options["after"]
+        self.bufsize = self.options["blocksize"]
+        self.linebuf = self.options["linebuf"]
+        self.linesep = T.LINESEP[self.options["linesep"]]
+        self.use_mmap = not self.options["no_mmap"]
+        self.index_dir = self.options["index_dir"]
+        self.use_index = self.options["index"] or self.index_dir is not None
+        self.decompress = self.options["decompress"]
+        self.segmented = self.options["segmented"]
+        self.readahead = self.options["readahead"]
+        self.zero_copy = self.options["zero_copy"]
+        # set by callers for --stats
+        self.stats: typing.Any = None
+        self.max_extent = max(MAX_EXTENT, self.bufsize * (1 + self.before + self.after))
+        self.__filehandle: typing.BinaryIO | None = None
+        self.__source: sources.Source | None = None
+        self.__seps: SepCache | lineindex.LineIndex | None = None
+        self.__last_span = (-1, -1)
+        self.__last_data: bytes | sources.SpanData = b""
+
+    # a new source for filehandle as selected by --decompress / --segmented
+    def open_source(self, filehandle: typing.BinaryIO, use_mmap: bool | None = None) -> sources.Source:
+        use_mmap = self.use_mmap if use_mmap is None else use_mmap
+        bufsize = self.linebuf if self.datatype == "lines" else self.bufsize
+        src: sources.Source
+        if self.segmented:
+            src = sources.SegmentedSource(sources.segment_paths(filehandle.name), bufsize, use_mmap)
+        elif self.decompress:
+            src = compressed.open_source(filehandle, bufsize, use_mmap, self.index_dir)
+        else:
+            src = sources.open_source(filehandle, bufsize, use_mmap)
+        return src if self.stats is None else self.stats.source(src)
+
+    # callers may pass a plain file handle or an already opened source.
+    # file handles are wrapped once and the source is kept for reuse.
+    def source(self, filehandle: typing.BinaryIO | sources.Source) -> sources.Source:
+        if isinstance(filehandle, sources.Source):
+            return filehandle
+        if self.__source is None or self.__filehandle is not filehandle:
+            self.close()
+            self.__source = self.open_source(filehandle)
+            self.__filehandle = filehandle
+        return self.__source
+
+    def close(self) -> None:
+        if isinstance(self.__seps, lineindex.LineIndex):
+            self.__seps.close()
+        if self.__source is not None:
+            self.__source.close()
+        self.__source = None
+        self.__filehandle = None
+        self.__seps = None
+        self.__last_span = (-1, -1)
+
+    def __sepcache(self, source: sources.Source, substring: bytes) -> SepCache | lineindex.LineIndex:
+        if self.__seps is None or self.__seps.source is not source or self.__seps.substring != substring:
+            if isinstance(self.__seps, lineindex.LineIndex):
+                self.__seps.close()
+            self.__seps = None
+            if self.use_index:
+                if source.name is not None and os.path.isfile(source.name):
+                    self.__seps = lineindex.LineIndex(source, substring, source.name, self.index_dir)
+                else:
+                    ERR.printmsg(f"cannot index {source.name}, it is not a regular file", ERR.ERRLVL.WARN)
+            if self.__seps is None:
+                self.__seps = SepCache(source, substring, self.linebuf, 4 * (self.before + self.after + 2))
+            self.__last_span = (-1, -1)
+        return self.__seps
+
+    # count-th separator before position, 0 if there are fewer
+    def __reverse_find(self, source: sources.Source, position: int, substring: bytes, count: int = 1) -> int:
+        if self.stats is not None:
+            self.stats.count("line_lookups")
+        idx = self.__sepcache(source, substring).rfind(position, count)
+        return idx if idx >= 0 else 0
+
+    # count-th separator from position on, the end of the input if there are fewer
+    def __forward_find(self, source: sources.Source, position: int, substring: bytes, count: int = 1) -> int:
+        if self.stats is not None:
+            self.stats.count("line_lookups")
+        idx = self.__sepcache(source, substring).find(position, count)
+        return idx if idx >= 0 else max(0, source.size - len(substring))
+
+    # (start, length) of the line(s) around position. all separators for
+    # -B are found in one backward lookup, those for -A in one forward lookup.
+    def line_span(self, filehandle: typing.BinaryIO | sources.Source, position: int, substring: bytes) -> tuple[int, int]:
         p = position
-        f = filehandle
+        src = self.source(filehandle)
         s = substring
-        b = self.args.before
-        a = self.args.after
-        idx_linestart = self.__reverse_find(f, p, s)
-        while b > 0:
-            idx_linestart = self.__reverse_find(f, idx_linestart - 1, s)
-            b -= 1
-        f.seek(p)
-        idx_lineend = self.__forward_find(f, p, s)
-        while a > 0:
-            idx_lineend = self.__forward_find(f, idx_lineend + 1, s)
-            a -= 1
-        f.seek(idx_linestart + len(s))
-        line = f.read(idx_lineend - idx_linestart)
-        return line
-
-    def dump_block(self, filehandle: typing.BinaryIO, position: int) -> bytes:
+        idx_linestart = self.__reverse_find(src, p, s, self.before + 1)
+        idx_lineend = self.__forward_find(src, p, s, self.after + 1)
+        return idx_linestart + len(s), idx_lineend - idx_linestart
+
+    # (start, length) of the block(s) around position
+    def block_span(self, position: int) -> tuple[int, int]:
         p = position
-        f = filehandle
-        b = self.args.before
-        a = self.args.after
+        b = self.before
+        a = self.after
         idx_blockstart = ((p // self.bufsize) * self.bufsize) - (b * self.bufsize)
-        f.seek(idx_blockstart)
         bytes_to_read = self.bufsize + (b * self.bufsize) + (a * self.bufsize)
-        block = f.read(bytes_to_read)
-        return block
+        return idx_blockstart, bytes_to_read
+
+    # spans of at least zero_copy bytes are not read here, see sources.SpanData
+    def read_span(self, filehandle: typing.BinaryIO | sources.Source, span: tuple[int, int]) -> bytes | sources.SpanData:
+        if span != self.__last_span:
+            # hits within the same line(s) or block(s) get the bytes read before
+            self.__last_data = self.__read(self.source(filehandle), *span)
+            self.__last_span = span
+        return self.__last_data
+
+    def __read(self, src: sources.Source, start: int, length: int) -> bytes | sources.SpanData:
+        if 0 < self.zero_copy <= length:
+            return sources.SpanData(src, start, length)
+        return src.read(start, length)
+
+    def dump_line(self, filehandle: typing.BinaryIO | sources.Source, position: int, substring: bytes) -> bytes | sources.SpanData:
+        return self.read_span(filehandle, self.line_span(filehandle, position, substring))
+
+    def dump_block(self, filehandle: typing.BinaryIO | sources.Source, position: int) -> bytes | sources.SpanData:
+        return self.read_span(filehandle, self.block_span(position))
+
+    # hands offsets on unchanged, readahead offsets behind. the windows of
+    # the offsets ahead are announced to the source (willneed) as they
+    # come in, overlapping windows as one range. offsets ahead lying close
+    # together switch the source to sequential access, else to random.
+    def __readahead(self, src: sources.Source, offsets: typing.Iterable[int]) -> typing.Iterator[int]:
+        if self.datatype == "lines":
+            window = self.linebuf
+        else:
+            window = self.bufsize * (1 + self.before + self.after)
+        ahead: collections.deque = collections.deque()
+        hint_start = hint_end = -1
+        pattern = None
+        for p in offsets:
+            if self.datatype == "lines":
+                start, end = max(0, p - window), p + window
+            else:
+                start = max(0, self.block_span(p)[0])
+                end = start + window
+            if start > hint_end or hint_end - hint_start > MAX_HINT:
+                if hint_end > hint_start:
+                    src.advise(hint_start, hint_end - hint_start, "willneed")
+                hint_start = start
+            hint_end = max(hint_end, end)
+            ahead.append(p)
+            if len(ahead) > self.readahead:
+                dense = ahead[-1] - ahead[0] <= 2 * window * len(ahead)
+                if pattern != dense:
+                    src.advise(0, 0, "sequential" if dense else "random")
+                    pattern = dense
+                yield ahead.popleft()
+        if hint_end > hint_start:
+            src.advise(hint_start, hint_end - hint_start, "willneed")
+        yield from ahead
+
+    # single pass over sorted offsets, yields (offset, span, data) tuples.
+    # line boundaries found for one offset are kept for the next ones.
+    # spans for which skip(span) is true are not read and not yielded.
+    # blocks are read per extent, see plan_extents().
+    def sweep(self, filehandle: typing.BinaryIO | sources.Source, offsets: typing.Iterable[int], skip: typing.Callable[[tuple[int, int]], bool] | None = None) -> typing.Iterator[tuple[int, tuple[int, int], bytes | sources.SpanData]]:
+        src = self.source(filehandle)
+        if self.readahead > 0:
+            offsets = self.__readahead(src, offsets)
+        if self.datatype == "blocks" and 0 < self.zero_copy <= self.bufsize * (1 + self.before + self.after):
+            # windows too large to be held in memory are not coalesced
+            for p in offsets:
+                span = self.block_span(p)
+                if skip is None or not skip(span):
+                    yield p, span, self.read_span(src, span)
+            return
+        if self.datatype == "blocks":
+            for extent in self.plan_extents(offsets, skip):
+                if extent[0][1][0] < 0:
+                    # invalid block position, fail the same way a single read does
+                    for p, span in extent:
+                        yield p, span, self.read_span(src, span)
+                    continue
+                (ext_start, ext_length), data = self.read_extent(src, extent, pieces=True)
+                for p, (start, length) in extent:
+                    yield p, (start, length), data[start - ext_start:start - ext_start + length]
+            return
+        for p in offsets:
+            span = self.line_span(src, p, self.linesep)
+            if skip is not None and skip(span):
+                continue
+            yield p, span, self.read_span(src, span)
+
+    # group the block windows of sorted offsets into extents: windows which
+    # overlap or touch end up in the same extent, so reading all extents
+    # never reads more than the union of the windows. yields lists of
+    # (offset, span), spans for which skip(span) is true are left out.
+    # an offset smaller than its predecessor (a second ascending run of
+    # --stream) starts a new extent.
+    def plan_extents(self, offsets: typing.Iterable[int], skip: typing.Callable[[tuple[int, int]], bool] | None = None) -> typing.Iterator[list[tuple[int, tuple[int, int]]]]:
+        extent: list[tuple[int, tuple[int, int]]] = []
+        ext_start = ext_end = 0
+        for p in offsets:
+            span = self.block_span(p)
+            if skip is not None and skip(span):
+                continue
+            start, length = span
+            end = start + length
+            if extent and 0 <= ext_start <= start <= ext_end and max(end, ext_end) - ext_start <= self.max_extent:
+                extent.append((p, span))
+                ext_end = max(end, ext_end)
+            else:
+                if extent:
+                    yield extent
+                extent = [(p, span)]
+                ext_start, ext_end = start, end
+        if extent:
+            yield extent
+
+    # span and data of an extent. with pieces, the data is cut into the
+    # windows of its offsets, each smaller than zero_copy: it is read as
+    # bytes however large the extent is (at most max_extent).
+    def read_extent(self, filehandle: typing.BinaryIO | sources.Source, extent: list[tuple[int, tuple[int, int]]], pieces: bool = False) -> tuple[tuple[int, int], bytes | sources.SpanData]:
+        ext_start = extent[0][1][0]
+        ext_end = max(start + length for _, (start, length) in extent)
+        src = self.source(filehandle)
+        if pieces:
+            return (ext_start, ext_end - ext_start), src.read(ext_start, ext_end - ext_start)
+        return (ext_start, ext_end - ext_start), self.__read(src, ext_start, ext_end - ext_start)
+
+    # one (first offset, extent span, data) tuple per extent, for --merge
+    def sweep_extents(self, filehandle: typing.BinaryIO | sources.Source, offsets: typing.Iterable[int], skip: typing.Callable[[tuple[int, int]], bool] | None = None) -> typing.Iterator[tuple[int, tuple[int, int], bytes | sources.SpanData]]:
+        src = self.source(filehandle)
+        if self.readahead > 0:
+            offsets = self.__readahead(src, offsets)
+        for extent in self.plan_extents(offsets, skip):
+            span, data = self.read_extent(src, extent)
+            yield extent[0][0], span, data
+
+    # set up everything that must not be built concurrently, i.e. the line index
+    def prepare(self, filehandle: typing.BinaryIO | sources.Source) -> None:
+        if self.datatype == "lines":
+            self.__sepcache(self.source(filehandle), self.linesep)
+
+
+# range partitioned sweep: sorted offsets are cut into contiguous chunks
+# which a pool of threads resolves and reads, every thread with its own
+# BlockLine (options as in template) on the shared (pread or mmap based) source. results come back
+# in offset order. with skip, each worker only drops spans equal to the
+# previous one in its chunk, skip itself is applied here in order, so
+# dedup gives exactly the single threaded result.
+def parallel_sweep(template: BlockLine, source: sources.Source, offsets: typing.Iterable[int], jobs: int, depth: int, skip: typing.Callable[[tuple[int, int]], bool] | None = None, chunksize: int = 1024, stats: typing.Any = None) -> typing.Iterator[tuple[int, tuple[int, int], bytes | sources.SpanData]]:
+    local = threading.local()
+    blocklines: list[BlockLine] = []
+
+    # returns the results up to a failing offset along with the exception,
+    # so output stops at the same offset as in a single threaded run
+    def work(chunk: list[int]) -> tuple[list[tuple[int, tuple[int, int], bytes | sources.SpanData]], Exception | None]:
+        if not hasattr(local, "blockline"):
+            local.blockline = BlockLine(**template.options)
+            local.blockline.stats = stats
+            blocklines.append(local.blockline)
+        last: tuple[int, int] | None = None
+
+        def adjacent(span: tuple[int, int]) -> bool:
+            nonlocal last
+            if span == last:
+                if stats is not None:
+                    stats.count("dup_spans")
+                return True
+            last = span
+            return False
+
+        results: list[tuple[int, tuple[int, int], bytes | sources.SpanData]] = []
+        try:
+            for result in local.blockline.sweep(source, chunk, adjacent if skip is not None else None):
+                results.append(result)
+        except Exception as excpt:
+            return results, excpt
+        return results, None
+
+    primer = BlockLine(**template.options)
+    primer.prepare(source)
+    primer.close()
+    pending: collections.deque = collections.deque()
+    it = iter(offsets)
+    try:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as pool:
+            while True:
+                chunk = list(itertools.islice(it, chunksize))
+                if chunk:
+                    pending.append(pool.submit(work, chunk))
+                # bounded queue: wait for the oldest chunk once depth are in flight
+                while pending and (len(pending) >= depth or not chunk):
+                    results, excpt = pending.popleft().result()
+                    for p, span, data in results:
+                        if skip is not None and skip(span):
+                            continue
+                        yield p, span, data
+                    if excpt is not None:
+                        raise excpt
+                if not chunk:
+                    break
+    finally:
+        for bl in blocklines:
+            bl.close()
@@ -0,0 +1,173 @@
+# flake8: noqa: E501
+#
+#   (C) Sebastian Weigmann, 2025
+#   This software is released under:
+#   GNU GENERAL PUBLIC LICENSE, Version 3
+#   Please find the full text in LICENSE.
+#
+# generic imports
+import typing
+import os
+import threading
+import collections
+
+# specific imports
+try:
+    from common import sources
+    from common import blockline
+except ModuleNotFoundError:
+    from offset_tools.common import sources
+    from offset_tools.common import blockline
+
+# windows of the page cache
+PAGE = 1 << 16
+# larger reads bypass the page cache
+MAX_CACHED_READ = 1 << 20
+
+
+# recently read windows of all cached sources, least recently used ones
+# are dropped once they take more than memory bytes
+class PageCache(object):
+    def __init__(self, memory: int = 256 << 20):
+        self.memory = memory
+        self.used = 0
+        self.pages: collections.OrderedDict[tuple[int, int], bytes] = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, owner: int, index: int) -> bytes | None:
+        with self.lock:
+            page = self.pages.get((owner, index))
+            if page is not None:
+                self.pages.move_to_end((owner, index))
+            return page
+
+    def put(self, owner: int, index: int, page: bytes) -> None:
+        with self.lock:
+            old = self.pages.pop((owner, index), None)
+            if old is not None:
+                self.used -= len(old)
+            self.pages[(owner, index)] = page
+            self.used += len(page)
+            while self.used > self.memory and self.pages:
+                _, dropped = self.pages.popitem(last=False)
+                self.used -= len(dropped)
+
+    def drop(self, owner: int) -> None:
+        with self.lock:
+            for key in [key for key in self.pages if key[0] == owner]:
+                self.used -= len(self.pages.pop(key))
+
+
+# reads of inner through pages of the page cache. line ends are searched
+# by reading windows (see sources.Source.find), so they come from the
+# cache as well when the same region is searched again.
+class CachedSource(sources.Source):
+    def __init__(self, source: sources.Source, pages: PageCache):
+        self.inner = source
+        self.pages = pages
+        self.size = source.size
+        self.name = source.name
+        self.bufsize = source.bufsize
+
+    def read(self, position: int, length: int) -> bytes:
+        self._check_position(position)
+        self._check_length(length)
+        end = self.size if length < 0 else min(position + length, self.size)
+        if end - position > MAX_CACHED_READ:
+            return self.inner.read(position, length)
+        if end <= position:
+            return b""
+        parts = []
+        for index in range(position // PAGE, (end - 1) // PAGE + 1):
+            page = self.pages.get(id(self), index)
+            if page is None:
+                page = self.inner.read(index * PAGE, PAGE)
+                self.pages.put(id(self), index, page)
+            parts.append(page)
+        skip = position % PAGE
+        return b"".join(parts)[skip:skip + end - position]
+
+    def advise(self, position: int, length: int, advice: str) -> None:
+        self.inner.advise(position, length, advice)
+
+    def data_extents(self, start: int, end: int) -> list[tuple[int, int]]:
+        return self.inner.data_extents(start, end)
+
+    def kernel_span(self, position: int, length: int) -> tuple[int, int, int] | None:
+        return self.inner.kernel_span(position, length)
+
+    def buffer_view(self) -> typing.Any:
+        return self.inner.buffer_view()
+
+    def close(self) -> None:
+        self.pages.drop(id(self))
+        self.inner.close()
+
+
+# open inputs kept between runs of a long running process (see server.py).
+# an input is reused while its path, identity (device, inode, size, mtime)
+# and the options its source depends on are the same. at most max_inputs
+# are kept open, the least recently used one not in use is closed first.
+# memory-mapped inputs are kept as they are, the kernel keeps their pages;
+# others read through a shared page cache of memory bytes.
+class SourceCache(object):
+    def __init__(self, max_inputs: int = 64, memory: int = 256 << 20):
+        self.max_inputs = max_inputs
+        self.pages = PageCache(memory)
+        self.lock = threading.Lock()
+        # key -> [file handle, source, users]
+        self.entries: collections.OrderedDict[tuple, list[typing.Any]] = collections.OrderedDict()
+        self.keys: dict[int, tuple] = {}
+
+    # the source of path as bl would open it, to be given back by release()
+    def acquire(self, bl: blockline.BlockLine, path: str) -> sources.Source:
+        st = os.stat(path)
+        key = (os.path.realpath(path), st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns, bl.datatype, bl.linebuf, bl.bufsize, bl.use_mmap, bl.decompress, bl.segmented, bl.index_dir)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+                entry[2] += 1
+                return entry[1]
+        filehandle = open(path, "rb")
+        try:
+            # without the stats of bl, the source outlives this run
+            src = blockline.BlockLine(**bl.options).open_source(filehandle)
+        except BaseException:
+            filehandle.close()
+            raise
+        if not isinstance(src, sources.MmapSource):
+            src = CachedSource(src, self.pages)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.entries[key] = [filehandle, src, 1]
+                self.keys[id(src)] = key
+                self.__evict()
+                return src
+            # opened by another thread meanwhile
+            entry[2] += 1
+        src.close()
+        filehandle.close()
+        return entry[1]
+
+    def release(self, src: sources.Source) -> None:
+        with self.lock:
+            self.entries[self.keys[id(src)]][2] -= 1
+            self.__evict()
+
+    def __evict(self) -> None:
+        idle = [key for key, entry in self.entries.items() if entry[2] == 0]
+        for key in idle[:max(0, len(self.entries) - self.max_inputs)]:
+            filehandle, src, _ = self.entries.pop(key)
+            del self.keys[id(src)]
+            src.close()
+            filehandle.close()
+
+    def close(self) -> None:
+        with self.lock:
+            for filehandle, src, _ in self.entries.values():
+                src.close()
+                filehandle.close()
+            self.entries.clear()
+            self.keys.clear()
@@ -0,0 +1,134 @@
+# flake8: noqa: E501
+#
+#   (C) Sebastian Weigmann, 2025
+#   This software is released under:
+#   GNU GENERAL PUBLIC LICENSE, Version 3
+#   Please find the full text in LICENSE.
+#
+# generic imports
+import typing
+import os
+import json
+import time
+import hashlib
+import threading
+
+# specific imports
+try:
+    from common import dedup
+    from common import output
+except ModuleNotFoundError:
+    from offset_tools.common import dedup
+    from offset_tools.common import output
+
+CHECKPOINT = ".offset_dump.ckpt"
+VERSION = 1
+
+
+# checkpoints of a resumable run (--resume), kept in the output directory:
+#   .offset_dump.ckpt       json: fingerprint of the arguments and per input
+#                           its identity (size, mtime), the next offset not
+#                           done yet, the number of --nodupes digests and
+#                           whether it is done
+#   .offset_dump.N.dedup    the --nodupes digests of input N, in the order
+#                           they were seen (see dedup.Dedup)
+# offsets are processed in ascending order, so everything below next is
+# done. a checkpoint is written every interval seconds and on save(), only
+# after everything this run wrote so far is on disk: sync() of the output
+# (its files and their directories) and of the dedup journals. nothing
+# else on the machine is flushed. results written after the last
+# checkpoint are redone and overwrite their files.
+class Checkpoint(object):
+    def __init__(self, outdir: str, fingerprint: str, interval: float = 60, sync: typing.Callable[[], None] | None = None):
+        self.outdir = outdir
+        self.path = os.path.join(outdir, CHECKPOINT)
+        self.fingerprint = fingerprint
+        self.interval = interval
+        self.sync = sync
+        self.lock = threading.Lock()
+        self.last_save = time.monotonic()
+        self.dedups: list[dedup.Dedup] = []
+        self.state: dict[str, typing.Any] = {"version": VERSION, "fingerprint": fingerprint, "inputs": {}}
+        self.resumed = False
+        if os.path.exists(self.path):
+            with open(self.path) as f:
+                state = json.load(f)
+            if state.get("version") != VERSION or state.get("fingerprint") != fingerprint:
+                raise ValueError(f"{self.path} belongs to a run with other arguments or inputs, use another --outdir")
+            self.state = state
+            self.resumed = True
+
+    # the state of infile: {"next", "digests", "done", "journal", "identity"}.
+    # a checkpointed input must not have changed since.
+    def input(self, infile: str) -> dict[str, typing.Any]:
+        identity = input_identity(infile)
+        key = os.path.abspath(infile)
+        with self.lock:
+            inputs = self.state["inputs"]
+            entry = inputs.get(key)
+            if entry is None:
+                entry = {"identity": identity, "next": 0, "digests": 0, "done": False, "journal": f".offset_dump.{len(inputs)}.dedup"}
+                inputs[key] = entry
+            elif entry["identity"] != identity:
+                raise ValueError(f"{infile} changed since the checkpoint in {self.outdir}")
+            return entry
+
+    # a --nodupes set continuing where the checkpoint of entry left off
+    def open_dedup(self, entry: dict[str, typing.Any], digest: str, store: str | None = None) -> dedup.Dedup:
+        dups = dedup.Dedup(digest, store, os.path.join(self.outdir, entry["journal"]), entry["digests"])
+        with self.lock:
+            self.dedups.append(dups)
+        return dups
+
+    # the result for offset is written, dups holds its digest if any
+    def advance(self, entry: dict[str, typing.Any], offset: int, dups: dedup.Dedup | None = None) -> None:
+        with self.lock:
+            entry["next"] = offset + 1
+            if dups is not None:
+                entry["digests"] = dups.count
+        if time.monotonic() - self.last_save >= self.interval:
+            self.save()
+
+    def finish(self, entry: dict[str, typing.Any]) -> None:
+        with self.lock:
+            entry["done"] = True
+
+    def save(self) -> None:
+        with self.lock:
+            # entries advance only after their results were handed to the
+            # output, so syncing after taking the snapshot covers them all
+            data = json.dumps(self.state, indent=1)
+            if self.sync is not None:
+                self.sync()
+            for dups in self.dedups:
+                dups.sync()
+            # journals of inputs which are done are closed
+            self.dedups = [dups for dups in self.dedups if dups.journal is not None and not dups.journal.closed]
+            tmp = self.path + ".tmp"
+            with open(tmp, "w") as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, self.path)
+            output.fsync_path(self.outdir, directory=True)
+            self.last_save = time.monotonic()
+
+
+# what identifies an input between runs
+def input_identity(infile: str) -> list[int]:
+    st = os.stat(infile)
+    return [st.st_size, st.st_mtime_ns]
+
+
+# lines passed through, with the digest of all of them in digest when
+# exhausted. offsets read from stdin have no identity to check, their
+# digest decides whether a checkpoint may be continued.
+def hashed_lines(lines: typing.Iterable[bytes], digest: typing.Any) -> typing.Iterator[bytes]:
+    for line in lines:
+        digest.update(line)
+        yield line
+
+
+# digest of everything that decides which results a run writes
+def fingerprint(options: dict[str, typing.Any]) -> str:
+    return hashlib.sha256(json.dumps(options, sort_keys=True, default=str).encode("utf-8")).hexdigest()
@@ -0,0 +1,445 @@
+# flake8: noqa: E501
+#
+#   (C) Sebastian Weigmann, 2025
+#   This software is released under:
+#   GNU GENERAL PUBLIC LICENSE, Version 3
+#   Please find the full text in LICENSE.
+#
+# generic imports
+import typing
+import os
+import sys
+import bz2
+import lzma
+import zlib
+import array
+import bisect
+import struct
+import hashlib
+import threading
+import collections
+
+# specific imports
+try:
+    from common import errors as ERR
+    from common import sources
+    from common import lineindex
+except ModuleNotFoundError:
+    from offset_tools.common import errors as ERR
+    from offset_tools.common import sources
+    from offset_tools.common import lineindex
+
+MAGICS = {
+    "gzip": b"\x1f\x8b",
+    "bzip2": b"BZh",
+    "xz": b"\xfd7zXZ\x00",
+}
+
+# uncompressed data is produced and cached in chunks of CHUNKSIZE bytes
+CHUNKSIZE = 1 << 20
+CACHECHUNKS = 64
+INPUTSIZE = 1 << 16
+# gzip only: a copy of the decompressor every SNAPSHOTSIZE bytes
+SNAPSHOTSIZE = 1 << 25
+MAX_SNAPSHOTS = 256
+
+# persistent checkpoint index, one per compressed input.
+# layout: one header, then the uncompressed and then the compressed
+# positions of all points decompression can start at without prior state.
+#   magic, byte order, mode, compressed size, mtime_ns, uncompressed size,
+#   checkpoint count, hash of the first and the last HASHSIZE compressed bytes
+MAGIC = b"OTZIDX01"
+HEADER = struct.Struct("<8sBB6sQqQQ16s16s")
+HASHSIZE = 1 << 16
+BYTEORDER = {"little": 1, "big": 2}
+# gzip members, bzip2 streams, xz streams or xz blocks
+MODES = {"gzip": 1, "bzip2": 2, "xz": 3, "xzblocks": 4}
+
+XZ_FILTERS = {
+    lzma.FILTER_X86, lzma.FILTER_POWERPC, lzma.FILTER_IA64,
+    lzma.FILTER_ARM, lzma.FILTER_ARMTHUMB, lzma.FILTER_SPARC,
+}
+
+
+def detect_format(source: sources.Source) -> str | None:
+    head = source.read(0, 6)
+    for fmt, magic in MAGICS.items():
+        if head.startswith(magic):
+            return fmt
+    return None
+
+
+def _varint(buf: bytes, i: int) -> tuple[int, int]:
+    value = 0
+    shift = 0
+    while True:
+        b = buf[i]
+        value |= (b & 0x7F) << shift
+        i += 1
+        if not b & 0x80:
+            return value, i
+        shift += 7
+        if shift > 63:
+            raise ValueError("bad xz integer")
+
+
+# the block table of an xz file, read from the indexes at the end of its
+# streams: [(compressed position of the block header, uncompressed size)]
+def xz_blocks(source: sources.Source) -> list[tuple[int, int]] | None:
+    streams = []
+    pos = source.size
+    try:
+        while pos > 0:
+            # stream padding
+            while pos >= 4 and source.read(pos - 4, 4) == b"\0\0\0\0":
+                pos -= 4
+            footer = source.read(pos - 12, 12)
+            if len(footer) != 12 or footer[10:12] != b"YZ":
+                return None
+            backward_size = (struct.unpack("<I", footer[4:8])[0] + 1) * 4
+            index_start = pos - 12 - backward_size
+            index = source.read(index_start, backward_size)
+            if index[0] != 0:
+                return None
+            count, i = _varint(index, 1)
+            records = []
+            for _ in range(count):
+                unpadded, i = _varint(index, i)
+                uncompressed, i = _varint(index, i)
+                records.append((unpadded, uncompressed))
+            stream_start = index_start - sum((u + 3) & ~3 for u, _ in records) - 12
+            if stream_start < 0 or source.read(stream_start, 6) != MAGICS["xz"]:
+                return None
+            blocks = []
+            p = stream_start + 12
+            for unpadded, uncompressed in records:
+                blocks.append((p, uncompressed))
+                p += (unpadded + 3) & ~3
+            streams.append(blocks)
+            pos = stream_start
+    except (IndexError, ValueError, struct.error):
+        return None
+    return [block for blocks in reversed(streams) for block in blocks]
+
+
+# filter chain and start of the compressed data of the xz block at position
+def xz_block_filters(source: sources.Source, position: int) -> tuple[list[dict], int] | None:
+    size = (source.read(position, 1)[0] + 1) * 4
+    header = source.read(position, size)
+    flags = header[1]
+    i = 2
+    if flags & 0x40:
+        _, i = _varint(header, i)
+    if flags & 0x80:
+        _, i = _varint(header, i)
+    filters = []
+    for _ in range((flags & 3) + 1):
+        filter_id, i = _varint(header, i)
+        propsize, i = _varint(header, i)
+        props = header[i:i + propsize]
+        i += propsize
+        if filter_id == lzma.FILTER_LZMA2 and propsize == 1 and props[0] <= 40:
+            d = props[0]
+            dict_size = 0xFFFFFFFF if d == 40 else (2 | (d & 1)) << (d // 2 + 11)
+            filters.append({"id": filter_id, "dict_size": dict_size})
+        elif filter_id == lzma.FILTER_DELTA and propsize == 1:
+            filters.append({"id": filter_id, "dist": props[0] + 1})
+        elif filter_id in XZ_FILTERS and propsize in (0, 4):
+            bcj: dict[str, int] = {"id": filter_id}
+            if propsize:
+                bcj["start_offset"] = struct.unpack("<I", props)[0]
+            filters.append(bcj)
+        else:
+            return None
+    return filters, position + size
+
+
+# read only random access to the uncompressed data of a gzip, bzip2 or xz
+# file, offsets are positions in the uncompressed data.
+# the stdlib decompressors cannot be started mid-stream, so decompression
+# restarts at the nearest checkpoint before the wanted data:
+#   gzip members, bzip2 streams and xz blocks can be decoded on their own.
+#     they are found once and kept in an index file next to the input.
+#   inside a gzip member, a copy of the decompressor state is kept every
+#     SNAPSHOTSIZE bytes. these live in memory for the current run only.
+# decompression moves forward from there and leaves chunks of CHUNKSIZE
+# bytes in a small cache, so sorted offsets cost one pass at most.
+class CompressedSource(sources.Source):
+    def __init__(self, raw: sources.Source, fmt: str, path: str | None = None, index_dir: str | None = None):
+        self.raw = raw
+        self.fmt = fmt
+        self.name = raw.name
+        self.path = path
+        self.bufsize = CHUNKSIZE
+        self.idxpath = lineindex.sidecar_path(path, index_dir, ".zidx") if path is not None else None
+        self.mode = fmt
+        # start points, uncompressed and compressed positions
+        self.starts = array.array("Q")
+        self.offsets = array.array("Q")
+        # (compressed position, decompressor, unconsumed input) by position
+        self.snapshot_starts: list[int] = []
+        self.snapshots: list[tuple[int, typing.Any, bytes]] = []
+        self.snapshotsize = SNAPSHOTSIZE
+        self.cache: collections.OrderedDict[int, bytes] = collections.OrderedDict()
+        self.lock = threading.Lock()
+        # decompression cursor
+        self.dec: typing.Any = None
+        self.inbuf = b""
+        self.comp_pos = 0
+        self.pos = -1
+        self.member = 0
+        self.xz_filters: dict[int, tuple[list[dict], int]] = {}
+        self.__open()
+
+    def __hash(self, start: int, end: int) -> bytes:
+        return hashlib.blake2b(self.raw.read(start, end - start), digest_size=16).digest()
+
+    def __mtime(self) -> int:
+        return os.stat(self.path).st_mtime_ns if self.path is not None else 0
+
+    def __header(self) -> bytes:
+        return HEADER.pack(MAGIC, BYTEORDER[sys.byteorder], MODES[self.mode], b"", self.raw.size, self.__mtime(),
+                           self.size, len(self.starts), self.__hash(0, min(HASHSIZE, self.raw.size)),
+                           self.__hash(max(0, self.raw.size - HASHSIZE), self.raw.size))
+
+    def __load(self) -> bool:
+        if self.idxpath is None:
+            return False
+        try:
+            with open(self.idxpath, "rb") as f:
+                hdr = f.read(HEADER.size)
+                if len(hdr) != HEADER.size:
+                    return False
+                magic, order, mode, _, compsize, mtime, size, count, headhash, tailhash = HEADER.unpack(hdr)
+                if magic != MAGIC or order != BYTEORDER[sys.byteorder] or compsize != self.raw.size or mtime != self.__mtime():
+                    return False
+                if headhash != self.__hash(0, min(HASHSIZE, compsize)) or tailhash != self.__hash(max(0, compsize - HASHSIZE), compsize):
+                    return False
+                starts = array.array("Q")
+                starts.fromfile(f, count)
+                offsets = array.array("Q")
+                offsets.fromfile(f, count)
+        except (OSError, EOFError):
+            return False
+        self.mode = {v: k for k, v in MODES.items()}.get(mode, self.fmt)
+        self.size = size
+        self.starts = starts
+        self.offsets = offsets
+        return True
+
+    def __save(self) -> None:
+        if self.idxpath is None:
+            return
+        try:
+            if os.path.dirname(self.idxpath):
+                os.makedirs(os.path.dirname(self.idxpath), exist_ok=True)
+            tmppath = f"{self.idxpath}.{os.getpid()}.tmp"
+            with open(tmppath, "wb") as f:
+                f.write(self.__header())
+                self.starts.tofile(f)
+                self.offsets.tofile(f)
+            os.replace(tmppath, self.idxpath)
+        except OSError as excpt:
+            ERR.printmsg(f"cannot write checkpoint index {self.idxpath}: {excpt}, keeping it in memory", ERR.ERRLVL.WARN)
+
+    def __open(self) -> None:
+        if self.__load():
+            return
+        if self.fmt == "xz":
+            blocks = xz_blocks(self.raw)
+            if blocks is not None and all(self.__xz_filters(p) is not None for p, _ in blocks):
+                # the xz index already tells where every block starts
+                self.mode = "xzblocks"
+                uncompressed = 0
+                for p, usize in blocks:
+                    self.starts.append(uncompressed)
+                    self.offsets.append(p)
+                    uncompressed += usize
+                self.size = uncompressed
+                self.__save()
+                return
+        # one pass over the whole input to find the start points and the size
+        ERR.printmsg(f"building checkpoint index for {self.name}", ERR.ERRLVL.INFO)
+        self.starts.append(0)
+        self.offsets.append(0)
+        self.__restart(0, 0)
+        while self.__step(CHUNKSIZE):
+            pass
+        self.size = self.pos
+        self.__save()
+
+    def __xz_filters(self, position: int) -> tuple[list[dict], int] | None:
+        if position not in self.xz_filters:
+            try:
+                result = xz_block_filters(self.raw, position)
+            except (IndexError, ValueError, struct.error):
+                result = None
+            if result is None:
+                return None
+            self.xz_filters[position] = result
+        return self.xz_filters[position]
+
+    def __restart(self, uncompressed: int, member: int) -> None:
+        self.dec = None
+        self.inbuf = b""
+        self.pos = uncompressed
+        self.member = member
+        self.comp_pos = self.offsets[member]
+
+    # a new decompressor for the member, stream or block at comp_pos.
+    # returns False at the end of the input, trailing garbage included.
+    def __start_member(self) -> bool:
+        if self.mode == "xzblocks":
+            if self.member >= len(self.offsets):
+                return False
+            block = self.__xz_filters(self.offsets[self.member])
+            if block is None:
+                # all block headers were readable when xzblocks was chosen
+                raise ValueError(f"{self.name}: unreadable xz block header at {self.offsets[self.member]}")
+            filters, data_start = block
+            self.dec = lzma.LZMADecompressor(lzma.FORMAT_RAW, filters=filters)
+            self.comp_pos = data_start
+            self.member += 1
+            return True
+        if self.comp_pos >= self.raw.size or not self.raw.read(self.comp_pos, 6).startswith(MAGICS[self.fmt]):
+            return False
+        if self.fmt == "gzip":
+            self.dec = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        elif self.fmt == "bzip2":
+            self.dec = bz2.BZ2Decompressor()
+        else:
+            self.dec = lzma.LZMADecompressor(lzma.FORMAT_XZ)
+        return True
+
+    def __feed(self) -> bytes:
+        buf = self.raw.read(self.comp_pos, INPUTSIZE)
+        if not buf:
+            raise EOFError(f"{self.name}: compressed data ends unexpectedly")
+        self.comp_pos += len(buf)
+        return buf
+
+    # decompress up to max_length bytes, b"" at the end of the data.
+    # member starts and decompressor snapshots are collected on the way.
+    def __step(self, max_length: int) -> bytes:
+        while True:
+            if self.dec is None:
+                if not self.__start_member():
+                    return b""
+                if self.mode != "xzblocks" and self.pos > self.starts[-1]:
+                    self.starts.append(self.pos)
+                    self.offsets.append(self.comp_pos)
+            d = self.dec
+            if self.fmt == "gzip":
+                if not self.inbuf and self.comp_pos < self.raw.size:
+                    self.inbuf = self.__feed()
+                out = d.decompress(self.inbuf, max_length)
+                self.inbuf = d.unconsumed_tail
+                if not out and not d.eof and self.comp_pos >= self.raw.size:
+                    raise EOFError(f"{self.name}: compressed data ends unexpectedly")
+            elif d.needs_input:
+                out = d.decompress(self.__feed(), max_length)
+            else:
+                out = d.decompress(b"", max_length)
+            self.pos += len(out)
+            if d.eof:
+                if self.mode != "xzblocks":
+                    # the next member starts right after this one
+                    self.comp_pos -= len(d.unused_data) + len(self.inbuf)
+                self.dec = None
+                self.inbuf = b""
+            elif self.fmt == "gzip" and self.pos % self.snapshotsize == 0:
+                self.__snapshot()
+            if out:
+                return out
+
+    def __snapshot(self) -> None:
+        if self.snapshot_starts and self.pos <= self.snapshot_starts[-1]:
+            return
+        self.snapshot_starts.append(self.pos)
+        self.snapshots.append((self.comp_pos, self.dec.copy(), self.inbuf))
+        if len(self.snapshots) > MAX_SNAPSHOTS:
+            # thin out instead of growing without bounds
+            self.snapshot_starts = self.snapshot_starts[1::2]
+            self.snapshots = self.snapshots[1::2]
+            self.snapshotsize *= 2
+
+    # continue at the nearest point at or before position, unless the
+    # cursor already is between that point and position
+    def __seek(self, position: int) -> None:
+        member = bisect.bisect_right(self.starts, position) - 1
+        best = self.starts[member]
+        i = bisect.bisect_right(self.snapshot_starts, position) - 1
+        if i >= 0 and self.snapshot_starts[i] >= best:
+            best = self.snapshot_starts[i]
+        if best <= self.pos <= position:
+            return
+        if i >= 0 and self.snapshot_starts[i] == best:
+            comp_pos, dec, inbuf = self.snapshots[i]
+            self.dec = dec.copy()
+            self.inbuf = inbuf
+            self.pos = best
+            self.comp_pos = comp_pos
+            return
+        self.__restart(best, member)
+
+    def __chunk(self, k: int) -> bytes:
+        if k in self.cache:
+            self.cache.move_to_end(k)
+            return self.cache[k]
+        start = k * CHUNKSIZE
+        self.__seek(start)
+        # the first chunk is incomplete if the cursor is not aligned
+        acc = bytearray()
+        acc_start = self.pos
+        while True:
+            j = acc_start // CHUNKSIZE
+            out = self.__step((j + 1) * CHUNKSIZE - self.pos)
+            acc += out
+            if not out or self.pos == (j + 1) * CHUNKSIZE:
+                if acc_start == j * CHUNKSIZE and j >= k - 1:
+                    # keep the chunk in front too, for reverse searches
+                    self.cache[j] = bytes(acc)
+                    if len(self.cache) > CACHECHUNKS:
+                        self.cache.popitem(last=False)
+                if not out or j >= k:
+                    break
+                acc = bytearray()
+                acc_start = self.pos
+        return self.cache.get(k, b"")
+
+    def read(self, position: int, length: int) -> bytes:
+        self._check_position(position)
+        self._check_length(length)
+        end = self.size if length < 0 else min(position + length, self.size)
+        if position >= end:
+            return b""
+        with self.lock:
+            first = position // CHUNKSIZE
+            last = (end - 1) // CHUNKSIZE
+            if first == last:
+                return self.__chunk(first)[position - first * CHUNKSIZE:end - first * CHUNKSIZE]
+            buf = b"".join(self.__chunk(k) for k in range(first, last + 1))
+        return buf[position - first * CHUNKSIZE:end - first * CHUNKSIZE]
+
+    def close(self) -> None:
+        self.raw.close()
+        self.cache.clear()
+        self.snapshot_starts = []
+        self.snapshots = []
+
+
+# open filehandle as compressed source if it holds gzip, bzip2 or xz data,
+# otherwise as a plain source
+def open_source(filehandle: typing.BinaryIO, bufsize: int = 512, use_mmap: bool = True, index_dir: str | None = None) -> sources.Source:
+    return wrap_source(sources.open_source(filehandle, bufsize, use_mmap), index_dir)
+
+
+# the same for an already opened source. the checkpoint index is only
+# kept for sources named after a regular file.
+def wrap_source(raw: sources.Source, index_dir: str | None = None) -> sources.Source:
+    fmt = detect_format(raw)
+    if fmt is None:
+        ERR.printmsg(f"{raw.name} is not gzip, bzip2 or xz compressed, reading it as is", ERR.ERRLVL.WARN)
+        return raw
+    path = raw.name if isinstance(raw.name, str) and os.path.isfile(raw.name) else None
+    return CompressedSource(raw, fmt, path, index_dir)
@@ -0,0 +1,113 @@
+# flake8: noqa: E501
+#
+#   (C) Sebastian Weigmann, 2025
+#   This software is released under:
+#   GNU GENERAL PUBLIC LICENSE, Version 3
+#   Please find the full text in LICENSE.
+#
+# generic imports
+import typing
+import os
+import hashlib
+import dbm
+
+# specific imports
+try:
+    from common import sources
+except ModuleNotFoundError:
+    from offset_tools.common import sources
+
+# content digests for duplicate suppression, binary digests only
+DIGESTS: dict[str, typing.Callable[[], typing.Any]] = {
+    "sha256": hashlib.sha256,
+    "sha1": hashlib.sha1,
+    "md5": hashlib.md5,
+    "blake2b": lambda: hashlib.blake2b(digest_size=16),
+}
+# digests per read when a journal is replayed
+READ_DIGESTS = 1 << 16
+
+
+# duplicate suppression for --nodupes in two stages:
+#   seen_span()  before reading: a span equal to the previous one is a dup.
+#                offsets arrive sorted, so equal spans are always adjacent.
+#   seen_data()  after reading: a digest of the data is looked up in a set,
+#                or in a dbm file on disk if the set would not fit in memory.
+#                spans not read into memory (SpanData) are hashed in chunks.
+# with a journal, every new digest is also appended to that file, so a
+# resumed run (--resume) can rebuild the set: resume is the number of
+# digests to keep from an existing journal, later ones are dropped.
+class Dedup(object):
+    def __init__(self, digest: str = "sha256", store: str | None = None, journal: str | None = None, resume: int = 0):
+        self.digest = DIGESTS[digest]
+        self.store = store
+        self.hashes: typing.Any = set() if store is None else dbm.open(store, "n")
+        self.last_span: tuple[int, int] | None = None
+        self.count = 0
+        self.journal: typing.BinaryIO | None = None
+        if journal is not None:
+            # unbuffered, a checkpoint must find every digest counted on disk
+            self.journal = open(journal, "a+b" if resume else "wb", buffering=0)
+            self.__replay(self.journal, resume)
+
+    def __replay(self, f: typing.BinaryIO, count: int) -> None:
+        size = self.digest().digest_size
+        f.seek(0)
+        while self.count < count:
+            buf = f.read(min(count - self.count, READ_DIGESTS) * size)
+            if not buf or len(buf) % size:
+                raise ValueError(f"dedup journal {f.name} holds fewer digests than its checkpoint")
+            for i in range(0, len(buf), size):
+                self.__add(buf[i:i + size])
+        f.truncate(count * size)
+
+    def seen_span(self, span: tuple[int, int]) -> bool:
+        if span == self.last_span:
+            return True
+        self.last_span = span
+        return False
+
+    def seen_data(self, buf: bytes | sources.SpanData) -> bool:
+        return self.seen_key(self.key(buf))
+
+    # the digest of buf, as looked up by seen_key()
+    def key(self, buf: bytes | sources.SpanData) -> bytes:
+        h = self.digest()
+        if isinstance(buf, sources.SpanData):
+            for chunk in buf.chunks():
+                h.update(chunk)
+        else:
+            h.update(buf)
+        return h.digest()
+
+    def seen_key(self, key: bytes) -> bool:
+        if key in self.hashes:
+            return True
+        self.__add(key)
+        if self.journal is not None:
+            self.journal.write(key)
+        return False
+
+    def __add(self, key: bytes) -> None:
+        if self.store is None:
+            self.hashes.add(key)
+        else:
+            self.hashes[key] = b""
+        self.count += 1
+
+    # the journal is on disk, for checkpoints. a journal closed meanwhile
+    # belongs to an input which is done.
+    def sync(self) -> None:
+        journal = self.journal
+        if journal is None or journal.closed:
+            return
+        try:
+            os.fsync(journal.fileno())
+        except ValueError:
+            pass
+
+    def close(self) -> None:
+        if self.store is not None:
+            self.hashes.close()
+        if self.journal is not None:
+            self.journal.close()
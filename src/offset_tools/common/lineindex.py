@@ -0,0 +1,192 @@
+# flake8: noqa: E501
+#
+#   (C) Sebastian Weigmann, 2025
+#   This software is released under:
+#   GNU GENERAL PUBLIC LICENSE, Version 3
+#   Please find the full text in LICENSE.
+#
+# generic imports
+import typing
+import os
+import sys
+import mmap
+import array
+import bisect
+import struct
+import hashlib
+
+# specific imports
+try:
+    from common import errors as ERR
+    from common import sources
+except ModuleNotFoundError:
+    from offset_tools.common import errors as ERR
+    from offset_tools.common import sources
+
+
+# persistent index of all separator positions of an input file.
+# layout: one header, then one unsigned 64 bit integer per separator.
+#   magic, byte order, separator, bytes indexed, mtime_ns, separator count,
+#   hash of the first HASHSIZE bytes, hash of the last HASHSIZE bytes indexed
+MAGIC = b"OTLIDX01"
+HEADER = struct.Struct("<8sB7sQqQ16s16s")
+HASHSIZE = 1 << 16
+CHUNKSIZE = 1 << 22
+BYTEORDER = {"little": 1, "big": 2}
+
+
+def sidecar_path(path: str, index_dir: str | None = None, ext: str = ".lidx") -> str:
+    if index_dir is None:
+        return path + ext
+    key = hashlib.sha256(os.path.abspath(path).encode("utf-8")).hexdigest()[:32]
+    return os.path.join(index_dir, key + ext)
+
+
+# drop-in replacement for blockline.SepCache: rfind and find are answered
+# by binary search over the separator positions, no input is read.
+class LineIndex(object):
+    def __init__(self, source: sources.Source, substring: bytes, path: str, index_dir: str | None = None):
+        self.source = source
+        self.substring = substring
+        self.path = path
+        self.idxpath = sidecar_path(path, index_dir)
+        self.positions: typing.Sequence[int] = array.array("Q")
+        self.__map: mmap.mmap | None = None
+        self.__view: memoryview | None = None
+        self.__open()
+
+    def __hash(self, start: int, end: int) -> bytes:
+        return hashlib.blake2b(self.source.read(start, end - start), digest_size=16).digest()
+
+    def __header(self, count: int) -> bytes:
+        size = self.source.size
+        mtime = os.stat(self.path).st_mtime_ns
+        return HEADER.pack(MAGIC, BYTEORDER[sys.byteorder], self.substring, size, mtime, count,
+                           self.__hash(0, min(HASHSIZE, size)), self.__hash(max(0, size - HASHSIZE), size))
+
+    # separators starting at or after start, one array per chunk read,
+    # holes are skipped
+    def __scan(self, start: int) -> typing.Iterator[array.array]:
+        s = self.substring
+        for p, ext_end in self.source.data_extents(start, self.source.size):
+            while p < ext_end:
+                end = min(p + CHUNKSIZE + len(s) - 1, ext_end)
+                buf = self.source.read(p, end - p)
+                found = array.array("Q")
+                idx = buf.find(s)
+                while idx >= 0:
+                    found.append(idx + p)
+                    idx = buf.find(s, idx + len(s))
+                yield found
+                p += CHUNKSIZE
+
+    # append the separators at or after start to f while scanning, so
+    # indexes of large inputs are not held in memory. returns their count.
+    def __write(self, f: typing.BinaryIO, start: int) -> int:
+        count = 0
+        for found in self.__scan(start):
+            found.tofile(f)
+            count += len(found)
+        return count
+
+    # returns (bytes indexed, separator count) of a reusable index file,
+    # or None if it is missing, foreign or the indexed part has changed
+    def __check(self) -> tuple[int, int] | None:
+        try:
+            with open(self.idxpath, "rb") as f:
+                hdr = f.read(HEADER.size)
+                f.seek(0, os.SEEK_END)
+                length = f.tell()
+        except OSError:
+            return None
+        if len(hdr) != HEADER.size:
+            return None
+        magic, order, sep, indexed, mtime, count, headhash, tailhash = HEADER.unpack(hdr)
+        if magic != MAGIC or order != BYTEORDER[sys.byteorder] or sep.rstrip(b"\0") != self.substring:
+            return None
+        if indexed > self.source.size or HEADER.size + count * 8 > length:
+            return None
+        # same size but touched: may have been rewritten in place
+        if indexed == self.source.size and mtime != os.stat(self.path).st_mtime_ns:
+            return None
+        if headhash != self.__hash(0, min(HASHSIZE, indexed)) or tailhash != self.__hash(max(0, indexed - HASHSIZE), indexed):
+            return None
+        return indexed, count
+
+    def __open(self) -> None:
+        state = self.__check()
+        try:
+            if state is None:
+                ERR.printmsg(f"building line index {self.idxpath}", ERR.ERRLVL.INFO)
+                if os.path.dirname(self.idxpath):
+                    os.makedirs(os.path.dirname(self.idxpath), exist_ok=True)
+                tmppath = f"{self.idxpath}.{os.getpid()}.tmp"
+                try:
+                    with open(tmppath, "wb") as f:
+                        # the count is known once scanned
+                        f.write(self.__header(0))
+                        count = self.__write(f, 0)
+                        f.seek(0)
+                        f.write(self.__header(count))
+                    os.replace(tmppath, self.idxpath)
+                except OSError:
+                    if os.path.exists(tmppath):
+                        os.remove(tmppath)
+                    raise
+            else:
+                indexed, count = state
+                if indexed < self.source.size:
+                    # append-only input: index the new tail only
+                    ERR.printmsg(f"updating line index {self.idxpath}", ERR.ERRLVL.INFO)
+                    with open(self.idxpath, "r+b") as f:
+                        f.truncate(HEADER.size + count * 8)
+                        f.seek(0, os.SEEK_END)
+                        count += self.__write(f, max(0, indexed - len(self.substring) + 1))
+                        f.seek(0)
+                        f.write(self.__header(count))
+        except OSError as excpt:
+            ERR.printmsg(f"cannot write line index {self.idxpath}: {excpt}, keeping it in memory", ERR.ERRLVL.WARN)
+            positions = array.array("Q")
+            for found in self.__scan(0):
+                positions.extend(found)
+            self.positions = positions
+            return
+        with open(self.idxpath, "rb") as f:
+            self.__map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.__view = memoryview(self.__map)
+        self.positions = self.__view[HEADER.size:HEADER.size + count * 8].cast("Q")
+
+    def close(self) -> None:
+        if isinstance(self.positions, memoryview):
+            self.positions.release()
+        if self.__view is not None:
+            self.__view.release()
+            self.__view = None
+        if self.__map is not None:
+            self.__map.close()
+            self.__map = None
+        self.positions = array.array("Q")
+
+    # same result as source.rfind(substring, position), repeated count
+    # times from the separator found - 1 on. -1 if there are fewer.
+    def rfind(self, position: int, count: int = 1) -> int:
+        sources.Source._check_position(position)
+        idx = -1
+        for _ in range(count):
+            if position < 0:
+                return -1
+            i = bisect.bisect_right(self.positions, min(position, self.source.size) - len(self.substring))
+            if i == 0:
+                return -1
+            idx = self.positions[i - 1]
+            position = idx - 1
+        return idx
+
+    # same result as source.find(substring, position), repeated count
+    # times from the separator found + 1 on. -1 if there are fewer.
+    def find(self, position: int, count: int = 1) -> int:
+        sources.Source._check_position(position)
+        i = bisect.bisect_left(self.positions, position)
+        # separators do not overlap, the next one is always the next position
+        i += count - 1
+        return self.positions[i] if i < len(self.positions) else -1
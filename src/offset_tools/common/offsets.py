@@ -0,0 +1,225 @@
+# flake8: noqa: E501
+#
+#   (C) Sebastian Weigmann, 2025
+#   This software is released under:
+#   GNU GENERAL PUBLIC LICENSE, Version 3
+#   Please find the full text in LICENSE.
+#
+# generic imports
+import typing
+import os
+import re
+import array
+import heapq
+import tempfile
+
+# an offset costs 8 bytes in a run, but sorting a run temporarily builds
+# a set and a list of python ints from it. budget for that, not for 8.
+BYTES_PER_OFFSET = 64
+READ_ITEMS = 1 << 16
+MAX_RUNS = 64
+
+
+# parse offsets from yara or strings output line by line.
+# YARA:
+# user_yes yes.txt          --> None
+# 0x14e:$user_yes01: yes    --> 0x14e
+# 0x213:$user_yes01: yes    --> 0x213
+# STRINGS:
+#     122 dirty bit         --> 122
+# 21691669 WXDP             --> 21691669
+#      7a dirty bit         --> 7a
+# 14afd15 WXDP              --> 14afd15
+def iter_offsets(lines: typing.Iterable[bytes | str], offsetmethod: str, offsettype: str | None = None) -> typing.Iterator[int]:
+    base = 10 if offsettype == "dec" else 16
+    regex = rb"^(0x[0-9a-f]+)" if offsetmethod == "yara" else rb"^ *([0-9a-f]+) "
+    rec = re.compile(regex)
+    for line in lines:
+        data = line.encode("utf-8") if isinstance(line, str) else line
+        regex_group = rec.match(data)
+        if regex_group:
+            yield int(regex_group.group().strip(), base)
+
+
+# yara hits with their origin, yields (target, rule, string id, offset).
+# yara -r prints one header line per matching file and rule, with tags
+# (-g) and meta data (-m) in brackets between rule and path. hits before
+# any header have neither target nor rule:
+# user_yes yes.txt                      --> target yes.txt, rule user_yes
+# user_yes [tag1,tag2] logs/a b.txt     --> target logs/a b.txt, rule user_yes
+# 0x14e:$user_yes01: yes                --> (target, rule, $user_yes01, 0x14e)
+def iter_yara_hits(lines: typing.Iterable[bytes | str]) -> typing.Iterator[tuple[str | None, str | None, str, int]]:
+    rec_hit = re.compile(rb"^(0x[0-9a-f]+)(?::([^:\r\n]*))?")
+    rec_header = re.compile(rb"^(\S+)(?: \[[^\]]*\])* (.+?)\r?\n?$")
+    target = rule = None
+    for line in lines:
+        data = line.encode("utf-8") if isinstance(line, str) else line
+        regex_group = rec_hit.match(data)
+        if regex_group:
+            yield target, rule, os.fsdecode(regex_group.group(2) or b""), int(regex_group.group(1), 16)
+            continue
+        regex_group = rec_header.match(data)
+        if regex_group:
+            rule = os.fsdecode(regex_group.group(1))
+            target = os.fsdecode(regex_group.group(2))
+
+
+# group yara offsets by target file, yields (target, offset) tuples
+def iter_yara_targets(lines: typing.Iterable[bytes | str]) -> typing.Iterator[tuple[str, int]]:
+    for target, _, _, p in iter_yara_hits(lines):
+        if target is not None:
+            yield target, p
+
+
+# collects offsets and hands them out sorted and without duplicates.
+# offsets are kept in a compact array; whenever the array outgrows the
+# memory budget it is sorted and spilled to a temporary file as a run.
+# iterating merges all runs, so memory stays flat however many there are.
+# with width > 1 the items are tuples of that many ints, e.g. (target, offset).
+class OffsetSorter(object):
+    def __init__(self, memory: int = 256 << 20, tmpdir: str | None = None, width: int = 1):
+        self.width = width
+        self.runsize = max(1, memory // (BYTES_PER_OFFSET * width)) * width
+        self.tmpdir = tmpdir
+        self.chunk = array.array("Q")
+        self.runs: list[typing.BinaryIO] = []
+
+    def add(self, item: typing.Any) -> None:
+        if self.width == 1:
+            self.chunk.append(item)
+        else:
+            self.chunk.extend(item)
+        if len(self.chunk) >= self.runsize:
+            self.__spill()
+
+    def extend(self, items: typing.Iterable[typing.Any]) -> None:
+        for item in items:
+            self.add(item)
+
+    def __items(self, flat: typing.Iterable[int]) -> typing.Iterable[typing.Any]:
+        if self.width == 1:
+            return flat
+        it = iter(flat)
+        return zip(*[it] * self.width)
+
+    def __flatten(self, items: typing.Iterable[typing.Any]) -> typing.Iterable[int]:
+        if self.width == 1:
+            return items
+        return (value for item in items for value in item)
+
+    def __sorted_chunk(self) -> list[typing.Any]:
+        return sorted(set(self.__items(self.chunk)))
+
+    def __spill(self) -> None:
+        run = tempfile.TemporaryFile(dir=self.tmpdir)
+        array.array("Q", self.__flatten(self.__sorted_chunk())).tofile(run)
+        self.runs.append(run)
+        self.chunk = array.array("Q")
+        if len(self.runs) >= MAX_RUNS:
+            self.__compact()
+
+    # merge all runs into one to keep the number of open files bounded
+    def __compact(self) -> None:
+        run = tempfile.TemporaryFile(dir=self.tmpdir)
+        items = array.array("Q")
+        for value in self.__flatten(self.__merge(self.runs)):
+            items.append(value)
+            if len(items) >= READ_ITEMS:
+                items.tofile(run)
+                items = array.array("Q")
+        items.tofile(run)
+        for old in self.runs:
+            old.close()
+        self.runs = [run]
+
+    def __read_run(self, run: typing.BinaryIO) -> typing.Iterator[typing.Any]:
+        run.seek(0)
+        while True:
+            values = array.array("Q")
+            try:
+                values.fromfile(run, READ_ITEMS * self.width)
+            except EOFError:
+                # short read, values holds whatever was left
+                yield from self.__items(values)
+                return
+            yield from self.__items(values)
+
+    def __merge(self, runs: list[typing.BinaryIO], *more: typing.Iterable[typing.Any]) -> typing.Iterator[typing.Any]:
+        last = None
+        for item in heapq.merge(*[self.__read_run(r) for r in runs], *more):
+            if item != last:
+                yield item
+                last = item
+
+    def __iter__(self) -> typing.Iterator[typing.Any]:
+        if not self.runs:
+            yield from self.__sorted_chunk()
+            return
+        yield from self.__merge(self.runs, self.__sorted_chunk())
+
+    def close(self) -> None:
+        for run in self.runs:
+            run.close()
+        self.runs = []
+        self.chunk = array.array("Q")
+
+
+def sorted_offsets(offsets: typing.Iterable[int], memory: int = 256 << 20, tmpdir: str | None = None) -> OffsetSorter:
+    sorter = OffsetSorter(memory, tmpdir)
+    sorter.extend(offsets)
+    return sorter
+
+
+# hands out offsets which arrive almost sorted, e.g. from strings or yara
+# still scanning, while they arrive. offsets wait in a heap, the smallest
+# one is handed out whenever window offsets are waiting. window 1 hands
+# every offset out as it arrives.
+# offsets smaller than one handed out already came too late for the
+# window: they are kept and handed out after the end of the input as a
+# second ascending run, leaving out those handed out before.
+class StreamWindow(object):
+    def __init__(self, offsets: typing.Iterable[int], window: int = 256, memory: int = 256 << 20, tmpdir: str | None = None):
+        self.offsets = offsets
+        self.window = max(1, window)
+        self.done = OffsetSorter(memory, tmpdir)
+        self.late = OffsetSorter(memory, tmpdir)
+        self.nlate = 0
+
+    def __ascending(self) -> typing.Iterator[int]:
+        heap: list[int] = []
+        last = -1
+        for p in self.offsets:
+            if p <= last:
+                if p < last:
+                    self.late.add(p)
+                    self.nlate += 1
+                continue
+            heapq.heappush(heap, p)
+            if len(heap) >= self.window:
+                p = heapq.heappop(heap)
+                if p != last:
+                    yield p
+                    last = p
+        while heap:
+            p = heapq.heappop(heap)
+            if p != last:
+                yield p
+                last = p
+
+    def __iter__(self) -> typing.Iterator[int]:
+        for p in self.__ascending():
+            self.done.add(p)
+            yield p
+        if not self.nlate:
+            return
+        done = iter(self.done)
+        d = next(done, None)
+        for p in self.late:
+            while d is not None and d < p:
+                d = next(done, None)
+            if d != p:
+                yield p
+
+    def close(self) -> None:
+        self.done.close()
+        self.late.close()
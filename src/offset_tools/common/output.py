@@ -0,0 +1,416 @@
+# flake8: noqa: E501
+#
+#   (C) Sebastian Weigmann, 2025
+#   This software is released under:
+#   GNU GENERAL PUBLIC LICENSE, Version 3
+#   Please find the full text in LICENSE.
+#
+# generic imports
+import typing
+import os
+import io
+import time
+import queue
+import struct
+import tarfile
+import tempfile
+import threading
+import json
+import base64
+
+# specific imports
+try:
+    from common import sources
+except ModuleNotFoundError:
+    from offset_tools.common import sources
+
+
+# output sinks for extracted data. every result is handed over as
+#   write(offset, span, name, data)
+# where name is the file name the result gets in a directory or container.
+# data is bytes or, for large results with --zero-copy, a sources.SpanData
+# which is only read while it is written, see write_data(). meta holds
+# what is known about the hit besides its offset (target, yara rule and
+# string, digest), only the structured formats write it.
+class Output(object):
+    def write(self, offset: int, span: tuple[int, int], name: str, data: bytes | sources.SpanData, meta: dict[str, typing.Any] | None = None) -> None:
+        raise NotImplementedError
+
+    # returns once every result handed to write() is written, for checkpoints
+    def sync(self) -> None:
+        pass
+
+    def close(self) -> None:
+        pass
+
+
+# all results concatenated into one stream, e.g. stdout. with flush, every
+# result is passed on right away instead of once the buffer is full.
+class StreamOutput(Output):
+    def __init__(self, stream: typing.BinaryIO, flush: bool = False):
+        self.stream = stream
+        self.flush = flush
+
+    def write(self, offset: int, span: tuple[int, int], name: str, data: bytes | sources.SpanData, meta: dict[str, typing.Any] | None = None) -> None:
+        write_data(self.stream, data)
+        if self.flush:
+            self.stream.flush()
+
+    def close(self) -> None:
+        self.stream.flush()
+
+
+# one file per result below outdir, directories are created once.
+# sync() flushes the files written since the last sync() and the
+# directories holding them to disk, nothing else.
+class DirOutput(Output):
+    def __init__(self, outdir: str):
+        self.outdir = outdir
+        self.dirs: set[str] = set()
+        self.lock = threading.Lock()
+        self.unsynced: list[str] = []
+        self.unsynced_dirs: set[str] = set()
+
+    def write(self, offset: int, span: tuple[int, int], name: str, data: bytes | sources.SpanData, meta: dict[str, typing.Any] | None = None) -> None:
+        opfname = os.path.join(self.outdir, name)
+        dirname = os.path.dirname(opfname)
+        if dirname not in self.dirs:
+            os.makedirs(dirname, exist_ok=True)
+            with self.lock:
+                self.dirs.add(dirname)
+                # new directories are entries of their parents, up to outdir
+                parent = os.path.dirname(dirname)
+                while len(parent) > len(self.outdir):
+                    self.unsynced_dirs.add(parent)
+                    parent = os.path.dirname(parent)
+                self.unsynced_dirs.add(self.outdir)
+        with open(opfname, "wb") as ofile:
+            write_data(ofile, data)
+        with self.lock:
+            self.unsynced.append(opfname)
+            self.unsynced_dirs.add(dirname)
+
+    def sync(self) -> None:
+        with self.lock:
+            paths, self.unsynced = self.unsynced, []
+            dirs, self.unsynced_dirs = self.unsynced_dirs, set()
+        for path in paths:
+            fsync_path(path)
+        for dirname in dirs:
+            fsync_path(dirname, directory=True)
+
+
+# one tar archive holding one member per result, streamable to stdout
+class TarOutput(Output):
+    def __init__(self, path: str, stream: typing.BinaryIO | None = None):
+        self.stream = stream
+        if stream is not None:
+            self.tar = tarfile.open(fileobj=stream, mode="w|")
+        else:
+            self.tar = tarfile.open(path, mode="w")
+        self.mtime = time.time()
+
+    def write(self, offset: int, span: tuple[int, int], name: str, data: bytes | sources.SpanData, meta: dict[str, typing.Any] | None = None) -> None:
+        info = tarfile.TarInfo(name)
+        info.size = len(data)
+        info.mtime = self.mtime
+        self.tar.addfile(info, data.reader() if isinstance(data, sources.SpanData) else io.BytesIO(data))
+
+    def close(self) -> None:
+        self.tar.close()
+        if self.stream is not None:
+            self.stream.flush()
+
+
+# pack: all results back to back, followed by an index and a footer.
+# index entry: offset, position and length in the pack, span start and
+# length in the input, name length, name (utf-8)
+# footer: magic, position of the index, number of entries
+PACK_MAGIC = b"OTPACK01"
+PACK_ENTRY = struct.Struct("<QQQqqH")
+PACK_FOOTER = struct.Struct("<8sQQ")
+
+
+class PackOutput(Output):
+    def __init__(self, path: str, stream: typing.BinaryIO | None = None):
+        self.stream = stream if stream is not None else open(path, "wb")
+        self.owned = stream is None
+        self.position = 0
+        self.count = 0
+        # index entries are spooled, so millions of results cost no memory
+        self.index = tempfile.TemporaryFile()
+
+    def write(self, offset: int, span: tuple[int, int], name: str, data: bytes | sources.SpanData, meta: dict[str, typing.Any] | None = None) -> None:
+        write_data(self.stream, data)
+        bname = name.encode("utf-8")
+        self.index.write(PACK_ENTRY.pack(offset, self.position, len(data), span[0], span[1], len(bname)) + bname)
+        self.position += len(data)
+        self.count += 1
+
+    def close(self) -> None:
+        self.index.seek(0)
+        while True:
+            buf = self.index.read(1 << 20)
+            if not buf:
+                break
+            self.stream.write(buf)
+        self.stream.write(PACK_FOOTER.pack(PACK_MAGIC, self.position, self.count))
+        self.index.close()
+        if self.owned:
+            self.stream.close()
+        else:
+            self.stream.flush()
+
+
+# structured formats, one record per hit. the metadata of a record is a
+# json object: offset, span [start, length], target, rule and string (yara
+# rule name and string id, null for strings and scan) and with --nodupes
+# digest (hex) and dup. a dup has no data, the first record with the same
+# digest holds it.
+#   jsonl     one json object per line, data base64 encoded
+#   records   per record a RECORD_HEADER (magic, length of the metadata,
+#             length of the data), the metadata (utf-8) and the data as is
+RECORD_MAGIC = b"OTR1"
+RECORD_HEADER = struct.Struct("<4sIQ")
+
+
+def record_meta(offset: int, span: tuple[int, int], meta: dict[str, typing.Any] | None) -> dict[str, typing.Any]:
+    return {"offset": offset, "span": list(span), **(meta or {})}
+
+
+class JsonlOutput(Output):
+    def __init__(self, path: str, stream: typing.BinaryIO | None = None):
+        self.stream = stream if stream is not None else open(path, "wb")
+        self.owned = stream is None
+
+    def write(self, offset: int, span: tuple[int, int], name: str, data: bytes | sources.SpanData, meta: dict[str, typing.Any] | None = None) -> None:
+        record = record_meta(offset, span, meta)
+        if record.get("dup"):
+            self.stream.write(json.dumps(record).encode("utf-8") + b"\n")
+            return
+        # the data is encoded while it is written, large results in chunks
+        self.stream.write(json.dumps(record)[:-1].encode("utf-8") + b', "data": "')
+        chunks = data.chunks() if isinstance(data, sources.SpanData) else [data]
+        rest = b""
+        for chunk in chunks:
+            chunk = rest + chunk
+            n = len(chunk) - len(chunk) % 3
+            self.stream.write(base64.b64encode(chunk[:n]))
+            rest = chunk[n:]
+        self.stream.write(base64.b64encode(rest) + b'"}\n')
+
+    def close(self) -> None:
+        if self.owned:
+            self.stream.close()
+        else:
+            self.stream.flush()
+
+
+class RecordOutput(JsonlOutput):
+    def write(self, offset: int, span: tuple[int, int], name: str, data: bytes | sources.SpanData, meta: dict[str, typing.Any] | None = None) -> None:
+        record = record_meta(offset, span, meta)
+        bmeta = json.dumps(record).encode("utf-8")
+        length = 0 if record.get("dup") else len(data)
+        self.stream.write(RECORD_HEADER.pack(RECORD_MAGIC, len(bmeta), length) + bmeta)
+        if length:
+            write_data(self.stream, data)
+
+
+# read back a records file: yields (metadata, data)
+def read_records(path: str) -> typing.Iterator[tuple[dict[str, typing.Any], bytes]]:
+    with open(path, "rb") as f:
+        while True:
+            header = f.read(RECORD_HEADER.size)
+            if not header:
+                return
+            magic, metalen, length = RECORD_HEADER.unpack(header)
+            if magic != RECORD_MAGIC:
+                raise ValueError(f"not a records file: {path}")
+            meta = json.loads(f.read(metalen))
+            yield meta, f.read(length)
+
+
+# write data to stream. SpanData of a plain file input goes from file to
+# file by the kernel (copy_file_range, or sendfile e.g. into a pipe) if
+# stream has a file descriptor, whatever is left is copied in chunks.
+def write_data(stream: typing.BinaryIO, data: bytes | sources.SpanData) -> None:
+    if not isinstance(data, sources.SpanData):
+        stream.write(data)
+        return
+    done = 0
+    span = data.kernel_span()
+    if span is not None:
+        try:
+            fd = stream.fileno()
+        except (AttributeError, OSError, io.UnsupportedOperation):
+            fd = -1
+        if fd >= 0:
+            stream.flush()
+            infd, position, length = span
+            done = copy_span(infd, position, length, fd)
+    for chunk in data.chunks(done):
+        stream.write(chunk)
+
+
+# copies up to length bytes at position of infd to the current position of
+# outfd, returns the number of bytes copied. stops early where the kernel
+# refuses, e.g. across file systems on old kernels or into a tty.
+def copy_span(infd: int, position: int, length: int, outfd: int) -> int:
+    done = 0
+    for method in ("copy_file_range", "sendfile"):
+        if not hasattr(os, method):
+            continue
+        try:
+            while done < length:
+                if method == "copy_file_range":
+                    n = os.copy_file_range(infd, outfd, length - done, position + done)
+                else:
+                    n = os.sendfile(outfd, infd, position + done, length - done)
+                if n == 0:
+                    return done
+                done += n
+            return done
+        except OSError:
+            continue
+    return done
+
+
+# read back a pack file: yields (offset, span, name, data)
+def read_pack(path: str) -> typing.Iterator[tuple[int, tuple[int, int], str, bytes]]:
+    with open(path, "rb") as f:
+        f.seek(-PACK_FOOTER.size, os.SEEK_END)
+        magic, idxpos, count = PACK_FOOTER.unpack(f.read(PACK_FOOTER.size))
+        if magic != PACK_MAGIC:
+            raise ValueError(f"not a pack file: {path}")
+        f.seek(idxpos)
+        for _ in range(count):
+            offset, position, length, start, span_length, namelen = PACK_ENTRY.unpack(f.read(PACK_ENTRY.size))
+            name = f.read(namelen).decode("utf-8")
+            idxpos = f.tell()
+            f.seek(position)
+            data = f.read(length)
+            f.seek(idxpos)
+            yield offset, (start, span_length), name, data
+
+
+# write-behind: results are queued and written by a background thread,
+# extraction only blocks once depth results are waiting. errors of the
+# writer are raised on the next write() or on close(). a SpanData result
+# reads from the input, which may be closed after extraction: write()
+# waits until it is written.
+class WriteBehind(Output):
+    def __init__(self, output: Output, depth: int = 1024):
+        self.output = output
+        self.queue: queue.Queue = queue.Queue(maxsize=depth)
+        self.error: BaseException | None = None
+        self.thread = threading.Thread(target=self.__run, name="write-behind", daemon=True)
+        self.thread.start()
+
+    def __run(self) -> None:
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+            if isinstance(item, threading.Event):
+                # sync(): everything queued before is written
+                item.set()
+                continue
+            if self.error is None:
+                try:
+                    self.output.write(*item[:5])
+                except BaseException as excpt:
+                    self.error = excpt
+            if item[5] is not None:
+                item[5].set()
+
+    def write(self, offset: int, span: tuple[int, int], name: str, data: bytes | sources.SpanData, meta: dict[str, typing.Any] | None = None) -> None:
+        if self.error is not None:
+            raise self.error
+        done = threading.Event() if isinstance(data, sources.SpanData) else None
+        self.queue.put((offset, span, name, data, meta, done))
+        if done is not None:
+            done.wait()
+            if self.error is not None:
+                raise self.error
+
+    def sync(self) -> None:
+        if not self.thread.is_alive():
+            # closed, everything is written
+            self.output.sync()
+            return
+        done = threading.Event()
+        self.queue.put(done)
+        done.wait()
+        if self.error is not None:
+            raise self.error
+        self.output.sync()
+
+    def close(self) -> None:
+        self.queue.put(None)
+        self.thread.join()
+        self.output.close()
+        if self.error is not None:
+            raise self.error
+
+
+# without a write-behind queue: writes of several threads (one per target,
+# see offset_dump.dump_targets) are passed on one at a time
+class SerialOutput(Output):
+    def __init__(self, output: Output):
+        self.output = output
+        self.lock = threading.Lock()
+
+    def write(self, offset: int, span: tuple[int, int], name: str, data: bytes | sources.SpanData, meta: dict[str, typing.Any] | None = None) -> None:
+        with self.lock:
+            self.output.write(offset, span, name, data, meta)
+
+    def sync(self) -> None:
+        with self.lock:
+            self.output.sync()
+
+    def close(self) -> None:
+        with self.lock:
+            self.output.close()
+
+
+# flush a file, or the entries of a directory, to disk. directories
+# cannot be flushed on every platform and file system.
+def fsync_path(path: str, directory: bool = False) -> None:
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        if directory:
+            return
+        raise
+    try:
+        os.fsync(fd)
+    except OSError:
+        if not directory:
+            raise
+    finally:
+        os.close(fd)
+
+
+# wrap is applied to the sink itself, below a write-behind queue
+def open_output(fmt: str, outdir: str, outfile: str, depth: int, stdout: typing.BinaryIO, wrap: typing.Callable[[Output], Output] | None = None, flush: bool = False) -> Output:
+    out: Output
+    if fmt == "tar":
+        out = TarOutput(outfile, stdout if outfile == "stdout" else None)
+    elif fmt == "pack":
+        out = PackOutput(outfile, stdout if outfile == "stdout" else None)
+    elif fmt == "jsonl":
+        out = JsonlOutput(outfile, stdout if outfile == "stdout" else None)
+    elif fmt == "records":
+        out = RecordOutput(outfile, stdout if outfile == "stdout" else None)
+    elif outdir != "stdout":
+        out = DirOutput(outdir)
+    else:
+        out = StreamOutput(stdout, flush)
+        return wrap(out) if wrap is not None else out
+    # files of a directory are independent, containers are not
+    serial = not isinstance(out, DirOutput)
+    if wrap is not None:
+        out = wrap(out)
+    if depth > 0:
+        return WriteBehind(out, depth)
+    return SerialOutput(out) if serial else out
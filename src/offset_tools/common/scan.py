@@ -0,0 +1,96 @@
+# flake8: noqa: E501
+#
+#   (C) Sebastian Weigmann, 2025
+#   This software is released under:
+#   GNU GENERAL PUBLIC LICENSE, Version 3
+#   Please find the full text in LICENSE.
+#
+# generic imports
+import typing
+import os
+import re
+import heapq
+
+# specific imports
+try:
+    from common import sources
+except ModuleNotFoundError:
+    from offset_tools.common import sources
+
+# scanned per read on inputs which are not in memory as a whole
+CHUNKSIZE = 16 << 20
+# regex matches may reach this far past the end of a chunk
+MAX_MATCH = 1 << 16
+
+
+# byte patterns for the scan method, in the spirit of yara text strings:
+#   literal or regex (python re syntax on bytes)
+#   nocase  ascii case insensitive
+#   ascii   the pattern as it is (default)
+#   wide    every character followed by a zero byte (utf-16le), literals only
+# every pattern and encoding is matched on its own, so hits of different
+# patterns may overlap. hits of the same pattern do not, like re.finditer.
+class Patterns(object):
+    def __init__(self, patterns: typing.Iterable[bytes | str], regex: bool = False, nocase: bool = False, ascii: bool = True, wide: bool = False):
+        flags = re.IGNORECASE if nocase else 0
+        self.compiled: list[re.Pattern] = []
+        longest = 0
+        for text in patterns:
+            # command line patterns are str, --patternfile lines are bytes
+            pattern = os.fsencode(text) if isinstance(text, str) else text
+            if not pattern:
+                raise ValueError("empty scan pattern")
+            if regex and wide:
+                raise ValueError("wide works with literal patterns only")
+            variants = []
+            if ascii:
+                variants.append(pattern if regex else re.escape(pattern))
+            if wide:
+                variants.append(b"".join(re.escape(pattern[i:i + 1]) + b"\x00" for i in range(len(pattern))))
+                longest = max(longest, 2 * len(pattern))
+            longest = max(longest, len(pattern))
+            for variant in variants:
+                self.compiled.append(re.compile(variant, flags))
+        if not self.compiled:
+            raise ValueError("no scan patterns")
+        # literals cannot reach further than their own length
+        self.overlap = MAX_MATCH if regex else longest - 1
+
+    # ascending match offsets in source from start on, without duplicates.
+    # inputs in memory are searched as a whole, others in chunks of
+    # chunksize bytes read once, each followed by overlap bytes of the next one.
+    def finditer(self, source: sources.Source, chunksize: int = CHUNKSIZE, start: int = 0) -> typing.Iterator[int]:
+        buf = source.buffer_view()
+        if buf is not None:
+            yield from self.__unique(heapq.merge(*[(m.start() for m in rec.finditer(buf, start)) for rec in self.compiled]))
+            return
+        # per pattern, where its next match may start: matches of the same
+        # pattern do not overlap across chunks either
+        resume = [start] * len(self.compiled)
+        last = -1
+        position = start
+        while position < source.size:
+            data = source.read(position, chunksize + self.overlap)
+            final = position + len(data) >= source.size
+            hits = []
+            for i, rec in enumerate(self.compiled):
+                for m in rec.finditer(data, max(0, resume[i] - position)):
+                    if m.start() >= chunksize and not final:
+                        break
+                    hits.append(m.start() + position)
+                    resume[i] = max(m.end(), m.start() + 1) + position
+            for p in sorted(hits):
+                if p > last:
+                    yield p
+                    last = p
+            if final:
+                return
+            position += chunksize
+
+    @staticmethod
+    def __unique(offsets: typing.Iterable[int]) -> typing.Iterator[int]:
+        last = -1
+        for p in offsets:
+            if p != last:
+                yield p
+                last = p
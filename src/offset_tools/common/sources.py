@@ -0,0 +1,499 @@
+# flake8: noqa: E501
+#
+#   (C) Sebastian Weigmann, 2025
+#   This software is released under:
+#   GNU GENERAL PUBLIC LICENSE, Version 3
+#   Please find the full text in LICENSE.
+#
+# generic imports
+import typing
+import os
+import io
+import re
+import mmap
+import stat
+import errno
+import struct
+import bisect
+import shutil
+import tempfile
+import threading
+import collections
+try:
+    import fcntl
+except ImportError:
+    fcntl = None  # type: ignore[assignment]
+
+# linux ioctl for the size of a block device in bytes
+BLKGETSIZE64 = 0x80081272
+# copy size when spooling input that cannot seek
+SPOOL_CHUNK = 1 << 20
+# access pattern hints of Source.advise() as far as the platform has them
+FADVISE = {name: getattr(os, "POSIX_FADV_" + name.upper()) for name in ["normal", "random", "sequential", "willneed"] if hasattr(os, "POSIX_FADV_" + name.upper())}
+MADVISE = {name: getattr(mmap, "MADV_" + name.upper()) for name in ["normal", "random", "sequential", "willneed"] if hasattr(mmap, "MADV_" + name.upper())}
+
+
+# random access backends for BlockLine.
+# all backends share the same small interface:
+#   size            total number of bytes
+#   read(pos, n)    like file.read(n) after file.seek(pos), n < 0 reads to EOF
+#   find(s, pos)    first index of s at or after pos, -1 if not found
+#   rfind(s, pos)   last index of s ending at or before pos, -1 if not found
+#   advise(pos, n, advice)
+#                   hint "willneed", "random", "sequential" or "normal"
+#                   access for n bytes at pos (n = 0: up to the end)
+#   data_extents(start, end)
+#                   (start, end) ranges within [start, end) which may hold
+#                   other bytes than zeros, i.e. without holes of sparse files
+#   kernel_span(pos, n)
+#                   (fd, pos, n) of a plain file holding these n bytes at pos,
+#                   for copies by the kernel. None if there is none.
+#   buffer_view()   the whole input as one buffer (mmap or memoryview) for
+#                   searches across all of it. None if it is not in memory.
+# advise, data_extents, kernel_span and buffer_view default to no hints,
+# no holes, no file and no buffer.
+# find and rfind default to searching windows of bufsize bytes returned
+# by read(). windows overlap by len(substring) - 1 bytes so that multi
+# byte separators (windows line endings) are found across window borders.
+class Source(object):
+    size: int = 0
+    name: str | None = None
+    bufsize: int = 512
+
+    def read(self, position: int, length: int) -> bytes:
+        raise NotImplementedError
+
+    def find(self, substring: bytes, position: int) -> int:
+        self._check_position(position)
+        p = position
+        overlap = len(substring) - 1
+        while p < self.size:
+            sz = min(self.bufsize + overlap, self.size - p)
+            idx = self.read(p, sz).find(substring)
+            if idx >= 0:
+                return idx + p
+            p += self.bufsize
+        return -1
+
+    def rfind(self, substring: bytes, position: int) -> int:
+        self._check_position(position)
+        p = min(position, self.size)
+        overlap = len(substring) - 1
+        while p > 0:
+            sz = min(self.bufsize, p)
+            end = min(p + overlap, position, self.size)
+            p -= sz
+            idx = self.read(p, end - p).rfind(substring)
+            if idx >= 0:
+                return idx + p
+        return -1
+
+    def advise(self, position: int, length: int, advice: str) -> None:
+        pass
+
+    def data_extents(self, start: int, end: int) -> list[tuple[int, int]]:
+        return [(start, end)] if start < end else []
+
+    def kernel_span(self, position: int, length: int) -> tuple[int, int, int] | None:
+        return None
+
+    def buffer_view(self) -> typing.Any:
+        return None
+
+    def close(self) -> None:
+        pass
+
+    @staticmethod
+    def _check_position(position: int) -> None:
+        if position < 0:
+            raise ValueError(f"negative position: {position}")
+
+    @staticmethod
+    def _check_length(length: int) -> None:
+        if length < -1:
+            raise ValueError("read length must be non-negative or -1")
+
+
+# file handle backend: reads in windows of bufsize bytes.
+# reads use os.pread where the handle has a file descriptor, so one
+# source can be shared by several threads without a shared file offset.
+class FileSource(Source):
+    def __init__(self, filehandle: typing.BinaryIO, bufsize: int = 512):
+        self.filehandle = filehandle
+        self.name = getattr(filehandle, "name", None)
+        self.bufsize = bufsize
+        self.size = input_size(filehandle)
+        try:
+            self.fd: int | None = filehandle.fileno() if hasattr(os, "pread") else None
+        except (OSError, AttributeError):
+            self.fd = None
+
+    def read(self, position: int, length: int) -> bytes:
+        self._check_position(position)
+        self._check_length(length)
+        if self.fd is None:
+            self.filehandle.seek(position)
+            return self.filehandle.read(length)
+        if length < 0:
+            length = max(0, self.size - position)
+        # pread may return less than asked for, e.g. above 2 GiB on linux
+        parts = []
+        while length > 0:
+            buf = os.pread(self.fd, length, position)
+            if not buf:
+                break
+            parts.append(buf)
+            length -= len(buf)
+            position += len(buf)
+        return b"".join(parts)
+
+    def advise(self, position: int, length: int, advice: str) -> None:
+        if self.fd is not None and advice in FADVISE:
+            try:
+                os.posix_fadvise(self.fd, position, length, FADVISE[advice])
+            except OSError:
+                pass
+
+    def data_extents(self, start: int, end: int) -> list[tuple[int, int]]:
+        if self.fd is None:
+            return super().data_extents(start, end)
+        return fd_data_extents(self.fd, start, end)
+
+    def kernel_span(self, position: int, length: int) -> tuple[int, int, int] | None:
+        return None if self.fd is None else (self.fd, position, length)
+
+
+# memory mapped backend: the kernel pages in what find/rfind touch,
+# no python level windows and copies except for the final slice.
+class MmapSource(Source):
+    def __init__(self, filehandle: typing.BinaryIO):
+        self.name = getattr(filehandle, "name", None)
+        # block devices report st_size 0, so map by the device size
+        self.size = input_size(filehandle)
+        self.fd = filehandle.fileno()
+        self.map = mmap.mmap(self.fd, self.size, access=mmap.ACCESS_READ)
+
+    def read(self, position: int, length: int) -> bytes:
+        self._check_position(position)
+        self._check_length(length)
+        if length < 0:
+            return self.map[position:]
+        return self.map[position:position + length]
+
+    def find(self, substring: bytes, position: int) -> int:
+        self._check_position(position)
+        return self.map.find(substring, position)
+
+    def rfind(self, substring: bytes, position: int) -> int:
+        self._check_position(position)
+        return self.map.rfind(substring, 0, position)
+
+    def advise(self, position: int, length: int, advice: str) -> None:
+        if advice not in MADVISE:
+            return
+        # madvise ranges start at a page border
+        start = position - position % mmap.PAGESIZE
+        end = self.size if length <= 0 else min(position + length, self.size)
+        try:
+            if start < end:
+                self.map.madvise(MADVISE[advice], start, end - start)
+        except (OSError, ValueError):
+            pass
+
+    def data_extents(self, start: int, end: int) -> list[tuple[int, int]]:
+        return fd_data_extents(self.fd, start, end)
+
+    def kernel_span(self, position: int, length: int) -> tuple[int, int, int] | None:
+        return self.fd, position, length
+
+    def buffer_view(self) -> typing.Any:
+        return self.map
+
+    def close(self) -> None:
+        self.map.close()
+
+
+# in-memory input: bytes, bytearray, mmap or anything else exposing the
+# buffer protocol. reads are slices, searches run on the buffer itself
+# where it has find/rfind, others are searched in windows.
+class BufferSource(Source):
+    def __init__(self, buffer: typing.Any, name: str | None = None, bufsize: int = 1 << 16):
+        self.buffer = buffer
+        self.view = memoryview(buffer).cast("B")
+        self.name = name
+        self.bufsize = bufsize
+        self.size = len(self.view)
+        self.searchable = hasattr(buffer, "find") and hasattr(buffer, "rfind")
+
+    def read(self, position: int, length: int) -> bytes:
+        self._check_position(position)
+        self._check_length(length)
+        if length < 0:
+            return bytes(self.view[position:])
+        return bytes(self.view[position:position + length])
+
+    def find(self, substring: bytes, position: int) -> int:
+        if not self.searchable:
+            return super().find(substring, position)
+        self._check_position(position)
+        return self.buffer.find(substring, position)
+
+    def rfind(self, substring: bytes, position: int) -> int:
+        if not self.searchable:
+            return super().rfind(substring, position)
+        self._check_position(position)
+        return self.buffer.rfind(substring, 0, position)
+
+    def buffer_view(self) -> typing.Any:
+        return self.view
+
+    def close(self) -> None:
+        self.view.release()
+
+
+# numbered segments of a split image, starting with the given one:
+# disk.001, disk.002, ... up to the first number that does not exist
+def segment_paths(first: str) -> list[str]:
+    m = re.match(r"^(.*\.)(\d+)$", first)
+    if m is None:
+        raise ValueError(f"not a numbered segment: {first}")
+    prefix, digits = m.groups()
+    paths = []
+    n = int(digits)
+    while os.path.isfile(f"{prefix}{n:0{len(digits)}d}"):
+        paths.append(f"{prefix}{n:0{len(digits)}d}")
+        n += 1
+    return paths
+
+
+# segments of a split image as one input. a logical position maps to a
+# segment and a position within it, reads crossing a segment end are
+# served from both. at most max_open segments are kept open, the least
+# recently used idle one is closed first.
+class SegmentedSource(Source):
+    def __init__(self, paths: list[str], bufsize: int = 512, use_mmap: bool = True, max_open: int = 16):
+        if not paths:
+            raise ValueError("no segments")
+        self.paths = paths
+        self.name = paths[0]
+        self.bufsize = bufsize
+        self.use_mmap = use_mmap
+        self.max_open = max_open
+        self.starts = []
+        self.size = 0
+        for path in paths:
+            self.starts.append(self.size)
+            self.size += os.path.getsize(path)
+        self.pool: collections.OrderedDict[int, tuple[typing.BinaryIO, Source]] = collections.OrderedDict()
+        self.users: collections.Counter = collections.Counter()
+        self.lock = threading.Lock()
+
+    def __acquire(self, i: int) -> Source:
+        with self.lock:
+            if i not in self.pool:
+                f = open(self.paths[i], "rb")
+                self.pool[i] = (f, open_source(f, self.bufsize, self.use_mmap))
+            self.pool.move_to_end(i)
+            self.users[i] += 1
+            # segments still read by other threads stay open
+            for j in [j for j in self.pool if self.users[j] == 0][:max(0, len(self.pool) - self.max_open)]:
+                self.__close(j)
+            return self.pool[i][1]
+
+    def __release(self, i: int) -> None:
+        with self.lock:
+            self.users[i] -= 1
+
+    def __close(self, i: int) -> None:
+        f, src = self.pool.pop(i)
+        src.close()
+        f.close()
+
+    # (segment, position within it, length) of the pieces of [position, end)
+    def __pieces(self, position: int, end: int) -> typing.Iterator[tuple[int, int, int]]:
+        i = bisect.bisect_right(self.starts, position) - 1
+        while position < end:
+            seg_end = self.starts[i + 1] if i + 1 < len(self.starts) else self.size
+            n = min(end, seg_end) - position
+            if n > 0:
+                yield i, position - self.starts[i], n
+                position += n
+            i += 1
+
+    def read(self, position: int, length: int) -> bytes:
+        self._check_position(position)
+        self._check_length(length)
+        end = self.size if length < 0 else min(position + length, self.size)
+        parts = []
+        for i, seg_position, n in self.__pieces(position, end):
+            src = self.__acquire(i)
+            try:
+                parts.append(src.read(seg_position, n))
+            finally:
+                self.__release(i)
+        return parts[0] if len(parts) == 1 else b"".join(parts)
+
+    def advise(self, position: int, length: int, advice: str) -> None:
+        end = self.size if length <= 0 else min(position + length, self.size)
+        for i, seg_position, n in self.__pieces(position, end):
+            src = self.__acquire(i)
+            try:
+                src.advise(seg_position, n, advice)
+            finally:
+                self.__release(i)
+
+    def data_extents(self, start: int, end: int) -> list[tuple[int, int]]:
+        extents: list[tuple[int, int]] = []
+        for i, seg_position, n in self.__pieces(start, end):
+            src = self.__acquire(i)
+            try:
+                for s, e in src.data_extents(seg_position, seg_position + n):
+                    s, e = s + self.starts[i], e + self.starts[i]
+                    # data running across a segment border is one extent,
+                    # separators may be split between the segments
+                    if extents and extents[-1][1] == s:
+                        extents[-1] = (extents[-1][0], e)
+                    else:
+                        extents.append((s, e))
+            finally:
+                self.__release(i)
+        return extents
+
+    def close(self) -> None:
+        with self.lock:
+            for i in list(self.pool):
+                self.__close(i)
+
+
+# a result that is not read yet: the bytes at start of a source.
+# results from --zero-copy on are handed to the outputs like this, which
+# copy them in chunks or have the kernel copy them (see output.write_data),
+# so no result is held in memory as a whole. bytes(data) reads it at once.
+# valid only as long as the source is open.
+class SpanData(object):
+    chunksize = 1 << 20
+
+    def __init__(self, source: Source, start: int, length: int):
+        Source._check_position(start)
+        self.source = source
+        self.start = start
+        self.length = max(0, min(length, source.size - start))
+
+    def __len__(self) -> int:
+        return self.length
+
+    def __bytes__(self) -> bytes:
+        return self.source.read(self.start, self.length)
+
+    def chunks(self, skip: int = 0) -> typing.Iterator[bytes]:
+        position = self.start + skip
+        end = self.start + self.length
+        while position < end:
+            buf = self.source.read(position, min(self.chunksize, end - position))
+            if not buf:
+                return
+            yield buf
+            position += len(buf)
+
+    def kernel_span(self) -> tuple[int, int, int] | None:
+        return self.source.kernel_span(self.start, self.length)
+
+    # a file object reading the span, e.g. for tarfile
+    def reader(self) -> typing.BinaryIO:
+        return io.BufferedReader(SpanReader(self), self.chunksize)
+
+
+class SpanReader(io.RawIOBase):
+    def __init__(self, data: SpanData):
+        self.data = data
+        self.position = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buf: typing.Any) -> int:
+        n = min(len(buf), self.data.length - self.position)
+        if n <= 0:
+            return 0
+        part = self.data.source.read(self.data.start + self.position, n)
+        buf[:len(part)] = part
+        self.position += len(part)
+        return len(part)
+
+
+# size of an open input: st_size of regular files, the device size of
+# block devices (BLKGETSIZE64, linux), seeking to the end for the rest
+def input_size(filehandle: typing.BinaryIO) -> int:
+    try:
+        st = os.fstat(filehandle.fileno())
+    except (OSError, AttributeError, ValueError):
+        st = None
+    if st is not None and stat.S_ISREG(st.st_mode):
+        return st.st_size
+    if st is not None and stat.S_ISBLK(st.st_mode) and fcntl is not None:
+        try:
+            return struct.unpack("Q", fcntl.ioctl(filehandle.fileno(), BLKGETSIZE64, bytes(8)))[0]
+        except OSError:
+            pass
+    filehandle.seek(0, os.SEEK_END)
+    return filehandle.tell()
+
+
+# data_extents() of a file descriptor by SEEK_DATA / SEEK_HOLE. where the
+# platform or file system does not support them, all of it is data.
+def fd_data_extents(fd: int, start: int, end: int) -> list[tuple[int, int]]:
+    if start >= end:
+        return []
+    if not hasattr(os, "SEEK_DATA"):
+        return [(start, end)]
+    extents: list[tuple[int, int]] = []
+    position = start
+    try:
+        # the file offset is shared with the file handle and any dup() of
+        # fd, it is put back for readers relying on it
+        saved = os.lseek(fd, 0, os.SEEK_CUR)
+    except OSError:
+        return [(start, end)]
+    try:
+        while position < end:
+            try:
+                data = os.lseek(fd, position, os.SEEK_DATA)
+            except OSError as excpt:
+                # nothing but a hole up to the end of the file
+                if excpt.errno == errno.ENXIO:
+                    break
+                raise
+            if data >= end:
+                break
+            position = min(os.lseek(fd, data, os.SEEK_HOLE), end)
+            extents.append((data, position))
+    except OSError:
+        return [(start, end)]
+    finally:
+        os.lseek(fd, saved, os.SEEK_SET)
+    return extents
+
+
+# copy of a handle that cannot seek (pipes, ttys, sockets) in an
+# anonymous temporary file, results can be anywhere in the input
+def spool(filehandle: typing.BinaryIO) -> typing.BinaryIO:
+    copy = tempfile.TemporaryFile()
+    shutil.copyfileobj(filehandle, copy, SPOOL_CHUNK)
+    copy.flush()
+    return typing.cast(typing.BinaryIO, copy)
+
+
+# pick the fastest backend that works for the given file handle.
+# input that cannot seek is spooled to a temporary file first. empty
+# files and anything else that cannot be mapped fall back to reading
+# with pread / seek + read.
+def open_source(filehandle: typing.BinaryIO, bufsize: int = 512, use_mmap: bool = True) -> Source:
+    seekable = getattr(filehandle, "seekable", None)
+    if seekable is not None and not seekable():
+        filehandle = spool(filehandle)
+    if use_mmap:
+        try:
+            return MmapSource(filehandle)
+        except (OSError, ValueError, OverflowError, AttributeError):
+            pass
+    return FileSource(filehandle, bufsize)
@@ -0,0 +1,207 @@
+# flake8: noqa: E501
+#
+#   (C) Sebastian Weigmann, 2025
+#   This software is released under:
+#   GNU GENERAL PUBLIC LICENSE, Version 3
+#   Please find the full text in LICENSE.
+#
+# generic imports
+import typing
+import json
+import time
+import threading
+import contextlib
+import collections
+
+# specific imports
+try:
+    from common import errors as ERR
+    from common import sources
+    from common import output
+except ModuleNotFoundError:
+    from offset_tools.common import errors as ERR
+    from offset_tools.common import sources
+    from offset_tools.common import output
+
+
+# opt-in instrumentation for --stats. nothing here is created without it,
+# the hot loops only check for None.
+# counters:
+#   reads, bytes_read, searches   input access through the source
+#   line_lookups                  separator lookups of BlockLine
+#   results, dup_spans, dup_data  offsets resolved, dropped by --nodupes
+#   written, bytes_written        results handed to the output
+# phases (seconds, summed over threads):
+#   offsets   reading and sorting the offset input
+#   extract   resolving spans and reading them
+#   dedup     hashing for --nodupes
+#   output    handing results over, waiting for a full write queue included
+#   write     writing results, in the background with --outdir and containers
+class Stats(object):
+    def __init__(self, progress: float = 10.0):
+        self.start = time.perf_counter()
+        self.counters: collections.Counter = collections.Counter()
+        self.phases: collections.defaultdict = collections.defaultdict(float)
+        self.lock = threading.Lock()
+        self.done = threading.Event()
+        self.thread: threading.Thread | None = None
+        if progress > 0:
+            self.thread = threading.Thread(target=self.__progress, args=(progress,), name="stats", daemon=True)
+            self.thread.start()
+
+    def count(self, name: str, n: int = 1) -> None:
+        with self.lock:
+            self.counters[name] += n
+
+    def add_time(self, name: str, seconds: float) -> None:
+        with self.lock:
+            self.phases[name] += seconds
+
+    @contextlib.contextmanager
+    def phase(self, name: str) -> typing.Iterator[None]:
+        t = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(name, time.perf_counter() - t)
+
+    # iterate, timing every step as phase and counting the items
+    def timed_iter(self, name: str, iterable: typing.Iterable[typing.Any], counter: str) -> typing.Iterator[typing.Any]:
+        it = iter(iterable)
+        while True:
+            t = time.perf_counter()
+            try:
+                item = next(it)
+            except StopIteration:
+                self.add_time(name, time.perf_counter() - t)
+                return
+            with self.lock:
+                self.phases[name] += time.perf_counter() - t
+                self.counters[counter] += 1
+            yield item
+
+    # func timed as phase, true results counted as counter
+    def timed_call(self, name: str, func: typing.Callable[..., typing.Any], counter: str | None = None) -> typing.Callable[..., typing.Any]:
+        def call(*args: typing.Any) -> typing.Any:
+            t = time.perf_counter()
+            result = func(*args)
+            with self.lock:
+                self.phases[name] += time.perf_counter() - t
+                if counter is not None and result:
+                    self.counters[counter] += 1
+            return result
+        return call
+
+    def source(self, source: sources.Source) -> sources.Source:
+        return CountingSource(source, self)
+
+    def output(self, out: output.Output) -> output.Output:
+        return CountingOutput(out, self)
+
+    def summary(self) -> dict[str, typing.Any]:
+        with self.lock:
+            counters = dict(self.counters)
+            phases = dict(self.phases)
+        elapsed = time.perf_counter() - self.start
+        offsets = counters.get("results", 0) + counters.get("dup_spans", 0)
+        dups = counters.get("dup_spans", 0) + counters.get("dup_data", 0)
+        return {
+            "elapsed_s": elapsed,
+            "offsets": offsets,
+            "offsets_per_s": offsets / elapsed if elapsed > 0 else 0.0,
+            "dedup_rate": dups / offsets if offsets else 0.0,
+            "counters": counters,
+            "phases_s": phases,
+        }
+
+    def __progress(self, interval: float) -> None:
+        while not self.done.wait(interval):
+            s = self.summary()
+            c = s["counters"]
+            ERR.printmsg(f"progress: {s['offsets']} offsets, {s['offsets_per_s']:.0f}/s, {c.get('bytes_read', 0) >> 20} MiB read, {c.get('written', 0)} results written", ERR.ERRLVL.INFO)
+
+    # stop progress reports, print the summary ("-") or write it as json
+    def close(self, path: str = "-") -> None:
+        self.done.set()
+        if self.thread is not None:
+            self.thread.join()
+        s = self.summary()
+        if path != "-":
+            with open(path, "w") as f:
+                json.dump(s, f, indent=2)
+            return
+        c = s["counters"]
+        ERR.printmsg(f"stats: {s['offsets']} offsets in {s['elapsed_s']:.2f} s, {s['offsets_per_s']:.0f} offsets/s", ERR.ERRLVL.INFO)
+        ERR.printmsg(f"stats: {c.get('reads', 0)} reads, {c.get('bytes_read', 0)} bytes read, {c.get('searches', 0)} searches, {c.get('line_lookups', 0)} line lookups", ERR.ERRLVL.INFO)
+        ERR.printmsg(f"stats: {c.get('dup_spans', 0)} duplicate spans, {c.get('dup_data', 0)} duplicate contents, dedup rate {100 * s['dedup_rate']:.1f} %", ERR.ERRLVL.INFO)
+        ERR.printmsg(f"stats: {c.get('written', 0)} results, {c.get('bytes_written', 0)} bytes written", ERR.ERRLVL.INFO)
+        ERR.printmsg("stats: phases: " + ", ".join(f"{name} {t:.2f} s" for name, t in s["phases_s"].items()), ERR.ERRLVL.INFO)
+
+
+# counts reads, bytes read and searches of a source
+class CountingSource(sources.Source):
+    def __init__(self, source: sources.Source, stats: Stats):
+        self.inner = source
+        self.stats = stats
+        self.size = source.size
+        self.name = source.name
+        self.bufsize = source.bufsize
+
+    def read(self, position: int, length: int) -> bytes:
+        buf = self.inner.read(position, length)
+        with self.stats.lock:
+            self.stats.counters["reads"] += 1
+            self.stats.counters["bytes_read"] += len(buf)
+        return buf
+
+    def find(self, substring: bytes, position: int) -> int:
+        self.stats.count("searches")
+        return self.inner.find(substring, position)
+
+    def rfind(self, substring: bytes, position: int) -> int:
+        self.stats.count("searches")
+        return self.inner.rfind(substring, position)
+
+    def advise(self, position: int, length: int, advice: str) -> None:
+        self.inner.advise(position, length, advice)
+
+    def data_extents(self, start: int, end: int) -> list[tuple[int, int]]:
+        return self.inner.data_extents(start, end)
+
+    # bytes copied by the kernel are counted as one read
+    def kernel_span(self, position: int, length: int) -> tuple[int, int, int] | None:
+        span = self.inner.kernel_span(position, length)
+        if span is not None:
+            with self.stats.lock:
+                self.stats.counters["reads"] += 1
+                self.stats.counters["bytes_read"] += length
+        return span
+
+    # searches in the buffer are not reads, as with find and rfind
+    def buffer_view(self) -> typing.Any:
+        return self.inner.buffer_view()
+
+    def close(self) -> None:
+        self.inner.close()
+
+
+# counts and times results written
+class CountingOutput(output.Output):
+    def __init__(self, out: output.Output, stats: Stats):
+        self.inner = out
+        self.stats = stats
+
+    def write(self, offset: int, span: tuple[int, int], name: str, data: bytes | sources.SpanData, meta: dict[str, typing.Any] | None = None) -> None:
+        t = time.perf_counter()
+        self.inner.write(offset, span, name, data, meta)
+        with self.stats.lock:
+            self.stats.phases["write"] += time.perf_counter() - t
+            self.stats.counters["written"] += 1
+            self.stats.counters["bytes_written"] += len(data)
+
+    def sync(self) -> None:
+        self.inner.sync()
+
+    def close(self) -> None:
+        with self.stats.phase("write"):
+            self.inner.close()
@@ -12,11 +12,19 @@
 #
 #
 # generic imports
+import typing
 import argparse
 import os
 import sys
-import re
+import array
 import hashlib
+import shutil
+import operator
+import itertools
+import tempfile
+import contextlib
+import collections
+import concurrent.futures
 
 # specific imports
 # from enum import IntEnum, StrEnum
@@ -25,11 +33,27 @@ try:
     from common import mytypes as T
     from common import version
     from common import blockline
+    from common import offsets
+    from common import dedup
+    from common import output
+    from common import stats
+    from common import scan
+    from common import checkpoint
+    import api
+    import client
 except ModuleNotFoundError:
     from offset_tools.common import errors as ERR
     from offset_tools.common import mytypes as T
     from offset_tools.common import version
     from offset_tools.common import blockline
+    from offset_tools.common import offsets
+    from offset_tools.common import dedup
+    from offset_tools.common import output
+    from offset_tools.common import stats
+    from offset_tools.common import scan
+    from offset_tools.common import checkpoint
+    from offset_tools import api
+    from offset_tools import client
 
 
 # 3rd-party imports
@@ -41,15 +65,19 @@ my_progver = "2"
 progname = my_progname + " (" + version.progname + ")"
 progver = version.progver + "-" + my_progver
 ERR.verbosity = 0
+# per target output held in memory before spooling to disk in multi-input mode
+SPOOLSIZE = 16 << 20
+# formats writing one record per hit, with its metadata
+STRUCTURED = ("jsonl", "records")
 
 
-def parse_args() -> argparse.Namespace:
+def parse_args(argv: list[str] | None = None) -> argparse.Namespace:
     global progname
     global progver
     parser = argparse.ArgumentParser(
         prog=my_progname,
         description="Get lines or blocks by yara or strings offset",
-        epilog="Note: This tool cannot extract content from multiple files in one run. All offsets given in --offsetfile FILE must originate from the same input!",
+        epilog="Note: All offsets given in --offsetfile FILE must originate from the same --infile FILE! Without --infile, yara output from multiple files (yara -r) is split by the file names it reports.",
     )
     parser.add_argument("--version", action="version", version=progname + " v" + progver)
     parser_common = argparse.ArgumentParser(add_help=False)
@@ -60,12 +88,16 @@ def parse_args() -> argparse.Namespace:
         help="results are given for the smallest offset only, all duplicates are omitted",
     )
     parser_common.add_argument(
-        "--offsetfile",
-        "-f",
-        type=T.type_infile,
-        default="stdin",
+        "--digest",
+        choices=sorted(dedup.DIGESTS),
+        default="sha256",
+        help="digest used by --nodupes to compare results (default: %(default)s)",
+    )
+    parser_common.add_argument(
+        "--dedup-store",
+        default=None,
         metavar="FILE",
-        help="source of offsets (default: %(default)s)",
+        help="keep --nodupes digests in a dbm file instead of memory, for very large runs",
     )
     parser_common.add_argument(
         "--infile",
@@ -73,19 +105,105 @@ def parse_args() -> argparse.Namespace:
         type=T.type_infile,
         default=None,
         metavar="FILE",
-        help="file or image to extract lines or blocks from",
+        help="file or image to extract lines or blocks from (yara: default is every file named in the yara output)",
+    )
+    parser_common.add_argument(
+        "--jobs",
+        "-j",
+        type=int,
+        default=None,
+        metavar="NUM",
+        help="number of worker threads: input files processed in parallel without --infile (default: 4), offset ranges read in parallel with --infile (default: 1)",
+    )
+    parser_common.add_argument(
+        "--queue-depth",
+        type=int,
+        default=None,
+        metavar="NUM",
+        help="offset ranges in flight with --jobs NUM and --infile (default: 2 * NUM)",
+    )
+    parser_common.add_argument(
+        "--offset-memory",
+        type=int,
+        default=256,
+        metavar="MB",
+        help="memory for sorting offsets, larger offset inputs are sorted on disk (default: %(default)d)",
+    )
+    parser_common.add_argument(
+        "--stream",
+        nargs="?",
+        type=int,
+        const=256,
+        default=0,
+        metavar="WINDOW",
+        help="extract while offsets are still arriving, e.g. from strings or yara in a pipe, instead of reading all offsets first. offsets are reordered within WINDOW offsets, later ones are extracted last (default WINDOW: %(const)d)",
     )
     parser_common.add_argument(
         "--outdir",
         "-o",
-        type=T.type_outfile,
         default="stdout",
         metavar="DIR",
         help="write one file per offset to DIR (default: %(default)s)",
     )
+    parser_common.add_argument(
+        "--resume",
+        action="store_true",
+        help="resumable run: keep a checkpoint in --outdir and continue an interrupted run with the same arguments from its checkpoint. --outdir may exist",
+    )
+    parser_common.add_argument(
+        "--checkpoint",
+        type=float,
+        default=60,
+        metavar="SECS",
+        help="with --resume, write a checkpoint every SECS seconds (default: %(default)g)",
+    )
+    parser_common.add_argument(
+        "--format",
+        choices=["raw", "tar", "pack", *STRUCTURED],
+        default="raw",
+        help="raw: results as they are to stdout or --outdir, tar: one tar member per result, pack: results back to back followed by an offset index, jsonl: one json record per hit with offset, span, yara rule and string and the data (base64), records: the same as length-prefixed binary records (default: %(default)s)",
+    )
+    parser_common.add_argument(
+        "--outfile",
+        type=T.type_outfile,
+        default="stdout",
+        metavar="FILE",
+        help="write the --format tar, pack, jsonl or records output to FILE (default: %(default)s)",
+    )
+    parser_common.add_argument(
+        "--write-queue",
+        type=int,
+        default=1024,
+        metavar="NUM",
+        help="results queued for the background writer of --outdir and containers, 0 writes in the foreground (default: %(default)d)",
+    )
+    parser_common.add_argument(
+        "--stats",
+        nargs="?",
+        const="-",
+        default=None,
+        metavar="FILE",
+        help="count reads, bytes and results and time each phase. the summary goes to stderr, or to FILE as json",
+    )
+    parser_common.add_argument(
+        "--progress",
+        type=float,
+        default=10,
+        metavar="SECS",
+        help="with --stats, report progress every SECS seconds, 0 disables it (default: %(default)g)",
+    )
+    parser_offsetfile = argparse.ArgumentParser(add_help=False)
+    parser_offsetfile.add_argument(
+        "--offsetfile",
+        "-f",
+        type=T.type_infile,
+        default="stdin",
+        metavar="FILE",
+        help="source of offsets (default: %(default)s)",
+    )
     subparsers = parser.add_subparsers(title="process offsets from", dest="method", metavar="offset_method")
-    subparser_yara = subparsers.add_parser('yara', help='use offsets from yara output', parents=[parser_common, blockline.parser])
-    subparser_strings = subparsers.add_parser('strings', help='use offsets from strings output', parents=[parser_common, blockline.parser])
+    subparser_yara = subparsers.add_parser('yara', help='use offsets from yara output', parents=[parser_offsetfile, parser_common, blockline.parser])
+    subparser_strings = subparsers.add_parser('strings', help='use offsets from strings output', parents=[parser_offsetfile, parser_common, blockline.parser])
     subparser_strings.add_argument(
         "--type",
         "-t",
@@ -93,8 +211,49 @@ def parse_args() -> argparse.Namespace:
         default="dec",
         help="offset format in STRINGS file (default: %(default)s)",
     )
+    subparser_scan = subparsers.add_parser('scan', help='find offsets by scanning --infile for patterns', parents=[parser_common, blockline.parser])
+    subparser_scan.set_defaults(offsetfile=None)
+    subparser_scan.add_argument(
+        "--pattern",
+        "-e",
+        action="append",
+        default=[],
+        metavar="PATTERN",
+        help="pattern to scan for, may be repeated. every match is an offset",
+    )
+    subparser_scan.add_argument(
+        "--patternfile",
+        "-F",
+        type=T.type_infile,
+        default=None,
+        metavar="FILE",
+        help="read patterns from FILE, one per line",
+    )
+    subparser_scan.add_argument(
+        "--regex",
+        "-E",
+        action="store_true",
+        help="patterns are regular expressions (python re syntax) instead of literal bytes",
+    )
+    subparser_scan.add_argument(
+        "--nocase",
+        action="store_true",
+        help="match ascii letters case insensitively",
+    )
+    subparser_scan.add_argument(
+        "--ascii",
+        action="store_true",
+        help="match patterns as they are, the default unless --wide is given",
+    )
+    subparser_scan.add_argument(
+        "--wide",
+        action="store_true",
+        help="match literal patterns as utf-16le, every character followed by a zero byte. combine with --ascii for both",
+    )
     try:
-        args = parser.parse_args()
+        args = parser.parse_args(argv)
+        if args.outdir != "stdout" and not args.resume:
+            T.type_outfile(args.outdir)
 #        print(f"args: {args}", file=sys.stderr)
         return args
     except Exception as excpt:
@@ -103,97 +262,371 @@ def parse_args() -> argparse.Namespace:
         sys.exit(ERR.EXIT.ARGPARSE)
 
 
-def get_offsets(input: list, offsetmethod: str, offsettype: str | None = None) -> list:
-    offsets: list[int] = []
-    base = 10 if offsettype == "dec" else 16
-    regex = r"^(0x[0-9a-f]+)" if offsetmethod == "yara" else r"^ *([0-9a-f]+) "
-    # YARA:
-    # user_yes yes.txt          --> None
-    # 0x14e:$user_yes01: yes    --> 0x14e
-    # 0x213:$user_yes01: yes    --> 0x213
-    # STRINGS:
-    #     122 dirty bit         --> 122
-    # 21691669 WXDP             --> 21691669
-    #      7a dirty bit         --> 7a
-    # 14afd15 WXDP              --> 14afd15
-    rec = re.compile(regex)
-    for line in input:
-        if type(line) is bytes:
-            line = line.decode("utf-8")
-        regex_group = rec.match(line)
-        if regex_group:
-            offset_str: str = regex_group.group().strip()
-            offset_int: int = int(offset_str, base)
-            offsets.append(offset_int)
-    sorted_uniq_offsets = sorted(set(offsets))
+def get_offsets(input: typing.Iterable[bytes | str], offsetmethod: str, offsettype: str | None = None) -> list:
+    sorted_uniq_offsets = list(offsets.sorted_offsets(offsets.iter_offsets(input, offsetmethod, offsettype)))
     return sorted_uniq_offsets
 
 
-def __main() -> None:
+def fmt_offset(args: argparse.Namespace, p: int) -> str:
+    if args.method == "strings":
+        return hex(p) if args.type == "hex" else str(p)
+    return hex(p)
+
+
+def output_name(args: argparse.Namespace, p: int, span: tuple[int, int]) -> str:
+    if args.merge:
+        start, length = span
+        return f"extent_{fmt_offset(args, start)}-{fmt_offset(args, start + length)}.bin"
+    fmt_p = fmt_offset(args, p)
+    return f"line_{fmt_p}.txt" if args.datatype == "lines" else f"block_{fmt_p}.bin"
+
+
+# mirror a target path below the output directory without leaving it
+def target_dirname(target: str) -> str:
+    parts = [part for part in os.path.normpath(target).split(os.sep) if part not in ("", ".", "..")]
+    return os.path.join(*parts) if parts else "_"
+
+
+# the api options set by the command line
+def extract_options(args: argparse.Namespace) -> dict[str, typing.Any]:
+    return {
+        "mode": args.datatype,
+        "before": args.before,
+        "after": args.after,
+        "blocksize": args.blocksize,
+        "linesep": args.linesep,
+        "linebuf": args.linebuf,
+        "readahead": args.readahead,
+        "zero_copy": args.zero_copy,
+        "nodupes": args.nodupes,
+        "digest": args.digest,
+        "merge": args.merge,
+        "queue_depth": args.queue_depth,
+        "use_mmap": not args.no_mmap,
+        "index": args.index,
+        "index_dir": args.index_dir,
+        "decompress": args.decompress,
+        "segmented": args.segmented,
+    }
+
+
+# what decides the results of a --resume run: a checkpoint is only
+# continued with the same options and offsets. offsets_digest is the
+# digest of offsets read from stdin.
+def job_options(args: argparse.Namespace, offsets_digest: str | None = None) -> dict[str, typing.Any]:
+    options = {k: v for k, v in extract_options(args).items() if k in ("mode", "before", "after", "blocksize", "linesep", "nodupes", "digest", "merge", "decompress", "segmented")}
+    options.update(method=args.method, type=getattr(args, "type", None), infile=args.infile)
+    if args.method == "scan":
+        options.update(pattern=args.pattern, patternfile=args.patternfile, regex=args.regex, nocase=args.nocase, ascii=args.ascii, wide=args.wide)
+        if args.patternfile is not None:
+            options.update(patternfile_id=checkpoint.input_identity(args.patternfile))
+    elif args.offsetfile != "stdin":
+        options.update(offsetfile=args.offsetfile, offsetfile_id=checkpoint.input_identity(args.offsetfile))
+    else:
+        options.update(offsets_digest=offsets_digest)
+    return options
+
+
+# list_offsets are sorted, or arrive in a stream with window > 0.
+# with ckpt, offsets done by an earlier run are skipped and every written
+# result is recorded. with tags, list_offsets are (offset, tag id) pairs.
+def dump_offsets(args: argparse.Namespace, infile: str, list_offsets: typing.Iterable[typing.Any], out: output.Output, dedup_store: str | None, jobs: int = 1, prefix: str = "", st: stats.Stats | None = None, window: int = 0, ckpt: checkpoint.Checkpoint | None = None,
+                 tags: list[tuple[str | None, str]] | None = None) -> None:
+    source: typing.Any = sys.stdin.buffer if infile == "stdin" else infile
+    write = out.write if st is None else st.timed_call("output", out.write)
+    if args.format in STRUCTURED:
+        dump_hits(args, infile, list_offsets, out, dedup_store, jobs, prefix, st, window, tags)
+        return
+    entry: dict[str, typing.Any] = {"next": 0}
+    dups = None
+    if ckpt is not None:
+        entry = ckpt.input(infile)
+        if entry["done"]:
+            return
+        dups = ckpt.open_dedup(entry, args.digest, dedup_store) if args.nodupes else None
+    try:
+        results = api.extract(source, list_offsets, **extract_options(args), dedup_store=dedup_store, dups=dups, jobs=jobs, presorted=True, window=window, resume_from=entry["next"], stats=st)
+        for p, span, buf in results:
+            write(p, span, prefix + output_name(args, p, span), buf)
+            if ckpt is not None:
+                # a merged extent is named by its first offset but holds all
+                # offsets below its end, the following ones start past it
+                ckpt.advance(entry, span[0] + span[1] - 1 if args.merge else p, dups)
+        if ckpt is not None:
+            ckpt.finish(entry)
+    finally:
+        if dups is not None:
+            dups.close()
+
+
+# structured formats: one record per hit. every offset is extracted once
+# and written once per tag (yara rule and string) it has. with --nodupes,
+# a result whose digest was seen before is written as a dup, without data.
+def dump_hits(args: argparse.Namespace, infile: str, hits: typing.Iterable[typing.Any], out: output.Output, dedup_store: str | None, jobs: int, prefix: str, st: stats.Stats | None, window: int,
+              tags: list[tuple[str | None, str]] | None) -> None:
+    source: typing.Any = sys.stdin.buffer if infile == "stdin" else infile
+    write = out.write if st is None else st.timed_call("output", out.write)
+    # tag ids of the offsets handed to extraction and not written yet
+    pending: collections.deque = collections.deque()
+
+    def hit_offsets() -> typing.Iterator[int]:
+        for p, tag in hits:
+            if pending and pending[-1][0] == p:
+                pending[-1][1].append(tag)
+            else:
+                pending.append((p, [tag]))
+                yield p
+
+    list_offsets: typing.Any = hits if tags is None else hit_offsets()
+    dups = dedup.Dedup(args.digest, dedup_store) if args.nodupes else None
+    last_span: tuple[int, int] | None = None
+    last_key = b""
+    try:
+        results = api.extract(source, list_offsets, **dict(extract_options(args), nodupes=False), jobs=jobs, presorted=True, window=window, stats=st)
+        for p, span, buf in results:
+            ptags: list[int] = []
+            if tags is not None:
+                while pending[0][0] != p:
+                    pending.popleft()
+                ptags = pending.popleft()[1]
+            meta: dict[str, typing.Any] = {"target": infile, "rule": None, "string": None}
+            if dups is not None:
+                if span == last_span:
+                    meta.update(digest=last_key.hex(), dup=True)
+                else:
+                    last_span, last_key = span, dups.key(buf)
+                    meta.update(digest=last_key.hex(), dup=dups.seen_key(last_key))
+                if st is not None and meta["dup"]:
+                    st.count("dup_data")
+            name = prefix + output_name(args, p, span)
+            for tag in ptags or [-1]:
+                if tags is not None and tag >= 0:
+                    meta.update(rule=tags[tag][0], string=tags[tag][1])
+                write(p, span, name, b"" if meta.get("dup") else buf, dict(meta))
+                if dups is not None:
+                    # further tags of the same hit refer to this record
+                    meta["dup"] = True
+    finally:
+        if dups is not None:
+            dups.close()
+
+
+# --pattern and --patternfile patterns of the scan method
+def scan_patterns(args: argparse.Namespace) -> scan.Patterns:
+    patterns: list[bytes | str] = list(args.pattern)
+    if args.patternfile is not None:
+        with open(args.patternfile, "rb") as f:
+            patterns.extend(line.rstrip(b"\r\n") for line in f if line.strip(b"\r\n"))
+    if not patterns:
+        raise ValueError("scan needs --pattern PATTERN or --patternfile FILE")
+    return scan.Patterns(patterns, args.regex, args.nocase, args.ascii or not args.wide, args.wide)
+
+
+# (target id, offset) from yara output, targets are numbered in the order
+# they appear and collected in targets. with tags, (target id, offset,
+# tag id) where tags collects the (rule, string id) of every tag id.
+def iter_target_ids(lines: typing.Iterable[bytes], targets: list[str], tags: list[tuple[str | None, str]] | None = None) -> typing.Iterator[tuple[int, ...]]:
+    target_ids: dict[str, int] = {}
+    tag_ids: dict[tuple[str | None, str], int] = {}
+    for target, rule, string, p in offsets.iter_yara_hits(lines):
+        if target is None:
+            continue
+        if target not in target_ids:
+            target_ids[target] = len(targets)
+            targets.append(target)
+        if tags is None:
+            yield target_ids[target], p
+        else:
+            yield target_ids[target], p, tag_id(tag_ids, tags, (rule, string))
+
+
+# (offset, tag id) from yara output of one target, see iter_target_ids()
+def iter_tag_ids(lines: typing.Iterable[bytes], tags: list[tuple[str | None, str]]) -> typing.Iterator[tuple[int, int]]:
+    tag_ids: dict[tuple[str | None, str], int] = {}
+    for _, rule, string, p in offsets.iter_yara_hits(lines):
+        yield p, tag_id(tag_ids, tags, (rule, string))
+
+
+def tag_id(tag_ids: dict[tuple[str | None, str], int], tags: list[tuple[str | None, str]], tag: tuple[str | None, str]) -> int:
+    if tag not in tag_ids:
+        tag_ids[tag] = len(tags)
+        tags.append(tag)
+    return tag_ids[tag]
+
+
+# multi-input mode: yara output without --infile names the targets itself.
+# targets are processed by a pool of workers. results for stdout are
+# spooled per target and written in the order the targets appeared.
+# directories and containers are shared, each target gets its own subdirectory.
+# grouped is sorted, or with --stream in the order of the yara output: a
+# target is submitted as soon as yara reports the next one. a target
+# named again later is submitted again with its later hits, results of
+# both are written and --nodupes does not span them.
+def dump_targets(args: argparse.Namespace, grouped: offsets.OffsetSorter, targets: list[str], out: output.Output, st: stats.Stats | None = None, ckpt: checkpoint.Checkpoint | None = None, tags: list[tuple[str | None, str]] | None = None) -> None:
+    spooled = args.format == "raw" and args.outdir == "stdout"
+
+    def dump_target(target_id: int, list_offsets: typing.Iterable[typing.Any], spool: typing.IO[bytes] | None) -> bool:
+        target = targets[target_id]
+        if not os.path.exists(target):
+            ERR.printmsg(f"skipping {target}: no such file", ERR.ERRLVL.WARN)
+            return False
+        dedup_store = f"{args.dedup_store}.{target_id}" if args.dedup_store else None
+        try:
+            if spool is not None:
+                dump_offsets(args, target, list_offsets, output.StreamOutput(typing.cast(typing.BinaryIO, spool)), dedup_store, st=st)
+            else:
+                dump_offsets(args, target, list_offsets, out, dedup_store, prefix=target_dirname(target) + os.sep, st=st, ckpt=ckpt, tags=tags)
+        except Exception as excpt:
+            ERR.printmsg(f"{target}: {type(excpt).__name__}: {excpt}", ERR.ERRLVL.ERROR)
+            return False
+        return True
+
+    failed = 0
+    pending: collections.deque = collections.deque()
+
+    def finish_first() -> None:
+        nonlocal failed
+        future, spool = pending.popleft()
+        if not future.result():
+            failed += 1
+        if spool is not None:
+            spool.seek(0)
+            shutil.copyfileobj(spool, sys.stdout.buffer)
+            spool.close()
+            if args.stream:
+                sys.stdout.buffer.flush()
+
+    jobs = args.jobs or 4
+    submitted: set[int] = set()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as pool:
+        for target_id, group in itertools.groupby(grouped, key=operator.itemgetter(0)):
+            if target_id in submitted:
+                ERR.printmsg(f"{targets[target_id]} is named again in the yara output, its later hits are extracted separately", ERR.ERRLVL.WARN)
+            submitted.add(target_id)
+            hits: typing.Iterable[typing.Any]
+            if tags is not None:
+                # (offset, tag id) pairs, kept as flat as the offsets
+                flat = array.array("Q", (value for item in group for value in item[1:]))
+                hits = zip(flat[0::2], flat[1::2])
+            else:
+                hits = array.array("Q", (p for _, p in group))
+                if args.stream:
+                    hits = array.array("Q", sorted(set(hits)))
+            spool: typing.IO[bytes] | None = tempfile.SpooledTemporaryFile(max_size=SPOOLSIZE) if spooled else None
+            pending.append((pool.submit(dump_target, target_id, hits, spool), spool))
+            # bound the number of targets held in memory
+            while len(pending) >= 2 * jobs:
+                finish_first()
+        while pending:
+            finish_first()
+    if failed:
+        raise RuntimeError(f"{failed} of {len(targets)} targets could not be processed")
+
+
+def __main(argv: list[str] | None = None) -> None:
     global progname
     global progver
     ERR.verbosity = ERR.ERRLVL.DEBUG
-    args = parse_args()
-    hashes = []
+    args = parse_args(argv)
+    if args.infile == "stdin" and args.offsetfile == "stdin":
+        raise ValueError("offsets and input cannot both be read from stdin")
+    if args.datatype not in ("lines", "blocks"):
+        ERR.printmsg(
+            "Neither blocks nor lines, what shall I do? Bailing out!",
+            ERR.ERRLVL.CRIT,
+        )
+        raise ValueError(f"Undefined datatype: {args.datatype}")
+    if args.format != "raw" and args.outdir != "stdout":
+        raise ValueError(f"--format {args.format} writes to --outfile, not to --outdir")
+    if args.merge and args.datatype != "blocks":
+        raise ValueError("--merge works on blocks only")
+    multi = args.infile is None
+    if args.segmented and (multi or args.infile == "stdin" or args.decompress):
+        raise ValueError("--segmented needs the first segment as --infile FILE and cannot be combined with --decompress")
+    if args.stream < 0:
+        raise ValueError("--stream WINDOW cannot be negative")
+    if multi and args.method != "yara":
+        raise ValueError(f"--infile is required for {args.method}")
+    if args.format in STRUCTURED and (args.merge or args.stream and args.method == "yara"):
+        raise ValueError(f"--format {args.format} cannot be combined with --merge, nor with --stream for yara")
+    if args.resume and (args.outdir == "stdout" or args.format != "raw" or args.stream or args.infile == "stdin"):
+        raise ValueError("--resume needs --outdir DIR and input files, and cannot be combined with --format or --stream")
     # read YARA or STRINGS output file and get offsets...
-    list_offsets = []
-    if args.offsetfile == "stdin":
-        list_offsets = get_offsets(sys.stdin.readlines(), args.method, "hex" if args.method == "yara" else args.type)
+    # the offset source is streamed, sorting spills to disk if needed
+    offsettype = "hex" if args.method != "strings" else args.type
+    memory = args.offset_memory << 20
+    st = stats.Stats(args.progress) if args.stats else None
+    offsetfile: typing.Any = None
+    targets: list[str] = []
+    # offsets from stdin are identified by their digest for --resume
+    stdin_digest: typing.Any = None
+    offsets_digest = None
+    # yara rules and strings of the hits, kept for structured formats
+    tags: list[tuple[str | None, str]] | None = [] if args.format in STRUCTURED and args.method == "yara" else None
+    if args.method == "scan":
+        # offsets are the matches in the input, found while extracting
+        sorted_offsets: typing.Any = scan_patterns(args)
+    elif args.stream:
+        # nothing is read here, offsets are parsed while extracting
+        offsetfile = sys.stdin.buffer if args.offsetfile == "stdin" else open(args.offsetfile, "rb")
+        sorted_offsets = iter_target_ids(offsetfile, targets) if multi else offsets.iter_offsets(offsetfile, args.method, offsettype)
     else:
-        with open(args.offsetfile, "rb") as f:
-            list_offsets = get_offsets(f.readlines(), args.method, "hex" if args.method == "yara" else args.type)
-    assert type(list_offsets) is list
-    bl = blockline.BlockLine(args)
-    with open(args.infile, "rb") as ifile:
-        for p in list_offsets:
-            # get buffer
-            if args.datatype == "lines":
-                buf = bl.dump_line(ifile, p, T.LINESEP.get(args.linesep))
-            elif args.datatype == "blocks":
-                buf = bl.dump_block(ifile, p)
+        offsetfile = sys.stdin.buffer if args.offsetfile == "stdin" else open(args.offsetfile, "rb")
+        lines: typing.Iterable[bytes] = offsetfile
+        if args.resume and args.offsetfile == "stdin":
+            stdin_digest = hashlib.sha256()
+            lines = checkpoint.hashed_lines(offsetfile, stdin_digest)
+        with offsetfile, st.phase("offsets") if st else contextlib.nullcontext():
+            if multi:
+                # one sorter for all targets, items are (target id, offset)
+                # or (target id, offset, tag id)
+                sorted_offsets = offsets.OffsetSorter(memory, width=2 if tags is None else 3)
+                sorted_offsets.extend(iter_target_ids(lines, targets, tags))
+            elif tags is not None:
+                sorted_offsets = offsets.OffsetSorter(memory, width=2)
+                sorted_offsets.extend(iter_tag_ids(lines, tags))
             else:
-                ERR.printmsg(
-                    "Neither blocks nor lines, what shall I do? Bailing out!",
-                    ERR.ERRLVL.CRIT,
-                )
-                raise ValueError(f"Undefined datatype: {args.datatype}")
-            # dup removal before further processing
-            # this is heavy on the cpu
-            if args.nodupes:
-                h = hashlib.sha256()
-                h.update(buf)
-                if h.hexdigest() in hashes:
-                    # we already collected this hash
-                    # we break this iteration and go on with the next one
-                    continue
-                else:
-                    hashes.append(h.hexdigest())
-            # go on with output
-            if args.outdir == "stdout":
-                sys.stdout.buffer.write(buf)
-            else:
-                if not os.path.exists(args.outdir):
-                    os.makedirs(args.outdir)
-                if args.method == "strings":
-                    fmt_p = hex(p) if args.type == "hex" else p
-                else:
-                    fmt_p = hex(p)
-                opfname = os.path.join(
-                    args.outdir,
-                    (
-                        f"line_{fmt_p}.txt"
-                        if args.datatype == "lines"
-                        else f"block_{fmt_p}.bin"
-                    ),
-                )
-                with open(opfname, "wb") as ofile:
-                    ofile.write(buf)
+                sorted_offsets = offsets.sorted_offsets(offsets.iter_offsets(lines, args.method, offsettype), memory)
+        if stdin_digest is not None:
+            offsets_digest = stdin_digest.hexdigest()
+    out = output.open_output(args.format, args.outdir, args.outfile, args.write_queue, sys.stdout.buffer, st.output if st else None, flush=args.stream > 0)
+    ckpt = None
+    if args.resume:
+        os.makedirs(args.outdir, exist_ok=True)
+        ckpt = checkpoint.Checkpoint(args.outdir, checkpoint.fingerprint(job_options(args, offsets_digest)), args.checkpoint, out.sync)
+        if ckpt.resumed:
+            ERR.printmsg(f"resuming from the checkpoint in {args.outdir}", ERR.ERRLVL.INFO)
+    try:
+        if multi:
+            dump_targets(args, sorted_offsets, targets, out, st, ckpt, tags)
+        else:
+            dump_offsets(args, args.infile, sorted_offsets, out, args.dedup_store, args.jobs or 1, st=st, window=args.stream, ckpt=ckpt, tags=tags)
+    finally:
+        out.close()
+        if ckpt is not None:
+            # everything handed to the output is written by now
+            ckpt.save()
+        if st:
+            st.close(args.stats)
+        if offsetfile is not None:
+            offsetfile.close()
+        if isinstance(sorted_offsets, offsets.OffsetSorter):
+            sorted_offsets.close()
     return
 
 
-def main() -> None:
+def main(argv: list[str] | None = None) -> None:
+    # a running server does the work, see server.py
+    code = client.run(sys.argv[1:] if argv is None else argv)
+    if code is not None:
+        sys.exit(code)
+    run(argv)
+
+
+# in this process, also what a server runs for every request
+def run(argv: list[str] | None = None) -> None:
     try:
-        __main()
+        __main(argv)
     except Exception as main_excpt:
         # yeah, this is truly unexpected. ever got CTRL+C'ed?? bail the heck out!
         ERR.printmsg(f"{type(main_excpt).__name__}: {main_excpt}", ERR.ERRLVL.CRIT)
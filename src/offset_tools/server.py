@@ -0,0 +1,175 @@
+# flake8: noqa: E501
+#
+#   (C) Sebastian Weigmann, 2025
+#   This software is released under:
+#   GNU GENERAL PUBLIC LICENSE, Version 3
+#   Please find the full text in LICENSE.
+#
+# long running offset_dump server for callers running it over and over.
+# it listens on a unix socket (see client.py) and runs offset_dump command
+# lines with the stdin, stdout and stderr of the client, in its working
+# directory. interpreter, modules and argument parsers are set up once,
+# inputs stay open between requests (see common/cache.py). requests are
+# run one at a time: stdio and the working directory belong to the process.
+# only the user running the server is served.
+#
+# generic imports
+import typing
+import argparse
+import os
+import sys
+import json
+import socket
+import signal
+import socketserver
+
+# specific imports
+try:
+    from common import errors as ERR
+    from common import cache
+    import api
+    import client
+    import offset_dump
+except ModuleNotFoundError:
+    from offset_tools.common import errors as ERR
+    from offset_tools.common import cache
+    from offset_tools import api
+    from offset_tools import client
+    from offset_tools import offset_dump
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        prog="offset_dump_server",
+        description="Serve offset_dump runs on a unix socket, with inputs kept open between runs",
+        epilog="offset_dump hands its runs to the server whenever it is listening on the socket",
+    )
+    parser.add_argument(
+        "--socket",
+        default=client.socket_path(),
+        metavar="PATH",
+        help="unix socket to listen on, clients look for it in $OFFSET_DUMP_SOCKET (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--max-inputs",
+        type=int,
+        default=64,
+        metavar="NUM",
+        help="inputs kept open between runs (default: %(default)d)",
+    )
+    parser.add_argument(
+        "--cache-memory",
+        type=int,
+        default=256,
+        metavar="MB",
+        help="memory for recently read windows of inputs which are not memory-mapped (default: %(default)d)",
+    )
+    return parser.parse_args()
+
+
+class Handler(socketserver.BaseRequestHandler):
+    def handle(self) -> None:
+        sock = self.request
+        if client.peer_uid(sock) != os.getuid():
+            return
+        msg, fds, _, _ = socket.recv_fds(sock, 1 << 16, 3)
+        try:
+            if len(fds) != 3 or len(msg) < client.REQUEST.size:
+                return
+            (length,) = client.REQUEST.unpack(msg[:client.REQUEST.size])
+            msg = msg[client.REQUEST.size:]
+            while len(msg) < length:
+                buf = sock.recv(length - len(msg))
+                if not buf:
+                    return
+                msg += buf
+            request = json.loads(msg)
+            fds, owned = [], fds
+            code = run(request["argv"], request["cwd"], owned)
+        finally:
+            for fd in fds:
+                os.close(fd)
+        sock.sendall(client.REPLY.pack(code))
+
+
+# runs offset_dump with argv in cwd on the file descriptors stdin, stdout
+# and stderr of a client, returns its exit code. the descriptors are closed.
+def run(argv: list[str], cwd: str, fds: list[int]) -> int:
+    saved = (sys.stdin, sys.stdout, sys.stderr, os.getcwd())
+    sys.stdin = open(fds[0], "r")
+    sys.stdout = open(fds[1], "w")
+    sys.stderr = open(fds[2], "w", buffering=1)
+    code: typing.Any = ERR.EXIT.GENERIC
+    try:
+        os.chdir(cwd)
+        offset_dump.run(argv)
+    except SystemExit as excpt:
+        code = excpt.code
+    except Exception as excpt:
+        ERR.printmsg(f"{type(excpt).__name__}: {excpt}", ERR.ERRLVL.CRIT)
+    finally:
+        for stream in (sys.stdout, sys.stderr, sys.stdin):
+            try:
+                stream.close()
+            except OSError:
+                pass
+        sys.stdin, sys.stdout, sys.stderr = saved[:3]
+        os.chdir(saved[3])
+    if code is None:
+        return ERR.EXIT.OK
+    return code if isinstance(code, int) else ERR.EXIT.GENERIC
+
+
+def serve(path: str, max_inputs: int = 64, memory: int = 256 << 20) -> None:
+    folder = os.path.dirname(path)
+    if folder == client.private_dir():
+        os.makedirs(folder, mode=0o700, exist_ok=True)
+        if not client.owned(folder, directory=True):
+            raise RuntimeError(f"{folder} is not a directory of this user only")
+    if os.path.lexists(path):
+        if not client.owned(path):
+            raise RuntimeError(f"{path} is not a socket of this user")
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            try:
+                sock.connect(path)
+            except OSError:
+                # left behind by a server which is gone
+                os.unlink(path)
+            else:
+                raise RuntimeError(f"a server is listening on {path} already")
+    api.input_cache = cache.SourceCache(max_inputs, memory)
+    umask = os.umask(0o177)
+    try:
+        server = socketserver.UnixStreamServer(path, Handler)
+    finally:
+        os.umask(umask)
+    try:
+        ERR.printmsg(f"listening on {path}", ERR.ERRLVL.INFO)
+        server.serve_forever()
+    finally:
+        server.server_close()
+        os.unlink(path)
+        api.input_cache.close()
+        api.input_cache = None
+
+
+def stop(signum: int, frame: typing.Any) -> None:
+    raise KeyboardInterrupt
+
+
+def main() -> None:
+    ERR.verbosity = ERR.ERRLVL.INFO
+    args = parse_args()
+    signal.signal(signal.SIGTERM, stop)
+    try:
+        serve(args.socket, args.max_inputs, args.cache_memory << 20)
+    except KeyboardInterrupt:
+        pass
+    except Exception as excpt:
+        ERR.printmsg(f"{type(excpt).__name__}: {excpt}", ERR.ERRLVL.CRIT)
+        sys.exit(ERR.EXIT.GENERIC)
+    sys.exit(ERR.EXIT.OK)
+
+
+if __name__ == "__main__":
+    main()
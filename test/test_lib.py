@@ -3,7 +3,23 @@
 import pytest      # noqa: F401
 import subprocess
 import os
+import sys
+import io
+import json
 import shutil
+import gzip
+import lzma
+import struct
+import tarfile
+import base64
+
+
+OFFSET_DUMP = ["python3", os.path.join("src", "offset_tools", "offset_dump.py")]
+
+
+# runs offset_dump with args, a non-zero exit code fails the test unless check is False
+def run_offset_dump(args, check=True, timeout=5, **kwargs):
+    return subprocess.run(OFFSET_DUMP + args, capture_output=True, check=check, timeout=timeout, **kwargs)
 
 
 class Test_offset_dump(object):
@@ -53,6 +69,417 @@ class Test_offset_dump(object):
         assert 'To generate text with the word "yes", you can use various creative methods.' in p.stdout
         assert 'express "yes" in English, such as "yep", "sure", or "totally", which can' in p.stdout
 
+    def test_yara_lines_nommap(self):
+        args = ["yara", "lines", "--offsetfile", os.path.join("test", "yara-out_yes.txt"), "--infile", os.path.join("test", "yes.txt")]
+        p_mmap = run_offset_dump(args)
+        p_file = run_offset_dump(args + ["--no-mmap"])
+        assert p_file.returncode == 0
+        assert p_mmap.stdout == p_file.stdout
+        assert b'To generate text with the word "yes", you can use various creative methods.' in p_file.stdout
+
+    def test_yara_lines_pipe(self):
+        # input from a pipe is spooled, results match those of the file
+        args = ["yara", "lines", "--offsetfile", os.path.join("test", "yara-out_yes.txt")]
+        p_file = run_offset_dump(args + ["--infile", os.path.join("test", "yes.txt")])
+        with open(os.path.join("test", "yes.txt"), "rb") as f:
+            cat = subprocess.Popen(["cat"], stdin=f, stdout=subprocess.PIPE)
+            p_pipe = run_offset_dump(args + ["--infile", "stdin"], stdin=cat.stdout)
+            cat.stdout.close()
+            cat.wait(timeout=5)
+        assert p_pipe.stdout == p_file.stdout
+
+    def test_strings_lines_sweep(self, tmp_path):
+        # several hits within the same line and in neighbouring lines
+        offsetfile = tmp_path / "offsets.txt"
+        offsetfile.write_text("".join(f"{o:x} x\n" for o in [0x14e, 0x150, 0x160, 0x213, 0x215]))
+        args = ["strings", "lines", "--type", "hex", "--offsetfile", str(offsetfile), "--infile", os.path.join("test", "yes.txt")]
+        p = run_offset_dump(args, text=True)
+        assert p.returncode == 0
+        assert p.stdout.count('To generate text with the word "yes", you can use various creative methods.') == 3
+        assert p.stdout.count('express "yes" in English, such as "yep", "sure", or "totally", which can') == 2
+        p = run_offset_dump(args + ["--nodupes"], text=True)
+        assert p.stdout.count('To generate text with the word "yes", you can use various creative methods.') == 1
+        assert p.stdout.count('express "yes" in English, such as "yep", "sure", or "totally", which can') == 1
+
+    def test_yara_lines_index(self, tmp_path):
+        args = ["yara", "lines", "--offsetfile", os.path.join("test", "yara-out_yes.txt"), "--infile", os.path.join("test", "yes.txt"), "--before", "1", "--after", "1"]
+        p_plain = run_offset_dump(args)
+        p_build = run_offset_dump(args + ["--index-dir", str(tmp_path)])
+        assert len(list(tmp_path.glob("*.lidx"))) == 1
+        p_reuse = run_offset_dump(args + ["--index-dir", str(tmp_path)])
+        assert b"building line index" not in p_reuse.stderr
+        assert p_plain.stdout == p_build.stdout == p_reuse.stdout
+        assert b'To generate text with the word "yes", you can use various creative methods.' in p_reuse.stdout
+
+    def test_strings_lines_context(self, tmp_path):
+        # long lines, a small --linebuf has to grow to reach the context
+        lines = [bytes([0x61 + i]) * (1000 * (i + 1)) for i in range(8)]
+        (tmp_path / "long.txt").write_bytes(b"\n".join(lines))
+        starts = [sum(len(line) + 1 for line in lines[:i]) for i in range(8)]
+        offsetfile = tmp_path / "offsets.txt"
+        offsetfile.write_text(f"{starts[4] + 10} x\n")
+        args = ["strings", "lines", "--type", "dec", "--offsetfile", str(offsetfile), "--infile", str(tmp_path / "long.txt"), "--linebuf", "16"]
+        p = run_offset_dump(args + ["-B", "2", "-A", "2"])
+        assert p.stdout == b"\n".join(lines[2:7]) + b"\n"
+        # context reaching past the start and the end of the input
+        p = run_offset_dump(args + ["-B", "9", "-A", "9"])
+        assert p.stdout.endswith(b"\n".join(lines[1:]))
+
+    def test_strings_lines_sparse(self, tmp_path):
+        # lines on both sides of a hole, with and without readahead hints
+        with open(tmp_path / "sparse.img", "wb") as f:
+            f.write(b"head\nfirst\n")
+            f.truncate(4 << 20)
+            f.seek(0, os.SEEK_END)
+            f.write(b"\nsecond\nthird\n")
+        offsetfile = tmp_path / "offsets.txt"
+        offsetfile.write_text(f"6 x\n{(4 << 20) + 3} x\n")
+        args = ["strings", "lines", "--type", "dec", "--offsetfile", str(offsetfile), "--infile", str(tmp_path / "sparse.img"), "-A", "1"]
+        for extra in [[], ["--no-mmap"], ["--readahead", "0"]]:
+            p = run_offset_dump(args + extra)
+            assert p.stdout == b"first\n" + bytes((4 << 20) - 11) + b"\nsecond\nthird\n"
+
+    def test_yara_lines_compressed(self, tmp_path):
+        with open(os.path.join("test", "yes.txt"), "rb") as f:
+            data = f.read()
+        # two gzip members and an xz file, offsets refer to the uncompressed data
+        (tmp_path / "yes.txt.gz").write_bytes(gzip.compress(data[:400]) + gzip.compress(data[400:]))
+        (tmp_path / "yes.txt.xz").write_bytes(lzma.compress(data))
+        args = ["yara", "lines", "--offsetfile", os.path.join("test", "yara-out_yes.txt"), "--before", "1", "--after", "1"]
+        p_plain = run_offset_dump(args + ["--infile", os.path.join("test", "yes.txt")])
+        for name in ["yes.txt.gz", "yes.txt.xz"]:
+            p_build = run_offset_dump(args + ["--infile", str(tmp_path / name), "--decompress"])
+            assert os.path.isfile(tmp_path / (name + ".zidx"))
+            p_reuse = run_offset_dump(args + ["--infile", str(tmp_path / name), "--decompress"])
+            assert b"building checkpoint index" not in p_reuse.stderr
+            assert p_plain.stdout == p_build.stdout == p_reuse.stdout
+
+    def test_strings_blocks_segmented(self, tmp_path):
+        with open(os.path.join("test", "yes.txt"), "rb") as f:
+            data = f.read()
+        # split into 100 byte segments, blocks and lines cross segment ends
+        for i in range(0, len(data), 100):
+            (tmp_path / f"yes.{i // 100 + 1:03d}").write_bytes(data[i:i + 100])
+        offsetfile = tmp_path / "offsets.txt"
+        offsetfile.write_text("".join(f"{o} x\n" for o in [90, 302, 538]))
+        for datatype in ["blocks", "lines"]:
+            args = ["strings", datatype, "--type", "dec", "--offsetfile", str(offsetfile), "--blocksize", "32", "--after", "1"]
+            p_plain = run_offset_dump(args + ["--infile", os.path.join("test", "yes.txt")])
+            p_split = run_offset_dump(args + ["--infile", str(tmp_path / "yes.001"), "--segmented"])
+            assert p_split.returncode == 0
+            assert p_plain.stdout == p_split.stdout
+        assert p_split.stdout.count(b'To generate text with the word "yes", you can use various creative methods.') == 1
+
+    def test_strings_lines_segmented_border(self, tmp_path):
+        # a windows line end split between two segments
+        (tmp_path / "seg.001").write_bytes(b"aaaa\r")
+        (tmp_path / "seg.002").write_bytes(b"\nbbbb\r\ncccc\r\n")
+        offsetfile = tmp_path / "offsets.txt"
+        offsetfile.write_text("6 x\n")
+        args = ["strings", "lines", "--type", "dec", "--offsetfile", str(offsetfile), "--infile", str(tmp_path / "seg.001"), "--linesep", "windows", "--segmented"]
+        for extra in [[], ["--no-mmap"], ["--index-dir", str(tmp_path / "index")]]:
+            p = run_offset_dump(args + extra)
+            assert p.stdout == b"bbbb\r\n"
+
+    def test_strings_lines_spill(self, tmp_path):
+        # a zero memory budget forces every offset into its own sorted run on disk
+        offsetfile = tmp_path / "offsets.txt"
+        offsetfile.write_text("".join(f"{o} x\n" for o in [538, 302, 522, 302, 540, 310]))
+        args = ["strings", "lines", "--type", "dec", "--offsetfile", str(offsetfile), "--infile", os.path.join("test", "yes.txt")]
+        p_mem = run_offset_dump(args)
+        p_disk = run_offset_dump(args + ["--offset-memory", "0"])
+        assert p_disk.returncode == 0
+        assert p_mem.stdout == p_disk.stdout
+        assert p_disk.stdout.count(b'To generate text with the word "yes", you can use various creative methods.') == 2
+
+    def test_strings_lines_nodupes_store(self, tmp_path):
+        offsetfile = tmp_path / "offsets.txt"
+        offsetfile.write_text("".join(f"{o:x} x\n" for o in [0x14e, 0x150, 0x160, 0x213, 0x215]))
+        args = ["strings", "lines", "--type", "hex", "--offsetfile", str(offsetfile), "--infile", os.path.join("test", "yes.txt"), "--nodupes"]
+        p_mem = run_offset_dump(args)
+        p_disk = run_offset_dump(args + ["--digest", "blake2b", "--dedup-store", str(tmp_path / "hashes")])
+        assert p_disk.returncode == 0
+        assert p_mem.stdout == p_disk.stdout
+        assert p_disk.stdout.count(b'To generate text with the word "yes", you can use various creative methods.') == 1
+
+    def test_yara_lines_multi(self, tmp_path):
+        # yara -r style output naming two targets, no --infile
+        other = tmp_path / "other yes.txt"
+        shutil.copy(os.path.join("test", "yes.txt"), other)
+        offsetfile = tmp_path / "yara-out.txt"
+        offsetfile.write_text(f"find_yes {os.path.join('test', 'yes.txt')}\n0x14e:$yes01: yes\nfind_yes [tag] {other}\n0x213:$yes01: yes\n")
+        p = run_offset_dump(["yara", "lines", "--offsetfile", str(offsetfile), "--jobs", "2"], text=True)
+        assert p.returncode == 0
+        assert p.stdout == 'To generate text with the word "yes", you can use various creative methods. \nexpress "yes" in English, such as "yep", "sure", or "totally", which can \n'
+        outdir = tmp_path / "lines"
+        p = run_offset_dump(["yara", "lines", "--offsetfile", str(offsetfile), "--outdir", str(outdir)])
+        assert os.path.isfile(os.path.join(outdir, "test", "yes.txt", "line_0x14e.txt"))
+        assert os.path.isfile(os.path.join(outdir, str(other).lstrip(os.sep), "line_0x213.txt"))
+
+    def test_yara_lines_multi_stream(self, tmp_path):
+        # targets are extracted as yara names the next one, a target named
+        # again is extracted again for its later hits
+        other = tmp_path / "other yes.txt"
+        shutil.copy(os.path.join("test", "yes.txt"), other)
+        offsetfile = tmp_path / "yara-out.txt"
+        yes = os.path.join("test", "yes.txt")
+        offsetfile.write_text(f"find_yes {yes}\n0x14e:$yes01: yes\nfind_yes {other}\n0x213:$yes01: yes\nfind_no {yes}\n0x213:$no01: yes\n")
+        args = ["yara", "lines", "--offsetfile", str(offsetfile), "--jobs", "2"]
+        p_sorted = run_offset_dump(args)
+        p_stream = run_offset_dump(args + ["--stream"])
+        line_14e = b'To generate text with the word "yes", you can use various creative methods. \n'
+        line_213 = b'express "yes" in English, such as "yep", "sure", or "totally", which can \n'
+        assert p_sorted.stdout == line_14e + line_213 + line_213
+        assert p_stream.stdout == line_14e + line_213 + line_213
+        assert f"{yes} is named again".encode() in p_stream.stderr
+
+    def test_yara_lines_multi_tar(self, tmp_path):
+        # targets written by parallel workers into one container without a write queue
+        hits = []
+        for t in range(16):
+            target = tmp_path / f"t{t}.txt"
+            target.write_bytes(b"".join(b"yes line %d\n" % i for i in range(500)))
+            hits.append(f"find_yes {target}\n" + "".join(f"0x{o:x}:$yes01: yes\n" for o in range(0, 5000, 25)))
+        offsetfile = tmp_path / "yara-out.txt"
+        offsetfile.write_text("".join(hits))
+        run_offset_dump(["yara", "lines", "--offsetfile", str(offsetfile), "--format", "tar", "--outfile", str(tmp_path / "lines.tar"), "--write-queue", "0", "--jobs", "8"], timeout=20)
+        with tarfile.open(tmp_path / "lines.tar") as tar:
+            assert len(tar.getnames()) == 16 * 200
+
+    def test_strings_blocks_jobs(self, tmp_path):
+        offsetfile = tmp_path / "offsets.txt"
+        offsetfile.write_text("".join(f"{o} x\n" for o in range(0, 900, 13)))
+        args = ["strings", "blocks", "--type", "dec", "--offsetfile", str(offsetfile), "--infile", os.path.join("test", "yes.txt"), "--blocksize", "16", "--nodupes"]
+        p_single = run_offset_dump(args)
+        p_jobs = run_offset_dump(args + ["--jobs", "3", "--queue-depth", "2"])
+        assert p_jobs.returncode == 0
+        assert p_single.stdout == p_jobs.stdout
+        assert p_jobs.stdout.startswith(b"Lorem ipsum dolor sit amet")
+
+    def test_strings_blocks_merge(self, tmp_path):
+        # 16 byte blocks with one block of context: 0..48 and 32..80 touch, 320..368 is apart
+        offsetfile = tmp_path / "offsets.txt"
+        offsetfile.write_text("".join(f"{o} x\n" for o in [20, 50, 330]))
+        outdir = tmp_path / "blocks"
+        args = ["strings", "blocks", "--type", "dec", "--offsetfile", str(offsetfile), "--infile", os.path.join("test", "yes.txt"), "--blocksize", "16", "--before", "1", "--after", "1"]
+        p = run_offset_dump(args + ["--merge", "--outdir", str(outdir)])
+        assert p.returncode == 0
+        assert sorted(os.listdir(outdir)) == ["extent_0-80.bin", "extent_304-352.bin"]
+        with open(os.path.join("test", "yes.txt"), "rb") as f:
+            data = f.read()
+        with open(os.path.join(outdir, "extent_0-80.bin"), "rb") as f:
+            assert f.read() == data[0:80]
+        p = run_offset_dump(args)
+        assert p.stdout == data[0:48] + data[32:80] + data[304:352]
+
+    def test_strings_lines_resume(self, tmp_path):
+        offsetfile = tmp_path / "offsets.txt"
+        offsetfile.write_text("".join(f"{o} x\n" for o in range(0, 900, 13)))
+        args = ["strings", "lines", "--type", "dec", "--offsetfile", str(offsetfile), "--infile", os.path.join("test", "yes.txt"), "--nodupes"]
+        run_offset_dump(args + ["--outdir", str(tmp_path / "plain")])
+        expected = {name: (tmp_path / "plain" / name).read_bytes() for name in os.listdir(tmp_path / "plain")}
+        outdir = tmp_path / "lines"
+        run_offset_dump(args + ["--outdir", str(outdir), "--resume"])
+        assert {name: (outdir / name).read_bytes() for name in os.listdir(outdir) if not name.startswith(".")} == expected
+        # roll the checkpoint back as if the run had been interrupted behind offset 221
+        state = json.loads((outdir / ".offset_dump.ckpt").read_text())
+        (entry,) = state["inputs"].values()
+        entry.update(next=222, digests=4, done=False)
+        (outdir / ".offset_dump.ckpt").write_text(json.dumps(state))
+        for name in expected:
+            if int(name[5:-4]) > 221:
+                os.remove(outdir / name)
+        (outdir / "line_221.txt").write_bytes(b"kept")
+        p = run_offset_dump(args + ["--outdir", str(outdir), "--resume"])
+        assert b"resuming" in p.stderr
+        assert (outdir / "line_221.txt").read_bytes() == b"kept"
+        assert {name: (outdir / name).read_bytes() for name in os.listdir(outdir) if not name.startswith(".") and name != "line_221.txt"} == {k: v for k, v in expected.items() if k != "line_221.txt"}
+        # other arguments do not continue this checkpoint
+        p = run_offset_dump(args + ["--outdir", str(outdir), "--resume", "--after", "1"], check=False)
+        assert p.returncode == 1
+        # nor do other offsets read from stdin
+        args_stdin = args[:args.index("--offsetfile")] + args[args.index("--offsetfile") + 2:] + ["--outdir", str(tmp_path / "stdin"), "--resume"]
+        run_offset_dump(args_stdin, input=offsetfile.read_bytes())
+        p = run_offset_dump(args_stdin, input=offsetfile.read_bytes())
+        assert b"resuming" in p.stderr
+        p = run_offset_dump(args_stdin, input=b"20 x\n", check=False)
+        assert p.returncode == 1
+
+    def test_strings_blocks_merge_resume(self, tmp_path):
+        # a merged extent holds several offsets, none of them is redone
+        offsetfile = tmp_path / "offsets.txt"
+        offsetfile.write_text("".join(f"{o} x\n" for o in [20, 50, 60, 330, 340]))
+        args = ["strings", "blocks", "--type", "dec", "--offsetfile", str(offsetfile), "--infile", os.path.join("test", "yes.txt"), "--blocksize", "16", "--before", "1", "--after", "1", "--merge"]
+        run_offset_dump(args + ["--outdir", str(tmp_path / "plain")])
+        expected = {name: (tmp_path / "plain" / name).read_bytes() for name in os.listdir(tmp_path / "plain")}
+        assert sorted(expected) == ["extent_0-80.bin", "extent_304-368.bin"]
+        # the second extent cannot be written, the run stops after the first
+        outdir = tmp_path / "blocks"
+        os.makedirs(outdir / "extent_304-368.bin")
+        p = run_offset_dump(args + ["--outdir", str(outdir), "--resume", "--checkpoint", "0"], check=False)
+        assert p.returncode == 1
+        os.rmdir(outdir / "extent_304-368.bin")
+        run_offset_dump(args + ["--outdir", str(outdir), "--resume"])
+        assert {name: (outdir / name).read_bytes() for name in os.listdir(outdir) if not name.startswith(".")} == expected
+
+    def test_strings_blocks_zero_copy(self, tmp_path):
+        # results of 48 bytes and more are copied from the input, not read into memory
+        offsetfile = tmp_path / "offsets.txt"
+        offsetfile.write_text("".join(f"{o} x\n" for o in [20, 50, 330]))
+        with open(os.path.join("test", "yes.txt"), "rb") as f:
+            data = f.read()
+        expected = data[0:48] + data[32:80] + data[304:352]
+        args = ["strings", "blocks", "--type", "dec", "--offsetfile", str(offsetfile), "--infile", os.path.join("test", "yes.txt"), "--blocksize", "16", "--before", "1", "--after", "1", "--zero-copy", "48"]
+        for extra in [[], ["--no-mmap"], ["--nodupes", "--jobs", "2"]]:
+            p = run_offset_dump(args + extra)
+            assert p.stdout == expected
+        p = run_offset_dump(args + ["--outdir", str(tmp_path / "blocks")])
+        with open(tmp_path / "blocks" / "block_50.bin", "rb") as f:
+            assert f.read() == data[32:80]
+        p = run_offset_dump(args + ["--format", "tar"])
+        with tarfile.open(fileobj=io.BytesIO(p.stdout)) as tar:
+            assert tar.extractfile("block_330.bin").read() == data[304:352]
+        run_offset_dump(args + ["--format", "pack", "--outfile", str(tmp_path / "blocks.pack")])
+        pack = (tmp_path / "blocks.pack").read_bytes()
+        assert pack[:len(expected)] == expected
+
+    def test_yara_lines_server(self, tmp_path):
+        # the same runs through a server as in this process
+        sock = tmp_path / "offset_dump.sock"
+        env = dict(os.environ, OFFSET_DUMP_SOCKET=str(sock))
+        args = ["yara", "lines", "--offsetfile", os.path.join("test", "yara-out_yes.txt"), "--infile", os.path.join("test", "yes.txt")]
+        p_local = run_offset_dump(args, env=env)
+        server = subprocess.Popen(["python3", os.path.join("src", "offset_tools", "server.py"), "--socket", str(sock)], stderr=subprocess.PIPE)
+        try:
+            assert b"listening" in server.stderr.readline()
+            for extra in [[], ["--no-mmap"], ["--no-mmap"]]:
+                p = run_offset_dump(args + extra, env=env)
+                assert p.stdout == p_local.stdout
+            p = run_offset_dump(args + ["--infile", str(tmp_path / "missing")], check=False, env=env)
+            assert p.returncode == 2
+            assert b"FileNotFoundError" in p.stderr
+        finally:
+            server.terminate()
+            server.wait(timeout=5)
+        assert not sock.exists()
+
+    def test_yara_lines_server_private(self, tmp_path):
+        # stdio goes only to a socket in a directory of this user only
+        env = {k: v for k, v in os.environ.items() if k not in ("XDG_RUNTIME_DIR", "OFFSET_DUMP_SOCKET")}
+        env["TMPDIR"] = str(tmp_path)
+        folder = tmp_path / f"offset_dump-{os.getuid()}"
+        args = ["yara", "lines", "--offsetfile", os.path.join("test", "yara-out_yes.txt"), "--infile", os.path.join("test", "yes.txt")]
+        p_local = run_offset_dump(args, env=env)
+        server = subprocess.Popen(["python3", os.path.join("src", "offset_tools", "server.py")], stderr=subprocess.PIPE, env=env)
+        try:
+            assert str(folder).encode() in server.stderr.readline()
+            assert folder.stat().st_mode & 0o777 == 0o700
+            p = run_offset_dump(args, env=env)
+            assert p.stdout == p_local.stdout
+            assert p.stderr == b""
+            folder.chmod(0o755)
+            p = run_offset_dump(args, env=env)
+            assert p.stdout == p_local.stdout
+            assert b"not a socket of this user" in p.stderr
+        finally:
+            server.terminate()
+            server.wait(timeout=5)
+        fake = tmp_path / "fake.sock"
+        fake.write_bytes(b"")
+        env["OFFSET_DUMP_SOCKET"] = str(fake)
+        p = run_offset_dump(args, env=env)
+        assert p.stdout == p_local.stdout
+        assert b"not a socket of this user" in p.stderr
+
+    def test_strings_blocks_dense(self, tmp_path):
+        # hits close enough to merge into extents beyond the default --zero-copy
+        data = bytes(range(256)) * (3 << 12)
+        (tmp_path / "image.img").write_bytes(data)
+        offsetfile = tmp_path / "offsets.txt"
+        offsetfile.write_text("".join(f"{o} x\n" for o in range(0, len(data), 300)))
+        expected = b"".join(data[o // 512 * 512:o // 512 * 512 + 512] for o in range(0, len(data), 300))
+        args = ["strings", "blocks", "--type", "dec", "--offsetfile", str(offsetfile), "--infile", str(tmp_path / "image.img")]
+        for extra in [[], ["--jobs", "2"]]:
+            p = run_offset_dump(args + extra, timeout=20)
+            assert p.stdout == expected
+
+    def test_yara_lines_tar(self):
+        p = run_offset_dump(["yara", "lines", "--offsetfile", os.path.join("test", "yara-out_yes.txt"), "--infile", os.path.join("test", "yes.txt"), "--format", "tar"])
+        assert p.returncode == 0
+        with tarfile.open(fileobj=io.BytesIO(p.stdout)) as tar:
+            assert tar.getnames() == ["line_0x14e.txt", "line_0x213.txt"]
+            assert tar.extractfile("line_0x14e.txt").read() == b'To generate text with the word "yes", you can use various creative methods. \n'
+
+    def test_yara_lines_pack(self, tmp_path):
+        packfile = tmp_path / "lines.pack"
+        p = run_offset_dump(["yara", "lines", "--offsetfile", os.path.join("test", "yara-out_yes.txt"), "--infile", os.path.join("test", "yes.txt"), "--format", "pack", "--outfile", str(packfile)])
+        assert p.returncode == 0
+        data = packfile.read_bytes()
+        magic, idxpos, count = struct.unpack("<8sQQ", data[-24:])
+        assert magic == b"OTPACK01"
+        assert count == 2
+        assert data[:idxpos] == b'To generate text with the word "yes", you can use various creative methods. \nexpress "yes" in English, such as "yep", "sure", or "totally", which can \n'
+
+    def test_yara_lines_jsonl(self, tmp_path):
+        # two rules hit the same line: one extraction, one record per hit
+        offsetfile = tmp_path / "yara.txt"
+        offsetfile.write_text("user_yes test/yes.txt\n0x14e:$user_yes01: yes\n0x213:$user_yes01: yes\nother test/yes.txt\n0x14e:$o1: yes\n")
+        args = ["yara", "lines", "--offsetfile", str(offsetfile), "--infile", os.path.join("test", "yes.txt")]
+        p = run_offset_dump(args + ["--format", "jsonl", "--nodupes"])
+        records = [json.loads(line) for line in p.stdout.splitlines()]
+        assert [(r["offset"], r["rule"], r["string"], r["dup"]) for r in records] == [(0x14e, "user_yes", "$user_yes01", False), (0x14e, "other", "$o1", True), (0x213, "user_yes", "$user_yes01", False)]
+        assert base64.b64decode(records[0]["data"]) == b'To generate text with the word "yes", you can use various creative methods. \n'
+        assert "data" not in records[1] and records[1]["digest"] == records[0]["digest"]
+        p = run_offset_dump(args + ["--format", "records"])
+        stream = io.BytesIO(p.stdout)
+        hits = []
+        while header := stream.read(16):
+            magic, metalen, length = struct.unpack("<4sIQ", header)
+            assert magic == b"OTR1"
+            meta = json.loads(stream.read(metalen))
+            hits.append((meta["rule"], meta["span"], stream.read(length)))
+        assert hits[1] == ("other", [302, 77], base64.b64decode(records[0]["data"]))
+        assert len(hits) == 3
+
+    def test_strings_lines_stats(self, tmp_path):
+        offsetfile = tmp_path / "offsets.txt"
+        offsetfile.write_text("".join(f"{o:x} x\n" for o in [0x14e, 0x150, 0x160, 0x213, 0x215]))
+        args = ["strings", "lines", "--type", "hex", "--offsetfile", str(offsetfile), "--infile", os.path.join("test", "yes.txt"), "--nodupes"]
+        p_plain = run_offset_dump(args)
+        p_stats = run_offset_dump(args + ["--stats"])
+        assert p_plain.stdout == p_stats.stdout
+        assert b"stats: 5 offsets" in p_stats.stderr
+        statsfile = tmp_path / "stats.json"
+        run_offset_dump(args + ["--stats", str(statsfile)])
+        summary = json.loads(statsfile.read_text())
+        assert summary["offsets"] == 5
+        assert summary["counters"]["dup_spans"] == 3
+        assert summary["counters"]["written"] == 2
+        assert summary["counters"]["bytes_written"] == len(p_plain.stdout)
+
+    def test_scan_lines(self, tmp_path):
+        p_yara = run_offset_dump(["yara", "lines", "--offsetfile", os.path.join("test", "yara-out_yes.txt"), "--infile", os.path.join("test", "yes.txt")])
+        p_scan = run_offset_dump(["scan", "lines", "--pattern", "YES", "--nocase", "--infile", os.path.join("test", "yes.txt")])
+        assert p_yara.stdout == p_scan.stdout
+        p_regex = run_offset_dump(["scan", "lines", "--pattern", "[\"]ye[s]", "--regex", "--no-mmap", "--infile", os.path.join("test", "yes.txt")])
+        assert p_yara.stdout == p_regex.stdout
+        # utf-16le text, matched with --wide only
+        (tmp_path / "wide.txt").write_bytes("no\nsay yes\nno\n".encode("utf-16le"))
+        p_wide = run_offset_dump(["scan", "blocks", "--pattern", "yes", "--wide", "--blocksize", "8", "--infile", str(tmp_path / "wide.txt"), "--outdir", str(tmp_path / "out")])
+        assert p_wide.returncode == 0
+        assert os.listdir(tmp_path / "out") == ["block_0xe.bin"]
+
+    def test_strings_lines_stream(self, tmp_path):
+        offsets = "".join(f"{o:x} x\n" for o in [0x213, 0x14e, 0x160, 0x14e, 0x215]).encode()
+        args = ["strings", "lines", "--type", "hex", "--infile", os.path.join("test", "yes.txt")]
+        p_plain = run_offset_dump(args, input=offsets)
+        p_stream = run_offset_dump(args + ["--stream"], input=offsets)
+        assert p_plain.stdout == p_stream.stdout
+        # window 1: 0x14e (twice) and 0x160 arrive late and are extracted last
+        p_late = run_offset_dump(args + ["--stream", "1", "--outdir", str(tmp_path / "late")], input=offsets)
+        assert b"3 offsets arrived too late" in p_late.stderr
+        assert sorted(os.listdir(tmp_path / "late")) == ["line_0x14e.txt", "line_0x160.txt", "line_0x213.txt", "line_0x215.txt"]
+
     def test_yara_blocks(self):
         if (os.path.exists("blocks") and os.path.isdir("blocks")):
             shutil.rmtree("blocks")
@@ -145,3 +572,24 @@ class Test_offset_dump(object):
         with open(os.path.join("blocks", "block_20215936.bin"), 'rb') as f:
             assert b']oYes\xe5YP9\r\xa0h\x12^B\xa5\xff\xde~\xc5\xb2z@\xc7\xbc7Ox\x9a\xba^\x99' in f.read()
         shutil.rmtree("blocks")
+
+
+class Test_api(object):
+    # in-process use of the library
+    def test_extract(self):
+        sys.path.insert(0, "src")
+        from offset_tools import extract
+        path = os.path.join("test", "yes.txt")
+        with open(path, "rb") as f:
+            data = f.read()
+        expected = [
+            (0x14e, (302, 77), b'To generate text with the word "yes", you can use various creative methods. \n'),
+            (0x213, (522, 74), b'express "yes" in English, such as "yep", "sure", or "totally", which can \n'),
+        ]
+        assert list(extract(path, [0x213, 0x14e, 0x213])) == expected
+        with open(path, "rb") as f:
+            assert list(extract(f, [0x14e, 0x213], nodupes=True)) == expected
+        assert list(extract(data, [0x14e, 0x213], jobs=2)) == expected
+        assert list(extract(memoryview(data), [0x213], "blocks", blocksize=16)) == [(0x213, (528, 16), data[528:544])]
+        with pytest.raises(ValueError):
+            extract(path, [0x14e], "lines", merge=True)